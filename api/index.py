@@ -1 +1,6 @@
+import os
+
+# Serverless: one connection per instance rather than a pool (see app/database.py).
+os.environ.setdefault("DB_MODE", "single")
+
 from app.main import app
@@ -0,0 +1,106 @@
+"""Admission control lanes for endpoint classes.
+
+Each lane is a semaphore with a bounded wait queue. Bulk endpoints
+(`/subjects/data`, `/cones/export`) run in a small lane so they can never
+hold more than a couple of pool connections; interactive endpoints get
+their own lane and therefore always find capacity. A request that would
+overflow a lane's queue, or waits longer than its limit, gets a 429 with
+Retry-After instead of piling up behind the semaphore.
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException
+
+from app.config import settings
+from app.instrumentation import stage
+
+
+class Ticket:
+    """A held lane slot. `release()` is idempotent so streaming paths can call it twice."""
+
+    def __init__(self, lane: "Lane"):
+        self._lane = lane
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._lane._release()
+
+
+class Lane:
+    def __init__(self, name: str, limit: int, max_queue: int, max_wait: float):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._sem = asyncio.Semaphore(limit)
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def _reject(self):
+        self.rejected += 1
+        raise HTTPException(
+            status_code=429,
+            detail=f"Too many concurrent {self.name} requests, retry shortly",
+            headers={"Retry-After": str(max(1, round(self.max_wait)))},
+        )
+
+    async def acquire(self) -> Ticket:
+        if not self._sem.locked():
+            # Free slot: Semaphore.acquire() returns without yielding.
+            await self._sem.acquire()
+        else:
+            if self.waiting >= self.max_queue:
+                self._reject()
+            self.waiting += 1
+            started = time.perf_counter()
+            try:
+                with stage("queue"):
+                    await asyncio.wait_for(self._sem.acquire(), timeout=self.max_wait)
+            except asyncio.TimeoutError:
+                self._reject()
+            finally:
+                self.waiting -= 1
+            waited = time.perf_counter() - started
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        self.admitted += 1
+        self.active += 1
+        return Ticket(self)
+
+    def _release(self):
+        self.active -= 1
+        self._sem.release()
+
+    @asynccontextmanager
+    async def admit(self):
+        ticket = await self.acquire()
+        try:
+            yield
+        finally:
+            ticket.release()
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "queued": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "wait_seconds_total": round(self.wait_seconds_total, 6),
+            "wait_seconds_max": round(self.wait_seconds_max, 6),
+        }
+
+
+bulk = Lane("bulk", settings.bulk_concurrency, settings.bulk_queue, settings.bulk_max_wait_seconds)
+interactive = Lane(
+    "interactive", settings.interactive_concurrency,
+    settings.interactive_queue, settings.interactive_max_wait_seconds,
+)
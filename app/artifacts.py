@@ -0,0 +1,243 @@
+"""Static, content-hashed export of the read-only UI data for CDN serving.
+
+Everything the viewer reads changes only when an admin uploads, so it can
+be written out once and served as plain files:
+
+    <out>/manifest.json          index of everything below; short cache
+    <out>/data/<kind>-<hash>.json          immutable; cache forever
+    <out>/data/<kind>-<hash>.json.gz / .br precompressed variants
+
+Kinds:
+
+    patients  the /patients list
+    ranges    /eccentricity-ranges of one (subject, eye, meridian)
+    block     one eccentricity range: "plot" is /plot-data for every cone
+              type (sorted by x, no limit) and "metadata" is /metadata
+              without a type filter, plus "type_counts" so a client can
+              total any selection of types itself
+
+`<hash>` is the first HASH_CHARS hex digits of the SHA-256 of the JSON
+body, so an unchanged block keeps its URL across exports and stays cached.
+The manifest maps subject -> eye -> meridian to the ranges file and each
+range's block file. Eye "*" is the view without an eye filter; for a
+one-eye subject its files are the same as that eye's.
+
+Values come from the columnar store (app/columnar.py), so they match the
+API's columnar answers. An export is written with
+
+    DATABASE_URL=... python -m app.artifacts --out DIR [--subject ID ...]
+
+and, with STATIC_EXPORT_DIR set, after every admin upload for the subjects
+it touched. A partial export keeps the other subjects' manifest entries.
+Files referenced by neither the new nor the previous manifest are deleted,
+so pages loaded before an export can still fetch their blocks.
+
+Builds (upload hooks in several workers, the CLI) take an flock on
+`<out>/.lock`, so each reads the manifest the previous one wrote and no
+prune deletes files another build is still writing. The manifest only
+moves forward: a build from a store older than it is skipped.
+"""
+import argparse
+import asyncio
+import fcntl
+import gzip
+import hashlib
+import json
+import os
+import time
+from typing import Iterable, Optional
+
+import asyncpg
+import brotli
+import numpy as np
+
+from app.columnar import ColumnStore, load_store
+from app.filters import FilterSpec, eccentricity_ranges
+from app.responses import dumps
+
+MANIFEST = "manifest.json"
+DATA_DIR = "data"
+HASH_CHARS = 16
+ANY_EYE = "*"
+# Exports are built rarely and served many times: compress hard.
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+# Stats of the latest build in this process, for /stats.
+last_run: Optional[dict] = None
+
+
+def _write(path: str, data: bytes):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class Export:
+    """Writes hashed files into <root>/data and records their names."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.data = os.path.join(root, DATA_DIR)
+        self.written = 0
+        self.reused = 0
+        os.makedirs(self.data, exist_ok=True)
+
+    def put(self, kind: str, content) -> str:
+        body = dumps(content)
+        name = f"{kind}-{hashlib.sha256(body).hexdigest()[:HASH_CHARS]}.json"
+        path = os.path.join(self.data, name)
+        if os.path.exists(path):
+            self.reused += 1
+        else:
+            # Variants first: a name that exists always has its .gz and .br.
+            _write(f"{path}.gz", gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0))
+            _write(f"{path}.br", brotli.compress(body, quality=BROTLI_QUALITY))
+            _write(path, body)
+            self.written += 1
+        return f"{DATA_DIR}/{name}"
+
+
+def _distinct(store: ColumnStore, col: str, idx: np.ndarray) -> list[str]:
+    codes = np.unique(store.columns[col][idx])
+    return [store.dictionaries[col][c] for c in codes.tolist() if c >= 0]
+
+
+def block(store: ColumnStore, spec: FilterSpec) -> dict:
+    mask = store.mask(spec)
+    metadata = store.metadata(mask)
+    types = store.columns["cone_spectral_type"][store._distinct_cones(np.flatnonzero(mask))]
+    codes, counts = np.unique(types, return_counts=True)
+    labels = store.dictionaries["cone_spectral_type"]
+    return {
+        "plot": store.plot_data(mask, store.size),
+        "metadata": metadata,
+        "type_counts": {labels[c]: int(n) for c, n in zip(codes.tolist(), counts.tolist()) if c >= 0},
+    }
+
+
+def subject_entries(store: ColumnStore, export: Export, subject_id: str) -> dict:
+    """{eye: {meridian: {"ranges": file, "blocks": [{min, max, label, file}]}}} of one subject."""
+    rows = np.flatnonzero(store.mask(FilterSpec.build(subject_id=subject_id)))
+    eyes = sorted({e.upper() for e in _distinct(store, "eye", rows)})
+    out: dict[str, dict] = {}
+    for eye in [*eyes, ANY_EYE]:
+        spec = FilterSpec.build(subject_id=subject_id, eye=None if eye == ANY_EYE else eye)
+        eye_rows = np.flatnonzero(store.mask(spec))
+        meridians = sorted({m.lower() for m in _distinct(store, "meridian", eye_rows)})
+        for meridian in meridians:
+            spec = FilterSpec.build(subject_id=spec.subject_id, eye=spec.eye, meridian=meridian)
+            ranges = eccentricity_ranges(store.eccentricities(store.mask(spec)))
+            blocks = []
+            for r in ranges:
+                window = FilterSpec.build(subject_id=spec.subject_id, eye=spec.eye, meridian=meridian,
+                                          eccentricity_min=r["min"], eccentricity_max=r["max"])
+                blocks.append({**r, "file": export.put("block", block(store, window))})
+            out.setdefault(eye, {})[meridian] = {
+                "ranges": export.put("ranges", {"ranges": ranges}),
+                "blocks": blocks,
+            }
+    return out
+
+
+def read_manifest(root: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(root, MANIFEST), "rb") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _files(manifest: Optional[dict]) -> set[str]:
+    if not manifest:
+        return set()
+    files = {manifest["patients"]}
+    for eyes in manifest["subjects"].values():
+        for meridians in eyes.values():
+            for entry in meridians.values():
+                files.add(entry["ranges"])
+                files.update(b["file"] for b in entry["blocks"])
+    return files
+
+
+def _prune(root: str, keep: set[str]) -> int:
+    removed = 0
+    data = os.path.join(root, DATA_DIR)
+    for name in os.listdir(data):
+        base = name.removesuffix(".gz").removesuffix(".br")
+        if f"{DATA_DIR}/{base}" not in keep and not name.endswith(".tmp"):
+            os.remove(os.path.join(data, name))
+            removed += 1
+    return removed
+
+
+def build(store: ColumnStore, root: str, subjects: Optional[Iterable[str]] = None) -> dict:
+    """Export `subjects` (default: all) and rewrite the manifest; returns run stats."""
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return _build(store, root, subjects)
+
+
+def _build(store: ColumnStore, root: str, subjects: Optional[Iterable[str]]) -> dict:
+    global last_run
+    start = time.perf_counter()
+    previous = read_manifest(root)
+    if previous is not None and previous["version"] > store.version:
+        return {"version": store.version, "subjects": 0, "written": 0, "reused": 0, "removed": 0,
+                "seconds": round(time.perf_counter() - start, 3), "skipped": True}
+    export = Export(root)
+    present = _distinct(store, "subject_id", np.arange(store.size))
+    if subjects is None or previous is None:
+        todo, entries = present, {}
+    else:
+        todo = [s for s in present if s in set(subjects)]
+        # Keep untouched subjects that still exist; drop those an upload removed.
+        entries = {s: e for s, e in previous["subjects"].items() if s in present and s not in todo}
+    for subject_id in todo:
+        entries[subject_id] = subject_entries(store, export, subject_id)
+
+    manifest = {
+        "version": store.version,
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "patients": export.put("patients", store.patients()),
+        "subjects": dict(sorted(entries.items())),
+    }
+    _write(os.path.join(root, MANIFEST), json.dumps(manifest, indent=1).encode())
+    removed = _prune(root, _files(manifest) | _files(previous))
+    last_run = {
+        "version": store.version,
+        "subjects": len(todo),
+        "written": export.written,
+        "reused": export.reused,
+        "removed": removed,
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+    return last_run
+
+
+async def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Export the UI data as static content-hashed files.")
+    parser.add_argument("--out", required=True, help="Output directory (manifest.json goes here).")
+    parser.add_argument("--subject", action="append",
+                        help="Only re-export this subject (repeatable); others keep their entries.")
+    args = parser.parse_args(argv)
+
+    database_url = os.environ.get("DATABASE_URL")
+    if not database_url:
+        raise SystemExit("DATABASE_URL is required")
+
+    conn = await asyncpg.connect(database_url, statement_cache_size=0)
+    try:
+        store = await load_store(conn)
+    finally:
+        await conn.close()
+    stats = build(store, args.out, args.subject)
+    print(f"v{stats['version']}: {stats['subjects']} subjects, {stats['written']} files written, "
+          f"{stats['reused']} unchanged, {stats['removed']} removed in {stats['seconds']}s")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(main()))
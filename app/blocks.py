@@ -0,0 +1,108 @@
+"""Per-block spatial index and the version-keyed cache behind the block analytics.
+
+A block is one (subject, eye, meridian, eccentricity) patch. Its index —
+the de-duplicated coordinates plus one cKDTree for the whole mosaic and one
+per cone-type submosaic — is built once and kept in an LRU cache. Finished
+reports (/spacing, /density) are cached next to it as encoded Payloads,
+keyed by the block and a per-endpoint variant tuple. Everything is keyed by
+the dataset version (the latest upload_log id), so any ingest invalidates
+the lot and a repeat query never sees stale cones.
+"""
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from app.responses import Payload
+
+CONE_TYPES = ("L", "M", "S")
+# Blocks whose index / reports are kept; a block index is a few hundred KB at most.
+MAX_BLOCKS = 128
+MAX_REPORTS = 512
+# Fewer cones than this in a (sub)mosaic gives no meaningful statistics.
+MIN_CONES = 4
+
+BlockKey = tuple[str, str, str, float]
+
+
+class BlockIndex:
+    """De-duplicated cone positions of one block with a KD-tree per mosaic."""
+
+    def __init__(self, x: np.ndarray, y: np.ndarray, types: np.ndarray, eccentricity_deg: float):
+        self.eccentricity_deg = eccentricity_deg
+        points = np.column_stack([x, y])
+        keep = ~np.isnan(points).any(axis=1)
+        points, types = points[keep], types[keep]
+        # Re-uploaded or double-marked cones would give zero-length neighbours.
+        _, first = np.unique(points, axis=0, return_index=True)
+        first.sort()
+        self.duplicates = int(len(points) - len(first))
+        self.points = points[first]
+        self.types = types[first]
+        self.lo = self.points.min(axis=0) if len(self.points) else np.zeros(2)
+        self.hi = self.points.max(axis=0) if len(self.points) else np.zeros(2)
+
+        self.subsets = {"all": np.arange(len(self.points))}
+        for t in CONE_TYPES:
+            self.subsets[t] = np.flatnonzero(self.types == t)
+        self.trees = {
+            name: cKDTree(self.points[idx])
+            for name, idx in self.subsets.items() if len(idx) >= MIN_CONES
+        }
+
+    def bounds(self) -> dict:
+        return {"x": [float(self.lo[0]), float(self.hi[0])],
+                "y": [float(self.lo[1]), float(self.hi[1])]}
+
+
+class BlockCache:
+    """Block indexes and encoded reports for one dataset version."""
+
+    def __init__(self):
+        self.version: Optional[int] = None
+        self.indexes: OrderedDict[BlockKey, BlockIndex] = OrderedDict()
+        self.reports: OrderedDict[tuple, Payload] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _check(self, version: int):
+        if version != self.version:
+            self.version = version
+            self.indexes.clear()
+            self.reports.clear()
+
+    def report(self, version: int, key: BlockKey, variant: Hashable) -> Optional[Payload]:
+        self._check(version)
+        payload = self.reports.get((key, variant))
+        if payload is not None:
+            self.reports.move_to_end((key, variant))
+            self.hits += 1
+        return payload
+
+    def index(self, version: int, key: BlockKey) -> Optional[BlockIndex]:
+        self._check(version)
+        index = self.indexes.get(key)
+        if index is not None:
+            self.indexes.move_to_end(key)
+        return index
+
+    def store_index(self, version: int, key: BlockKey, index: BlockIndex):
+        self._check(version)
+        self.indexes[key] = index
+        while len(self.indexes) > MAX_BLOCKS:
+            self.indexes.popitem(last=False)
+
+    def store_report(self, version: int, key: BlockKey, variant: Hashable, payload: Payload):
+        self._check(version)
+        self.misses += 1
+        self.reports[(key, variant)] = payload
+        while len(self.reports) > MAX_REPORTS:
+            self.reports.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {"version": self.version, "blocks": len(self.indexes), "reports": len(self.reports),
+                "hits": self.hits, "misses": self.misses}
+
+
+cache = BlockCache()
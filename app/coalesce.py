@@ -0,0 +1,43 @@
+"""Single-flight coalescing for identical concurrent read queries.
+
+When several requests with the same normalized filters arrive while one is
+already running, they all await that one in-flight call instead of each
+taking a pool connection and computing the same result. Nothing is cached:
+once the call finishes, the next request with that key starts a new one.
+"""
+import asyncio
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    def __init__(self):
+        self._inflight: dict[Hashable, asyncio.Task] = {}
+        self.executed = 0
+        self.deduplicated = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        task = self._inflight.get(key)
+        if task is None:
+            self.executed += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.deduplicated += 1
+        # shield: one caller disconnecting must not cancel the query for the others.
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # mark retrieved even if every waiter went away
+
+    def stats(self) -> dict:
+        return {
+            "executed": self.executed,
+            "deduplicated": self.deduplicated,
+            "in_flight": len(self._inflight),
+        }
@@ -0,0 +1,240 @@
+"""Cohort normative curves: density, L/M ratio and % S-cones versus eccentricity.
+
+cohort_aggregates keeps running sums per (meridian, eccentricity bin, age
+bin): for each metric the number of blocks with a value, their sum and
+their sum of squares. A block (one subject / eye / meridian / eccentricity
+patch) contributes once, using its stated metadata:
+
+    density   lcone_density + mcone_density + scone_density (cones/mm²)
+    lm_ratio  "L/M ratio"
+    scones    "% S-cones"
+
+An upload replaces whole (subject, eye) pairs, so `_ingest` subtracts the
+old blocks' contribution and adds the new one inside the same transaction
+as the cone_data rewrite; the cost is O(blocks in the upload), never a scan
+of the cohort. Means and SDs come straight from the sums, so /cohort is
+O(bins).
+
+Bin edges are part of the stored keys: after changing ECC_EDGES or
+AGE_BIN_YEARS, or after loading data outside `_ingest`, rebuild with
+
+    DATABASE_URL=... python -m app.cohort
+"""
+import asyncio
+import math
+import os
+from bisect import bisect_right
+from typing import Iterable, Optional
+
+import asyncpg
+
+# Lower edges of the eccentricity bins (deg); the last bin is open-ended.
+ECC_EDGES = (0.0, 0.25, 0.5, 0.75, 1.0, 1.25, 1.5, 2.0, 2.5, 3.0, 4.0, 5.0, 6.0, 8.0, 10.0, 12.0, 15.0, 20.0)
+AGE_BIN_YEARS = 10
+METRICS = ("density", "lm_ratio", "scones")
+UNKNOWN_AGE_BIN = -1
+
+# One row per block of the given (subject_id, eye) pairs, as stored in cone_data.
+BLOCKS_SQL = """
+    SELECT DISTINCT ON (subject_id, eye, meridian, eccentricity_deg)
+           subject_id, eye, meridian, eccentricity_deg, age,
+           lcone_density + mcone_density + scone_density AS density, lm_ratio, scones
+    FROM cone_data
+    WHERE (subject_id, eye) IN (SELECT s, e FROM unnest($1::text[], $2::text[]) AS t(s, e))
+      AND meridian IS NOT NULL AND eccentricity_deg IS NOT NULL
+    ORDER BY subject_id, eye, meridian, eccentricity_deg, id
+"""
+ALL_BLOCKS_SQL = """
+    SELECT DISTINCT ON (subject_id, eye, meridian, eccentricity_deg)
+           subject_id, eye, meridian, eccentricity_deg, age,
+           lcone_density + mcone_density + scone_density AS density, lm_ratio, scones
+    FROM cone_data
+    WHERE meridian IS NOT NULL AND eccentricity_deg IS NOT NULL
+    ORDER BY subject_id, eye, meridian, eccentricity_deg, id
+"""
+SUBJECT_BLOCKS_SQL = """
+    SELECT DISTINCT ON (eye, meridian, eccentricity_deg)
+           subject_id, eye, meridian, eccentricity_deg, age,
+           lcone_density + mcone_density + scone_density AS density, lm_ratio, scones
+    FROM cone_data
+    WHERE subject_id = $1 AND meridian IS NOT NULL AND eccentricity_deg IS NOT NULL
+    ORDER BY eye, meridian, eccentricity_deg, id
+"""
+# Sums over the selected age bins; $1 meridian (NULL = all), $2/$3 age-bin range (NULL = any).
+CURVES_SQL = """
+    SELECT meridian, ecc_bin, {age} AS age_bin, SUM(n_blocks) AS n_blocks,
+           SUM(density_n) AS density_n, SUM(density_sum) AS density_sum,
+           SUM(density_sumsq) AS density_sumsq,
+           SUM(lm_ratio_n) AS lm_ratio_n, SUM(lm_ratio_sum) AS lm_ratio_sum,
+           SUM(lm_ratio_sumsq) AS lm_ratio_sumsq,
+           SUM(scones_n) AS scones_n, SUM(scones_sum) AS scones_sum,
+           SUM(scones_sumsq) AS scones_sumsq
+    FROM cohort_aggregates
+    WHERE ($1::text IS NULL OR meridian = $1)
+      AND ($2::int IS NULL OR age_bin >= $2)
+      AND ($3::int IS NULL OR (age_bin <= $3 AND age_bin <> {unknown}))
+    GROUP BY meridian, ecc_bin{group}
+    ORDER BY meridian, ecc_bin{group}
+"""
+APPLY_SQL = """
+    INSERT INTO cohort_aggregates (
+        meridian, ecc_bin, age_bin, n_blocks,
+        density_n, density_sum, density_sumsq,
+        lm_ratio_n, lm_ratio_sum, lm_ratio_sumsq,
+        scones_n, scones_sum, scones_sumsq
+    ) VALUES ($1,$2,$3,$4,$5,$6,$7,$8,$9,$10,$11,$12,$13)
+    ON CONFLICT (meridian, ecc_bin, age_bin) DO UPDATE SET
+        n_blocks = cohort_aggregates.n_blocks + EXCLUDED.n_blocks,
+        density_n = cohort_aggregates.density_n + EXCLUDED.density_n,
+        density_sum = cohort_aggregates.density_sum + EXCLUDED.density_sum,
+        density_sumsq = cohort_aggregates.density_sumsq + EXCLUDED.density_sumsq,
+        lm_ratio_n = cohort_aggregates.lm_ratio_n + EXCLUDED.lm_ratio_n,
+        lm_ratio_sum = cohort_aggregates.lm_ratio_sum + EXCLUDED.lm_ratio_sum,
+        lm_ratio_sumsq = cohort_aggregates.lm_ratio_sumsq + EXCLUDED.lm_ratio_sumsq,
+        scones_n = cohort_aggregates.scones_n + EXCLUDED.scones_n,
+        scones_sum = cohort_aggregates.scones_sum + EXCLUDED.scones_sum,
+        scones_sumsq = cohort_aggregates.scones_sumsq + EXCLUDED.scones_sumsq
+"""
+
+
+def ecc_bin(ecc: float) -> int:
+    return max(bisect_right(ECC_EDGES, ecc) - 1, 0)
+
+
+def ecc_range(b: int) -> list[Optional[float]]:
+    return [ECC_EDGES[b], ECC_EDGES[b + 1] if b + 1 < len(ECC_EDGES) else None]
+
+
+def age_bin(age: Optional[float]) -> int:
+    if age is None or age != age:
+        return UNKNOWN_AGE_BIN
+    return int(age // AGE_BIN_YEARS) * AGE_BIN_YEARS
+
+
+def _density(l, m, s) -> Optional[float]:
+    return None if None in (l, m, s) else l + m + s
+
+
+def blocks_from_rows(rows: Iterable[tuple]) -> list[dict]:
+    """One dict per block of to_row() tuples (see csv_parser.to_row for positions)."""
+    seen = {}
+    for r in rows:
+        key = (r[3], r[4], r[5], r[6])
+        if key in seen or r[5] is None or r[6] is None:
+            continue
+        seen[key] = {"meridian": r[5], "eccentricity_deg": r[6], "age": r[15],
+                     "density": _density(r[10], r[11], r[12]), "lm_ratio": r[8], "scones": r[9]}
+    return list(seen.values())
+
+
+def deltas(blocks: Iterable, sign: int = 1) -> dict[tuple, list[float]]:
+    """(meridian, ecc_bin, age_bin) -> [n_blocks, n, sum, sumsq per metric], times `sign`."""
+    out: dict[tuple, list[float]] = {}
+    for b in blocks:
+        key = (b["meridian"].lower(), ecc_bin(b["eccentricity_deg"]), age_bin(b["age"]))
+        acc = out.setdefault(key, [0.0] * (1 + 3 * len(METRICS)))
+        acc[0] += sign
+        for i, metric in enumerate(METRICS):
+            v = b[metric]
+            if v is None or v != v:
+                continue
+            acc[1 + 3 * i] += sign
+            acc[2 + 3 * i] += sign * v
+            acc[3 + 3 * i] += sign * v * v
+    return out
+
+
+def _merge(*parts: dict) -> dict:
+    out: dict[tuple, list[float]] = {}
+    for part in parts:
+        for key, acc in part.items():
+            cur = out.setdefault(key, [0.0] * len(acc))
+            for i, v in enumerate(acc):
+                cur[i] += v
+    return out
+
+
+async def apply(conn, *parts: dict):
+    """Add the summed deltas to cohort_aggregates and drop bins left empty."""
+    merged = _merge(*parts)
+    rows = [(*key, int(acc[0]), *(int(v) if i % 3 == 0 else v for i, v in enumerate(acc[1:])))
+            for key, acc in merged.items() if any(acc)]
+    if rows:
+        await conn.executemany(APPLY_SQL, rows)
+        await conn.execute("DELETE FROM cohort_aggregates WHERE n_blocks <= 0")
+
+
+def summary(n: int, total: float, sumsq: float) -> dict:
+    if n <= 0:
+        return {"n": 0, "mean": None, "sd": None}
+    mean = total / n
+    # Clamp: subtracting contributions can leave -1e-12 instead of 0.
+    var = max(sumsq - n * mean * mean, 0.0) / (n - 1) if n > 1 else None
+    return {"n": n, "mean": mean, "sd": math.sqrt(var) if var is not None else None}
+
+
+def curves_sql(by_age: bool) -> str:
+    if by_age:
+        return CURVES_SQL.format(age="age_bin", group=", age_bin", unknown=UNKNOWN_AGE_BIN)
+    return CURVES_SQL.format(age="NULL::int", group="", unknown=UNKNOWN_AGE_BIN)
+
+
+def curves(rows) -> dict:
+    """{meridian: [bin, ...]} with n / mean / sd per metric, from CURVES_SQL rows."""
+    out: dict[str, list] = {}
+    for r in rows:
+        entry = {"ecc_bin": r["ecc_bin"], "eccentricity_deg": ecc_range(r["ecc_bin"])}
+        if r["age_bin"] is not None:
+            entry["age_bin"] = r["age_bin"]
+        entry["n_blocks"] = int(r["n_blocks"])
+        for metric in METRICS:
+            entry[metric] = summary(int(r[f"{metric}_n"]), r[f"{metric}_sum"], r[f"{metric}_sumsq"])
+        out.setdefault(r["meridian"], []).append(entry)
+    return out
+
+
+def compare(blocks, cohort_curves: dict) -> list[dict]:
+    """A subject's blocks with a z-score per metric against the matching cohort bin."""
+    lookup = {(m, e["ecc_bin"]): e for m, entries in cohort_curves.items()
+              for e in entries if "age_bin" not in e}
+    out = []
+    for b in blocks:
+        meridian = b["meridian"].lower()
+        ref = lookup.get((meridian, ecc_bin(b["eccentricity_deg"])))
+        entry = {"eye": b["eye"], "meridian": meridian, "eccentricity_deg": b["eccentricity_deg"],
+                 "ecc_bin": ecc_bin(b["eccentricity_deg"])}
+        for metric in METRICS:
+            v = b[metric]
+            stats = ref[metric] if ref else None
+            z = None
+            if v is not None and stats and stats["sd"]:
+                z = (v - stats["mean"]) / stats["sd"]
+            entry[metric] = {"value": v, "z": z}
+        out.append(entry)
+    return out
+
+
+async def rebuild(conn):
+    """Recompute cohort_aggregates from every block in cone_data."""
+    blocks = await conn.fetch(ALL_BLOCKS_SQL)
+    async with conn.transaction():
+        await conn.execute("DELETE FROM cohort_aggregates")
+        await apply(conn, deltas(blocks))
+    return len(blocks)
+
+
+async def main():
+    database_url = os.environ.get("DATABASE_URL")
+    if not database_url:
+        raise RuntimeError("DATABASE_URL environment variable is not set")
+    conn = await asyncpg.connect(database_url, statement_cache_size=0)
+    try:
+        n = await rebuild(conn)
+        bins = await conn.fetchval("SELECT COUNT(*) FROM cohort_aggregates")
+        print(f"cohort_aggregates rebuilt from {n} blocks into {bins} bins")
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
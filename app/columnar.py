@@ -0,0 +1,390 @@
+"""Read-only in-memory columnar copy of cone_data.
+
+Postgres stays the system of record and the only write path. When
+`COLUMNAR_ENGINE=true`, the whole table is pulled into NumPy arrays at
+startup (and again after every ingest commit) so the hot read endpoints can
+answer with vectorized boolean masks instead of a network round-trip.
+
+Only the worker that ran an ingest refreshes right away. The others catch up
+by following SNAPSHOT_DIR's CURRENT pointer (app/snapshot.py) every
+SNAPSHOT_POLL_INTERVAL seconds or, without it, by polling the dataset
+version every VERSION_POLL_INTERVAL seconds. Both polls run as background
+tasks with their disk reads in a thread, so a read never waits on either.
+
+Text columns are dictionary-encoded: each one is stored as an int32 code
+array plus a small array of distinct values, so filtering on subject, eye,
+meridian or cone type is an integer comparison. NULLs are code -1 for text
+and NaN for numeric columns.
+"""
+import asyncio
+import logging
+from typing import Optional, Sequence
+
+import numpy as np
+
+from app.config import settings
+from app.filters import FilterSpec
+
+
+TEXT_COLS = ("cone_spectral_type", "subject_id", "eye", "meridian", "fov", "cone_origin")
+FLOAT_COLS = (
+    "cone_x_microns", "cone_y_microns", "eccentricity_deg", "eccentricity_mm",
+    "lm_ratio", "scones", "lcone_density", "mcone_density", "scone_density",
+    "age", "ret_mag_factor", "zernike_pupil_diam", "zernike_measure_wave",
+    "zernike_optim_wave", "eccentricity_x_deg", "eccentricity_y_deg", "eccentricity_x_mm",
+    "eccentricity_y_mm", "retinal_x_mm", "retinal_y_mm",
+)
+# Nullable INTEGER columns are held as float64 so NULL can be NaN.
+INT_COLS = ("numcones", "nonclass_cones")
+
+# Column order of `SELECT * FROM cone_data` (see app/create_schema.py).
+CONE_COLUMNS = (
+    "id", "cone_x_microns", "cone_y_microns", "cone_spectral_type",
+    "subject_id", "eye", "meridian", "eccentricity_deg", "eccentricity_mm",
+    "lm_ratio", "scones", "lcone_density", "mcone_density", "scone_density",
+    "numcones", "nonclass_cones", "age", "fov", "ret_mag_factor",
+    "cone_origin", "zernike_pupil_diam", "zernike_measure_wave", "zernike_optim_wave",
+    "eccentricity_x_deg", "eccentricity_y_deg", "eccentricity_x_mm", "eccentricity_y_mm",
+    "retinal_x_mm", "retinal_y_mm",
+)
+
+META_COLS = ("fov", "lm_ratio", "scones", "lcone_density", "mcone_density",
+             "scone_density", "numcones", "eye")
+
+EYE_DESCRIPTIONS = {"OD": "Right Eye", "OS": "Left Eye"}
+
+# The dataset version is the id of the latest ingest recorded in upload_log.
+VERSION_SQL = "SELECT COALESCE(MAX(id), 0) FROM upload_log"
+
+
+def _encode(values: list) -> tuple[np.ndarray, np.ndarray]:
+    """Dictionary-encode a list of optional strings into (codes, dictionary)."""
+    dictionary = sorted({v for v in values if v is not None})
+    lookup = {v: i for i, v in enumerate(dictionary)}
+    codes = np.fromiter((lookup.get(v, -1) if v is not None else -1 for v in values),
+                        dtype=np.int32, count=len(values))
+    return codes, np.array(dictionary, dtype=object)
+
+
+def _floats(values: list) -> np.ndarray:
+    # NumPy reads None as NaN for a float dtype.
+    return np.array(values, dtype=np.float64)
+
+
+def _to_json(arr: np.ndarray) -> list:
+    """float64 array -> list with NaN mapped to None (SQL NULL)."""
+    out = arr.tolist()
+    if np.isnan(arr).any():
+        out = [None if v != v else v for v in out]
+    return out
+
+
+def _to_json_int(arr: np.ndarray) -> list:
+    return [None if v != v else int(v) for v in arr.tolist()]
+
+
+def _same(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Elementwise equality where NaN == NaN, matching SQL DISTINCT."""
+    return (a == b) | (np.isnan(a) & np.isnan(b))
+
+
+class ColumnStore:
+    """Immutable column arrays for one snapshot of cone_data."""
+
+    def __init__(self, columns: dict[str, np.ndarray], dictionaries: dict[str, np.ndarray], version: int):
+        self.columns = columns
+        self.dictionaries = dictionaries
+        self.version = version
+        self.size = len(columns["id"])
+
+    @classmethod
+    def from_records(cls, records, version: int, duplicates: Sequence[int] = ()) -> "ColumnStore":
+        """Build from CONE_COLUMNS records; CPU-bound, so callers on the event loop use a thread."""
+        columns: dict[str, np.ndarray] = {}
+        dictionaries: dict[str, np.ndarray] = {}
+        # Records are CONE_COLUMNS tuples: take each column by position, then convert it whole.
+        values = {col: [r[i] for r in records] for i, col in enumerate(CONE_COLUMNS)}
+        columns["id"] = np.array(values["id"], dtype=np.int64)
+        for col in TEXT_COLS:
+            columns[col], dictionaries[col] = _encode(values[col])
+        for col in FLOAT_COLS + INT_COLS:
+            columns[col] = _floats(values[col])
+        # Rows that repeat a cone imaged by a neighbouring block (cone_overlap, app/overlap.py).
+        columns["overlap_duplicate"] = np.isin(columns["id"], np.asarray(duplicates, dtype=np.int64))
+        return cls(columns, dictionaries, version)
+
+    # -- filtering ---------------------------------------------------------
+
+    def _codes_where(self, col: str, pred) -> np.ndarray:
+        dictionary = self.dictionaries[col]
+        return np.array([i for i, v in enumerate(dictionary) if pred(v)], dtype=np.int32)
+
+    def _match(self, col: str, value: str, fold=None) -> np.ndarray:
+        """`value` is already normalized; `fold` normalizes the stored side."""
+        if fold is None:
+            wanted = self._codes_where(col, lambda v: v == value)
+        else:
+            wanted = self._codes_where(col, lambda v: fold(v) == value)
+        return np.isin(self.columns[col], wanted)
+
+    def mask(self, spec: FilterSpec) -> np.ndarray:
+        """Boolean row mask with the same semantics as `spec.compile()`'s WHERE clause."""
+        m = np.ones(self.size, dtype=bool)
+        if spec.subject_id:
+            m &= self._match("subject_id", spec.subject_id)
+        if spec.eye:
+            m &= self._match("eye", spec.eye, str.upper)
+        if spec.meridian:
+            m &= self._match("meridian", spec.meridian, str.lower)
+        if spec.cone_types:
+            wanted = self._codes_where("cone_spectral_type", lambda v: v in spec.cone_types)
+            m &= np.isin(self.columns["cone_spectral_type"], wanted)
+        # NaN comparisons are False, which matches SQL dropping NULLs in range predicates.
+        if spec.eccentricity_min is not None:
+            m &= self.columns["eccentricity_deg"] >= spec.eccentricity_min
+        if spec.eccentricity_max is not None:
+            m &= self.columns["eccentricity_deg"] <= spec.eccentricity_max
+        if spec.age_min is not None:
+            m &= self.columns["age"] >= spec.age_min
+        if spec.age_max is not None:
+            m &= self.columns["age"] <= spec.age_max
+        return m
+
+    def _text(self, col: str, idx: np.ndarray) -> list:
+        codes = self.columns[col][idx]
+        values = self.dictionaries[col]
+        return [values[c] if c >= 0 else None for c in codes.tolist()]
+
+    def _distinct_cones(self, idx: np.ndarray, x_col: str = "cone_x_microns",
+                        y_col: str = "cone_y_microns") -> np.ndarray:
+        """Row indices of the first occurrence of each distinct (x, y, type) triple."""
+        if len(idx) == 0:
+            return idx
+        x = self.columns[x_col][idx]
+        y = self.columns[y_col][idx]
+        t = self.columns["cone_spectral_type"][idx]
+        order = np.lexsort((t, y, x))
+        xs, ys, ts = x[order], y[order], t[order]
+        dup = np.zeros(len(order), dtype=bool)
+        dup[1:] = _same(xs[1:], xs[:-1]) & _same(ys[1:], ys[:-1]) & (ts[1:] == ts[:-1])
+        return idx[order[~dup]]
+
+    # -- endpoint queries --------------------------------------------------
+
+    def patients(self) -> list[dict]:
+        subj = self.columns["subject_id"]
+        eye = self.columns["eye"]
+        age = self.columns["age"]
+        keep = np.flatnonzero(subj >= 0)
+        # Distinct (subject, age, eye): sort and drop adjacent repeats.
+        order = keep[np.lexsort((eye[keep], age[keep], subj[keep]))]
+        if len(order):
+            dup = np.zeros(len(order), dtype=bool)
+            dup[1:] = ((subj[order][1:] == subj[order][:-1])
+                       & _same(age[order][1:], age[order][:-1])
+                       & (eye[order][1:] == eye[order][:-1]))
+            order = order[~dup][:1000]
+        subjects = self._text("subject_id", order)
+        eyes = self._text("eye", order)
+        ages = _to_json(age[order])
+        return [
+            {"subject_id": s, "age": a, "eye": e,
+             "eye_description": EYE_DESCRIPTIONS.get(e, e)}
+            for s, a, e in zip(subjects, ages, eyes)
+        ]
+
+    def cones(self, mask: np.ndarray, limit: int, offset: int) -> list[dict]:
+        idx = np.flatnonzero(mask)
+        # ORDER BY cone_x_microns NULLS LAST — argsort puts NaN last already.
+        idx = idx[np.argsort(self.columns["cone_x_microns"][idx], kind="stable")]
+        idx = idx[offset:offset + limit]
+        out: dict[str, list] = {"id": self.columns["id"][idx].tolist()}
+        for col in TEXT_COLS:
+            out[col] = self._text(col, idx)
+        for col in FLOAT_COLS:
+            out[col] = _to_json(self.columns[col][idx])
+        for col in INT_COLS:
+            out[col] = _to_json_int(self.columns[col][idx])
+        return [dict(zip(CONE_COLUMNS, vals)) for vals in zip(*(out[c] for c in CONE_COLUMNS))]
+
+    def plot_data(self, mask: np.ndarray, limit: int) -> dict:
+        idx = self._distinct_cones(np.flatnonzero(mask))
+        idx = idx[np.argsort(self.columns["cone_x_microns"][idx], kind="stable")][:limit]
+        return {
+            "x": _to_json(self.columns["cone_x_microns"][idx]),
+            "y": _to_json(self.columns["cone_y_microns"][idx]),
+            "cone_type": self._text("cone_spectral_type", idx),
+        }
+
+    def metadata(self, mask: np.ndarray) -> dict:
+        idx = np.flatnonzero(mask)
+        if len(idx) == 0:
+            return {}
+        first = idx[:1]
+        meta = {}
+        for col in META_COLS:
+            if col in TEXT_COLS:
+                meta[col] = self._text(col, first)[0]
+            elif col in INT_COLS:
+                meta[col] = _to_json_int(self.columns[col][first])[0]
+            else:
+                meta[col] = _to_json(self.columns[col][first])[0]
+        meta["eye_description"] = EYE_DESCRIPTIONS.get(meta["eye"], meta["eye"])
+
+        distinct = self._distinct_cones(idx)
+        types = self.columns["cone_spectral_type"][distinct]
+
+        def count(label: str) -> int:
+            code = self._codes_where("cone_spectral_type", lambda v: v == label)
+            return int(np.isin(types, code).sum())
+
+        meta.update({
+            "filtered_total_cones": int(len(distinct)),
+            "filtered_l_cones": count("L"),
+            "filtered_m_cones": count("M"),
+            "filtered_s_cones": count("S"),
+        })
+        return meta
+
+    def positions(self, mask: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """x, y, cone type (object array) and eccentricity of the masked rows."""
+        idx = np.flatnonzero(mask)
+        types = np.array(self._text("cone_spectral_type", idx), dtype=object)
+        return (self.columns["cone_x_microns"][idx], self.columns["cone_y_microns"][idx],
+                types, self.columns["eccentricity_deg"][idx])
+
+    def _in_box(self, mask: np.ndarray, box: tuple, dedupe: bool) -> np.ndarray:
+        """Row indices with montage coordinates inside box = (x_min, x_max, y_min, y_max), mm."""
+        rx, ry = self.columns["retinal_x_mm"], self.columns["retinal_y_mm"]
+        if dedupe and "overlap_duplicate" in self.columns:  # absent from older snapshots
+            mask = mask & ~self.columns["overlap_duplicate"]
+        x_min, x_max, y_min, y_max = box
+        for values, lo, hi in ((rx, x_min, x_max), (ry, y_min, y_max)):
+            if lo is not None:
+                mask = mask & (values >= lo)
+            if hi is not None:
+                mask = mask & (values <= hi)
+        return np.flatnonzero(mask & ~np.isnan(rx) & ~np.isnan(ry))
+
+    def montage(self, mask: np.ndarray, box: tuple, limit: int, dedupe: bool = False) -> dict:
+        """Distinct cones in montage coordinates inside box = (x_min, x_max, y_min, y_max), mm."""
+        rx, ry = self.columns["retinal_x_mm"], self.columns["retinal_y_mm"]
+        idx = self._distinct_cones(self._in_box(mask, box, dedupe), "retinal_x_mm", "retinal_y_mm")
+        idx = idx[np.argsort(rx[idx], kind="stable")][:limit]
+        return {
+            "x": _to_json(rx[idx]),
+            "y": _to_json(ry[idx]),
+            "cone_type": self._text("cone_spectral_type", idx),
+        }
+
+    def retinal_positions(self, mask: np.ndarray, box: tuple) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Montage x, y (mm) and cone type (object array) of every cone inside box."""
+        idx = self._in_box(mask, box, dedupe=False)
+        types = np.array(self._text("cone_spectral_type", idx), dtype=object)
+        return self.columns["retinal_x_mm"][idx], self.columns["retinal_y_mm"][idx], types
+
+    def eccentricities(self, mask: np.ndarray) -> list[float]:
+        ecc = self.columns["eccentricity_deg"][mask]
+        return np.unique(ecc[~np.isnan(ecc)]).tolist()
+
+
+logger = logging.getLogger("app.columnar")
+
+_store: Optional[ColumnStore] = None
+
+# How often (seconds) a worker checks SNAPSHOT_DIR for a newer version.
+SNAPSHOT_POLL_INTERVAL = 1.0
+# How often (seconds) a worker without SNAPSHOT_DIR checks Postgres for a newer version.
+VERSION_POLL_INTERVAL = 2.0
+
+
+async def load_store(conn) -> ColumnStore:
+    # One snapshot for all three reads, so a commit between them can't pair
+    # version N with N+1's rows or with another version's overlap set.
+    async with conn.transaction(isolation="repeatable_read", readonly=True):
+        version = await conn.fetchval(VERSION_SQL)
+        records = await conn.fetch(f"SELECT {', '.join(CONE_COLUMNS)} FROM cone_data ORDER BY id")
+        duplicates = await conn.fetch("SELECT cone_id FROM cone_overlap")
+    # Building the arrays takes most of a second on a full dataset; keep it off the event loop.
+    return await asyncio.to_thread(ColumnStore.from_records, records, version,
+                                   [r["cone_id"] for r in duplicates])
+
+
+async def startup(pool) -> ColumnStore:
+    """Attach to an up-to-date snapshot if one exists, else build from Postgres."""
+    global _store
+    if settings.snapshot_dir:
+        from app.snapshot import load_snapshot  # app.snapshot imports this module
+
+        async with pool.acquire() as conn:
+            version = await conn.fetchval(VERSION_SQL)
+        store = await asyncio.to_thread(load_snapshot, settings.snapshot_dir)
+        if store is not None and store.version == version:
+            _store = store
+            return store
+    return await refresh(pool)
+
+
+async def refresh(pool) -> ColumnStore:
+    """Rebuild the store from Postgres and swap it in atomically.
+
+    With SNAPSHOT_DIR set the fresh copy is published to disk and re-opened
+    memory-mapped, so other workers pick up the same pages on their next poll.
+    """
+    global _store
+    async with pool.acquire() as conn:
+        store = await load_store(conn)
+    if settings.snapshot_dir:
+        store = await asyncio.to_thread(_publish, store, settings.snapshot_dir)
+    # Two refreshes can overlap (an ingest and the version poll); never go back a version.
+    if _store is None or store.version >= _store.version:
+        _store = store
+    return _store
+
+
+async def watch(pool):
+    """Reload whenever another worker's ingest moves the dataset version (no SNAPSHOT_DIR)."""
+    while True:
+        await asyncio.sleep(VERSION_POLL_INTERVAL)
+        try:
+            async with pool.acquire() as conn:
+                version = await conn.fetchval(VERSION_SQL)
+            if _store is None or version > _store.version:
+                await refresh(pool)
+        except Exception:
+            # A database blip shouldn't end the watch; keep serving the current copy.
+            logger.exception("columnar version poll failed")
+
+
+def _publish(store: ColumnStore, root: str) -> ColumnStore:
+    from app.snapshot import load_snapshot, write_snapshot
+
+    write_snapshot(store, root)
+    return load_snapshot(root) or store
+
+
+def _newer_snapshot(root: str, version: int) -> Optional[ColumnStore]:
+    from app.snapshot import current_version, load_snapshot
+
+    current = current_version(root)
+    if current is None or current <= version:
+        return None
+    return load_snapshot(root)
+
+
+async def watch_snapshot():
+    """Attach to the newer snapshots other workers publish (SNAPSHOT_DIR); disk reads run in a thread."""
+    global _store
+    while True:
+        await asyncio.sleep(SNAPSHOT_POLL_INTERVAL)
+        try:
+            version = _store.version if _store is not None else -1
+            store = await asyncio.to_thread(_newer_snapshot, settings.snapshot_dir, version)
+            if store is not None and (_store is None or store.version > _store.version):
+                _store = store
+        except Exception:
+            logger.exception("columnar snapshot poll failed")
+
+
+def get_store() -> Optional[ColumnStore]:
+    return _store
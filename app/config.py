@@ -1,10 +1,44 @@
+from typing import Optional
+
 from pydantic_settings import BaseSettings
 
 
 class Settings(BaseSettings):
     database_url: str
     admin_password: str
+    # Connection mode (app/database.py): pool (direct), pooler (transaction pooler) or single (serverless)
+    db_mode: str = "pooler"
+    # Prepared statements cached per connection; unset uses the mode's default (0 for pooler and single)
+    db_statement_cache_size: Optional[int] = None
     allowed_origins: str = "http://localhost:5173"
+    # Admin session signing (app/sessions.py); empty secret derives one from admin_password
+    session_secret: str = ""
+    session_ttl_seconds: int = 12 * 60 * 60
+    # Admission lanes (app/admission.py). The bulk lane must stay below the pool's
+    # max_size so interactive requests always find a free connection.
+    bulk_concurrency: int = 2
+    bulk_queue: int = 4
+    bulk_max_wait_seconds: float = 10.0
+    interactive_concurrency: int = 8
+    interactive_queue: int = 64
+    interactive_max_wait_seconds: float = 5.0
+    # Sampled slow-request log with SQL (app/instrumentation.py); 0 disables
+    slow_request_ms: float = 0
+    slow_request_sample_rate: float = 1.0
+    # Serve hot read endpoints from an in-memory copy of cone_data (app/columnar.py)
+    columnar_engine: bool = False
+    # Optional directory for memory-mapped columnar snapshots shared by workers (app/snapshot.py)
+    snapshot_dir: str = ""
+    # Where X-Profile request profiles are written (app/profiling.py); empty uses the temp dir
+    profile_dir: str = ""
+    # Processes for randomness jobs queued via /admin/randomness (app/randomness.py)
+    analysis_workers: int = 1
+    # Distance (microns) at which cones of neighbouring blocks count as one (app/overlap.py)
+    overlap_tolerance_microns: float = 1.0
+    # Where rendered montage tiles are cached (app/tiles.py); empty uses the temp dir
+    tile_dir: str = ""
+    # Re-export the static UI files (app/artifacts.py) here after every upload; empty disables
+    static_export_dir: str = ""
 
     @property
     def cors_origins(self) -> list[str]:
@@ -45,6 +45,116 @@ CREATE INDEX IF NOT EXISTS idx_cone_data_spectral_type
 
 CREATE INDEX IF NOT EXISTS idx_cone_data_plot_query
     ON cone_data (subject_id, meridian, eccentricity_deg, cone_spectral_type);
+
+-- Signed block eccentricity and montage-wide retinal coordinates per cone
+-- (mm from the fovea, +x temporal, +y superior; see app/retina.py).
+ALTER TABLE cone_data
+    ADD COLUMN IF NOT EXISTS eccentricity_x_deg FLOAT,
+    ADD COLUMN IF NOT EXISTS eccentricity_y_deg FLOAT,
+    ADD COLUMN IF NOT EXISTS eccentricity_x_mm  FLOAT,
+    ADD COLUMN IF NOT EXISTS eccentricity_y_mm  FLOAT,
+    ADD COLUMN IF NOT EXISTS retinal_x_mm       FLOAT,
+    ADD COLUMN IF NOT EXISTS retinal_y_mm       FLOAT;
+
+-- UPPER(eye) matches FilterSpec, so /montage is one range scan per subject and eye.
+CREATE INDEX IF NOT EXISTS idx_cone_data_retina
+    ON cone_data (subject_id, UPPER(eye), retinal_x_mm, retinal_y_mm);
+
+-- One row per block that carries a Zernike table; coefficients in OSA/ANSI
+-- order (see app/zernike.py). Replaced per (subject_id, eye) like cone_data.
+CREATE TABLE IF NOT EXISTS block_optics (
+    id                   BIGSERIAL PRIMARY KEY,
+    subject_id           VARCHAR(32) NOT NULL,
+    eye                  VARCHAR(4),
+    meridian             VARCHAR(16),
+    eccentricity_deg     FLOAT,
+    zernike_pupil_diam   FLOAT,
+    zernike_measure_wave FLOAT,
+    zernike_optim_wave   FLOAT,
+    zernike_coeffs       FLOAT8[] NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_block_optics_block
+    ON block_optics (subject_id, meridian, eccentricity_deg);
+
+-- Label-permutation randomness statistics per block and cone type, written
+-- by `python -m app.randomness` (see that module for the columns).
+CREATE TABLE IF NOT EXISTS block_randomness (
+    id               BIGSERIAL PRIMARY KEY,
+    subject_id       VARCHAR(32) NOT NULL,
+    eye              VARCHAR(4) NOT NULL,
+    meridian         VARCHAR(16) NOT NULL,
+    eccentricity_deg FLOAT NOT NULL,
+    cone_type        VARCHAR(4) NOT NULL,
+    digest           TEXT NOT NULL,
+    permutations     INTEGER NOT NULL,
+    bins             INTEGER NOT NULL,
+    max_spacings     FLOAT NOT NULL,
+    seed             INTEGER NOT NULL,
+    n_cones          INTEGER,
+    n_type           INTEGER,
+    nn_observed      FLOAT,
+    nn_null_mean     FLOAT,
+    nn_null_sd       FLOAT,
+    nn_ratio         FLOAT,
+    nn_p_clustered   FLOAT,
+    nn_p_regular     FLOAT,
+    pcf_r            FLOAT8[],
+    pcf_ratio        FLOAT8[],
+    pcf_lo           FLOAT8[],
+    pcf_hi           FLOAT8[],
+    elapsed_ms       FLOAT,
+    computed_at      TIMESTAMPTZ DEFAULT now(),
+    UNIQUE (subject_id, eye, meridian, eccentricity_deg, cone_type)
+);
+
+-- The one randomness job allowed at a time and its progress, shared by every
+-- worker and the CLI (see app/randomness.py). Single row, id = 1.
+CREATE TABLE IF NOT EXISTS randomness_job (
+    id              INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    running         BOOLEAN NOT NULL DEFAULT false,
+    subject_id      VARCHAR(32),
+    permutations    INTEGER,
+    blocks_total    INTEGER,
+    blocks_done     INTEGER,
+    blocks_skipped  INTEGER,
+    started_at      TIMESTAMPTZ,
+    heartbeat_at    TIMESTAMPTZ,
+    elapsed_seconds FLOAT,
+    error           TEXT
+);
+
+-- Non-canonical cones: rows that image the same physical cone as another
+-- block's `canonical_id` (see app/overlap.py). A cone without a row is canonical.
+CREATE TABLE IF NOT EXISTS cone_overlap (
+    cone_id      BIGINT PRIMARY KEY,
+    canonical_id BIGINT NOT NULL,
+    subject_id   VARCHAR(32) NOT NULL,
+    eye          VARCHAR(4),
+    distance_um  FLOAT
+);
+
+CREATE INDEX IF NOT EXISTS idx_cone_overlap_subject
+    ON cone_overlap (subject_id, eye);
+
+-- Running per-bin sums behind the cohort normative curves, kept current by
+-- every ingest (see app/cohort.py; `python -m app.cohort` rebuilds them).
+CREATE TABLE IF NOT EXISTS cohort_aggregates (
+    meridian       VARCHAR(16) NOT NULL,
+    ecc_bin        INTEGER NOT NULL,
+    age_bin        INTEGER NOT NULL,
+    n_blocks       INTEGER NOT NULL,
+    density_n      INTEGER NOT NULL,
+    density_sum    FLOAT8 NOT NULL,
+    density_sumsq  FLOAT8 NOT NULL,
+    lm_ratio_n     INTEGER NOT NULL,
+    lm_ratio_sum   FLOAT8 NOT NULL,
+    lm_ratio_sumsq FLOAT8 NOT NULL,
+    scones_n       INTEGER NOT NULL,
+    scones_sum     FLOAT8 NOT NULL,
+    scones_sumsq   FLOAT8 NOT NULL,
+    PRIMARY KEY (meridian, ecc_bin, age_bin)
+);
 """
 
 
@@ -62,6 +172,20 @@ CREATE TABLE IF NOT EXISTS upload_log (
 
 CREATE INDEX IF NOT EXISTS idx_upload_log_uploaded_at
     ON upload_log (uploaded_at DESC);
+
+-- Per-stage ingest timings; NULL for rows logged before these existed.
+ALTER TABLE upload_log
+    ADD COLUMN IF NOT EXISTS bytes_ingested  BIGINT,
+    ADD COLUMN IF NOT EXISTS blocks_parsed   INTEGER,
+    ADD COLUMN IF NOT EXISTS parse_ms        FLOAT,
+    ADD COLUMN IF NOT EXISTS convert_ms      FLOAT,
+    ADD COLUMN IF NOT EXISTS delete_ms       FLOAT,
+    ADD COLUMN IF NOT EXISTS insert_ms       FLOAT,
+    ADD COLUMN IF NOT EXISTS rows_per_second FLOAT;
+
+-- Cohort aggregate and cross-block overlap upkeep after the insert, kept out of insert_ms.
+ALTER TABLE upload_log
+    ADD COLUMN IF NOT EXISTS derive_ms FLOAT;
 """
 
 
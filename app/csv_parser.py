@@ -6,6 +6,9 @@ import re
 import numpy as np
 import pandas as pd
 
+from app import retina
+from app.zernike import parse_coefficients
+
 
 def parse_tuple(s):
     if pd.isna(s):
@@ -40,20 +43,14 @@ def parse_csv_bytes(content: bytes) -> pd.DataFrame:
     ao = pd.read_csv(io.BytesIO(content), encoding="utf-8-sig")
     cols = ao.columns.tolist()
 
-    param_cols = [c for c in cols if c.startswith("Parameter_Name")]
-    values_cols = [c for c in cols if c.startswith("Values")]
-    nonempty_values = [v for v in values_cols if ao[v].dropna().shape[0] > 0]
-    col_index = {c: i for i, c in enumerate(cols)}
-
-    param_to_values = {}
-    for p in param_cols:
-        if not nonempty_values:
-            continue
-        pidx = col_index[p]
-        best = min(nonempty_values, key=lambda v: abs(col_index[v] - pidx))
-        param_to_values[p] = best
+    # Each block is laid out as ..., Zernike Coeffs, Values, Parameter_Name, Values:
+    # every label column is read with the Values column right after it.
+    def values_after(col):
+        j = cols.index(col) + 1 if col in cols else len(cols)
+        return cols[j] if j < len(cols) and cols[j].startswith("Values") else None
 
     all_dfs = []
+    block_optics = []
     i = 0
     while True:
         suffix = "" if i == 0 else f".{i}"
@@ -71,7 +68,7 @@ def parse_csv_bytes(content: bytes) -> pd.DataFrame:
             continue
 
         param_col = "Parameter_Name" if i == 0 else f"Parameter_Name.{i}"
-        values_col = param_to_values.get(param_col)
+        values_col = values_after(param_col)
         metadata = {}
 
         if values_col:
@@ -94,9 +91,11 @@ def parse_csv_bytes(content: bytes) -> pd.DataFrame:
                 elif "eccentricity (x,y) (deg)" in pl:
                     x, y = parse_tuple(v)
                     metadata["eccentricity_deg"] = safe_float(math.hypot(x, y)) if not (math.isnan(x) or math.isnan(y)) else None
+                    metadata["eccentricity_x_deg"], metadata["eccentricity_y_deg"] = safe_float(x), safe_float(y)
                 elif "eccentricity (x,y) (mm)" in pl:
                     x, y = parse_tuple(v)
                     metadata["eccentricity_mm"] = safe_float(math.hypot(x, y)) if not (math.isnan(x) or math.isnan(y)) else None
+                    metadata["eccentricity_x_mm"], metadata["eccentricity_y_mm"] = safe_float(x), safe_float(y)
                 elif "retinal ma" in pl:
                     metadata["ret_mag_factor"] = safe_float(v)
                 elif pl.startswith("fov"):
@@ -124,8 +123,27 @@ def parse_csv_bytes(content: bytes) -> pd.DataFrame:
                 elif "zernike coeffs optimized wavelength" in pl:
                     metadata["zernike_optim_wave"] = safe_float(v)
 
+        zernike_col = f"Zernike Coeffs{suffix}"
+        zernike_values = values_after(zernike_col)
+        if zernike_values:
+            coeffs = parse_coefficients(ao[zernike_col].tolist(), ao[zernike_values].tolist())
+            if coeffs:
+                block_optics.append((
+                    str(metadata.get("subject_id") or "UNKNOWN"),
+                    metadata.get("eye") or None,
+                    metadata.get("meridian") or None,
+                    metadata.get("eccentricity_deg"),
+                    metadata.get("zernike_pupil_diam"),
+                    metadata.get("zernike_measure_wave"),
+                    metadata.get("zernike_optim_wave"),
+                    coeffs,
+                ))
+
         for k, val in metadata.items():
             block[k] = val
+        # Position of the block in the file, so checks can report per block
+        # even when its metadata is missing (not stored in cone_data).
+        block["block"] = i
 
         all_dfs.append(block.reset_index(drop=True))
         i += 1
@@ -133,7 +151,13 @@ def parse_csv_bytes(content: bytes) -> pd.DataFrame:
     if not all_dfs:
         return pd.DataFrame()
 
-    return pd.concat(all_dfs, ignore_index=True)
+    df = pd.concat(all_dfs, ignore_index=True)
+    # Signed eccentricity components and montage coordinates (see app/retina.py).
+    retina.add_columns(df)
+    df.attrs["blocks_parsed"] = len(all_dfs)
+    # One row per block with Zernike coefficients, in block_optics column order.
+    df.attrs["block_optics"] = block_optics
+    return df
 
 
 def to_row(r) -> tuple:
@@ -166,4 +190,10 @@ def to_row(r) -> tuple:
         safe_float(f("zernike_pupil_diam")),
         safe_float(f("zernike_measure_wave")),
         safe_float(f("zernike_optim_wave")),
+        safe_float(f("eccentricity_x_deg")),
+        safe_float(f("eccentricity_y_deg")),
+        safe_float(f("eccentricity_x_mm")),
+        safe_float(f("eccentricity_y_mm")),
+        safe_float(f("retinal_x_mm")),
+        safe_float(f("retinal_y_mm")),
     )
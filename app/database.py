@@ -1,19 +1,176 @@
+"""Database connections, in one of three modes (DB_MODE):
+
+    pool     a long-lived asyncpg pool straight to Postgres (port 5432), for
+             the Procfile server. Prepared statements are cached per
+             connection, so repeated queries skip parse/plan.
+    pooler   the same pool, pointed at a transaction pooler (Supabase /
+             PgBouncer, port 6543). The default, and what the app always did.
+             A server connection can change between transactions, so the
+             statement cache is off unless DB_STATEMENT_CACHE_SIZE is set; set
+             it only when the pooler tracks prepared statements itself
+             (PgBouncer >= 1.21 with max_prepared_statements).
+    single   one connection per process, opened by the first request and
+             reused by the following ones, for serverless (api/index.py).
+             Requests take turns on it, and it is reopened if it was closed
+             or belongs to an earlier event loop.
+
+Every read builds its SQL from fixed text and a FilterSpec (app/filters.py),
+so equal filters send byte-identical statements and a statement cache, here
+or in the pooler, hits across requests.
+
+Opening a connection is timed into the request's "connect" stage, the
+db_connect_duration_seconds histogram and `stats()`.
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
 import asyncpg
+from app import metrics
 from app.config import settings
+from app.instrumentation import InstrumentedConnection, stage
+
+MODES = ("pool", "pooler", "single")
+# Used when DB_STATEMENT_CACHE_SIZE is unset; 100 is asyncpg's own default.
+DEFAULT_STATEMENT_CACHE = {"pool": 100, "pooler": 0, "single": 0}
+POOL_MIN_SIZE = 2
+POOL_MAX_SIZE = 5
+
+pool: "asyncpg.Pool | SingleConnection | None" = None
+_pool_lock = asyncio.Lock()
+_connects = {"count": 0, "seconds_total": 0.0, "last_seconds": None}
+
+connect_seconds = metrics.registry.register(metrics.Histogram(
+    "db_connect_duration_seconds", "Time to open one database connection, by DB_MODE.",
+    metrics.LATENCY_BUCKETS, ("mode",),
+))
+
+
+def mode() -> str:
+    if settings.db_mode not in MODES:
+        raise RuntimeError(f"DB_MODE must be one of {', '.join(MODES)}, not {settings.db_mode!r}")
+    return settings.db_mode
+
+
+def statement_cache_size() -> int:
+    if settings.db_statement_cache_size is not None:
+        return settings.db_statement_cache_size
+    return DEFAULT_STATEMENT_CACHE[mode()]
+
+
+async def _connect(*args, **kwargs) -> asyncpg.Connection:
+    """asyncpg.connect, timed."""
+    started = time.perf_counter()
+    conn = await asyncpg.connect(*args, **kwargs)
+    seconds = time.perf_counter() - started
+    _connects["count"] += 1
+    _connects["seconds_total"] += seconds
+    _connects["last_seconds"] = seconds
+    connect_seconds.observe(seconds, settings.db_mode)
+    return conn
+
+
+class _SingleAcquire:
+    """`await single.acquire()` or `async with single.acquire() as conn`, like asyncpg's pool."""
+
+    def __init__(self, owner: "SingleConnection"):
+        self.owner = owner
+        self.conn = None
+
+    def __await__(self):
+        return self.owner._acquire().__await__()
+
+    async def __aenter__(self):
+        self.conn = await self.owner._acquire()
+        return self.conn
 
-pool: asyncpg.Pool | None = None
+    async def __aexit__(self, *exc):
+        await self.owner.release(self.conn)
+
+
+class SingleConnection:
+    """One lazily opened connection behind the part of asyncpg.Pool's interface the app uses."""
+
+    def __init__(self, dsn: str, **connect_kwargs):
+        self.dsn = dsn
+        self.connect_kwargs = connect_kwargs
+        self.conn: Optional[asyncpg.Connection] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.lock: Optional[asyncio.Lock] = None
+        self.in_use = False
+
+    def acquire(self) -> _SingleAcquire:
+        return _SingleAcquire(self)
+
+    async def _acquire(self) -> asyncpg.Connection:
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop:
+            # A connection (and lock) from a previous loop can't be awaited on this one.
+            if self.conn is not None:
+                self.conn.terminate()
+            self.conn, self.loop, self.lock = None, loop, asyncio.Lock()
+        await self.lock.acquire()
+        try:
+            if self.conn is None or self.conn.is_closed():
+                with stage("connect"):
+                    self.conn = await _connect(self.dsn, **self.connect_kwargs)
+        except BaseException:
+            self.lock.release()
+            raise
+        self.in_use = True
+        return self.conn
+
+    async def release(self, conn):
+        try:
+            # As asyncpg's pool does on release: never hand on an open transaction.
+            if not conn.is_closed() and conn.is_in_transaction():
+                await conn.execute("ROLLBACK")
+        except Exception:
+            conn.terminate()
+        finally:
+            self.in_use = False
+            self.lock.release()
+
+    async def close(self):
+        if self.conn is not None and not self.conn.is_closed():
+            await self.conn.close()
+        self.conn = None
+
+    def get_size(self) -> int:
+        return 0 if self.conn is None or self.conn.is_closed() else 1
+
+    def get_idle_size(self) -> int:
+        return self.get_size() - int(self.in_use)
+
+    def get_max_size(self) -> int:
+        return 1
 
 
 async def create_pool():
     global pool
+    if mode() == "single":
+        pool = SingleConnection(settings.database_url, statement_cache_size=statement_cache_size())
+        return
     pool = await asyncpg.create_pool(
         settings.database_url,
-        min_size=2,
-        max_size=5,
-        statement_cache_size=0,
+        min_size=POOL_MIN_SIZE,
+        max_size=POOL_MAX_SIZE,
+        statement_cache_size=statement_cache_size(),
+        connect=_connect,
     )
 
 
+async def ensure_pool() -> "asyncpg.Pool | SingleConnection":
+    """The pool, opened on first use so a cold start connects only when a request needs it."""
+    if pool is None:
+        async with _pool_lock:
+            if pool is None:
+                with stage("connect"):
+                    await create_pool()
+    return pool
+
+
 async def close_pool():
     global pool
     if pool:
@@ -21,6 +178,30 @@ async def close_pool():
         pool = None
 
 
-def get_pool() -> asyncpg.Pool:
+def get_pool() -> "asyncpg.Pool | SingleConnection":
     assert pool is not None, "Database pool not initialized"
     return pool
+
+
+def stats() -> dict:
+    count = _connects["count"]
+    last = _connects["last_seconds"]
+    return {
+        "mode": settings.db_mode,
+        "statement_cache_size": statement_cache_size(),
+        "connects": count,
+        "connect_ms_mean": _connects["seconds_total"] / count * 1000 if count else None,
+        "connect_ms_last": last * 1000 if last is not None else None,
+    }
+
+
+@asynccontextmanager
+async def acquire():
+    """Pool connection whose acquire wait and queries are timed into the current request."""
+    pool = await ensure_pool()
+    with stage("acquire"):
+        conn = await pool.acquire()
+    try:
+        yield InstrumentedConnection(conn)
+    finally:
+        await pool.release(conn)
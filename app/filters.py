@@ -0,0 +1,93 @@
+"""Shared cone_data filter spec for the read endpoints.
+
+Every endpoint that filters cone_data builds a `FilterSpec` and compiles it
+instead of hand-assembling its own WHERE clause. Values are normalized once
+(eye upper-cased, meridian lower-cased, cone types de-duplicated and
+sorted), clauses are always emitted in the same order, and lists bind as a
+single `= ANY($n::text[])` parameter. The same filters therefore always
+produce the same SQL text, and the frozen spec itself is a hashable key for
+coalescing or caching.
+"""
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+
+@dataclass(frozen=True)
+class FilterSpec:
+    subject_id: Optional[str] = None
+    eye: Optional[str] = None
+    meridian: Optional[str] = None
+    cone_types: tuple[str, ...] = ()
+    eccentricity_min: Optional[float] = None
+    eccentricity_max: Optional[float] = None
+    age_min: Optional[float] = None
+    age_max: Optional[float] = None
+
+    @classmethod
+    def build(
+        cls,
+        subject_id: Optional[str] = None,
+        eye: Optional[str] = None,
+        meridian: Optional[str] = None,
+        cone_types: Optional[Iterable[str]] = None,
+        eccentricity_min: Optional[float] = None,
+        eccentricity_max: Optional[float] = None,
+        age_min: Optional[float] = None,
+        age_max: Optional[float] = None,
+    ) -> "FilterSpec":
+        return cls(
+            subject_id=subject_id or None,
+            eye=eye.upper() if eye else None,
+            meridian=meridian.lower() if meridian else None,
+            cone_types=tuple(sorted({t for t in cone_types or () if t})),
+            eccentricity_min=float(eccentricity_min) if eccentricity_min is not None else None,
+            eccentricity_max=float(eccentricity_max) if eccentricity_max is not None else None,
+            age_min=float(age_min) if age_min is not None else None,
+            age_max=float(age_max) if age_max is not None else None,
+        )
+
+    def compile(self, start: int = 1) -> tuple[str, list]:
+        """Return (`WHERE ...` or "", params) with placeholders numbered from `start`."""
+        clauses: list[str] = []
+        params: list = []
+
+        def add(template: str, value):
+            params.append(value)
+            clauses.append(template.format(f"${start + len(params) - 1}"))
+
+        if self.subject_id:
+            add("subject_id = {}", self.subject_id)
+        if self.eye:
+            add("UPPER(eye) = {}", self.eye)
+        if self.meridian:
+            add("LOWER(meridian) = {}", self.meridian)
+        if self.cone_types:
+            add("cone_spectral_type = ANY({}::text[])", list(self.cone_types))
+        if self.eccentricity_min is not None:
+            add("eccentricity_deg >= {}", self.eccentricity_min)
+        if self.eccentricity_max is not None:
+            add("eccentricity_deg <= {}", self.eccentricity_max)
+        if self.age_min is not None:
+            add("age >= {}", self.age_min)
+        if self.age_max is not None:
+            add("age <= {}", self.age_max)
+
+        where_sql = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return where_sql, params
+
+
+def eccentricity_ranges(eccentricities: list[float]) -> list[dict]:
+    """One 0.1° window per distinct block eccentricity, as offered to the UI."""
+    ranges = []
+    for ecc in eccentricities:
+        # Create a small range around each eccentricity value
+        range_size = 0.1  # 0.1 degree range
+        min_ecc = max(0, ecc - range_size / 2)
+        max_ecc = ecc + range_size / 2
+
+        ranges.append({
+            "min": min_ecc,
+            "max": max_ecc,
+            "label": f"{ecc:.1f}°"
+        })
+    return ranges
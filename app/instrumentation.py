@@ -0,0 +1,193 @@
+"""Per-request stage timings, Server-Timing headers and request logs.
+
+`TimingMiddleware` gives every request a `RequestTimings` (held in a
+contextvar). Code on the request path adds to it with `stage("name")`,
+and connections from `app.database.acquire()` record each query's time,
+row count and SQL shape automatically. When the response starts, the
+stages go out as a `Server-Timing` header; when it finishes, one JSON log
+line is written to the `app.requests` logger. Requests slower than
+SLOW_REQUEST_MS are additionally sampled into `app.slow` together with the
+SQL they ran and its parameters.
+"""
+import json
+import logging
+import random
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from app import metrics
+from app.config import settings
+
+logger = logging.getLogger("app.requests")
+slow_logger = logging.getLogger("app.slow")
+for _log in (logger, slow_logger):
+    if not _log.handlers:
+        _handler = logging.StreamHandler()
+        _handler.setFormatter(logging.Formatter("%(message)s"))
+        _log.addHandler(_handler)
+        _log.setLevel(logging.INFO)
+        _log.propagate = False
+
+# Keep slow-log lines bounded when a query binds a long list.
+MAX_LOGGED_PARAM_ITEMS = 20
+
+
+class RequestTimings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: dict[str, float] = {}
+        self.rows = 0
+        self.queries: list[tuple[str, tuple]] = []
+
+    def add(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def server_timing(self) -> str:
+        parts = [f"{name};dur={secs * 1000:.2f}" for name, secs in self.stages.items()]
+        parts.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.2f}")
+        if self.queries:
+            parts.append(f'rows;desc="{self.rows}"')
+        return ", ".join(parts)
+
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+def current() -> Optional[RequestTimings]:
+    return _current.get()
+
+
+@contextmanager
+def stage(name: str):
+    """Time the enclosed block into the current request's `name` stage."""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - started)
+
+
+def sql_shape(sql: str) -> str:
+    return re.sub(r"\s+", " ", sql).strip()
+
+
+def _loggable(value):
+    if isinstance(value, (list, tuple)) and len(value) > MAX_LOGGED_PARAM_ITEMS:
+        return [*value[:MAX_LOGGED_PARAM_ITEMS], f"... {len(value)} items"]
+    return value
+
+
+class InstrumentedConnection:
+    """asyncpg connection proxy that times queries into the current request."""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    async def _timed(self, method: str, sql: str, args: tuple):
+        timings = _current.get()
+        if timings is None:
+            return await getattr(self._conn, method)(sql, *args)
+        started = time.perf_counter()
+        try:
+            result = await getattr(self._conn, method)(sql, *args)
+        finally:
+            timings.add("sql", time.perf_counter() - started)
+            timings.queries.append((sql, args))
+        if isinstance(result, list):
+            timings.rows += len(result)
+        elif result is not None and method == "fetchrow":
+            timings.rows += 1
+        return result
+
+    async def fetch(self, sql: str, *args):
+        return await self._timed("fetch", sql, args)
+
+    async def fetchrow(self, sql: str, *args):
+        return await self._timed("fetchrow", sql, args)
+
+    async def fetchval(self, sql: str, *args):
+        return await self._timed("fetchval", sql, args)
+
+    async def execute(self, sql: str, *args):
+        return await self._timed("execute", sql, args)
+
+    async def executemany(self, sql: str, args):
+        timings = _current.get()
+        started = time.perf_counter()
+        try:
+            return await self._conn.executemany(sql, args)
+        finally:
+            if timings is not None:
+                timings.add("sql", time.perf_counter() - started)
+                timings.queries.append((sql, (f"<{len(args)} rows>",)))
+
+
+class TimingMiddleware:
+    """Pure ASGI middleware so streaming responses aren't buffered."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = _current.set(timings)
+        status = 500
+        size = 0
+
+        async def send_with_timing(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", timings.server_timing().encode()))
+                message = {**message, "headers": headers}
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            # Route template, not the raw path, keeps metric cardinality bounded.
+            route = getattr(scope.get("route"), "path", "unmatched")
+            metrics.observe_request(scope["method"], route, status,
+                                    time.perf_counter() - timings.started, size)
+            _log_request(scope, status, timings)
+
+
+def _log_request(scope, status: int, timings: RequestTimings):
+    total_ms = (time.perf_counter() - timings.started) * 1000
+    record = {
+        "method": scope["method"],
+        "path": scope["path"],
+        "status": status,
+        "total_ms": round(total_ms, 2),
+        "stages_ms": {k: round(v * 1000, 2) for k, v in timings.stages.items()},
+        "rows": timings.rows,
+        "queries": len(timings.queries),
+    }
+    logger.info(json.dumps(record))
+
+    if (settings.slow_request_ms and total_ms >= settings.slow_request_ms
+            and random.random() < settings.slow_request_sample_rate):
+        record["query_string"] = scope.get("query_string", b"").decode("latin-1")
+        record["sql"] = [
+            {"shape": sql_shape(sql), "params": [_loggable(a) for a in args]}
+            for sql, args in timings.queries
+        ]
+        slow_logger.warning(json.dumps(record, default=str))
@@ -3,33 +3,56 @@ import os
 import csv
 import io
 import asyncio
-import secrets
+import time
 from contextlib import asynccontextmanager
 from datetime import datetime
 from typing import Optional, List
 
-from fastapi import FastAPI, Query, HTTPException, UploadFile, File, Header, BackgroundTasks, Form
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi import FastAPI, Request, Query, HTTPException, UploadFile, File, Header, BackgroundTasks, Form
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
 from pydantic import BaseModel, Field
 
 from app.config import settings
-from app.database import create_pool, close_pool, get_pool
-from app.csv_parser import parse_csv_bytes, to_row
-
-# In-memory admin session tokens (reset on server restart)
-_admin_sessions: set[str] = set()
-
+from app import database
+from app.database import acquire, close_pool, ensure_pool, get_pool
+# Modules that pull in NumPy, pandas or SciPy are imported by the handlers that
+# use them, so a cold start that serves /patients loads none of them.
+from app import admission, cohort, metrics, profiling
+from app.sessions import issue_token, verify_token
+from app.coalesce import SingleFlight
+from app.responses import FastJSONResponse, Payload, dumps, json_response
+from app.filters import FilterSpec, eccentricity_ranges
+from app.instrumentation import TimingMiddleware, stage
+
+# Identical concurrent /plot-data and /metadata queries share one DB round-trip.
+_read_flight = SingleFlight()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    await create_pool()
+    # The pool opens on first use (app/database.py); only the columnar copy needs it up front.
+    watcher = None
+    if settings.columnar_engine:
+        from app import columnar
+
+        await columnar.startup(await ensure_pool())
+        # Other workers' uploads reach this one through a poll: of SNAPSHOT_DIR, else of the version.
+        if settings.snapshot_dir:
+            watcher = asyncio.create_task(columnar.watch_snapshot())
+        else:
+            watcher = asyncio.create_task(columnar.watch(get_pool()))
     yield
+    if watcher is not None:
+        watcher.cancel()
     await close_pool()
 
 
-app = FastAPI(title="Retinal Cones API", lifespan=lifespan)
+app = FastAPI(title="Retinal Cones API", lifespan=lifespan, default_response_class=FastJSONResponse)
 
+# Admin-only X-Profile header (app/profiling.py); _require_admin is defined below.
+# Added before CORS so it runs inside it and its own 400/401/409 answers carry CORS headers.
+app.add_middleware(profiling.ProfilingMiddleware, authorize=lambda authorization: _require_admin(authorization))
 # CORS
 app.add_middleware(
     CORSMiddleware,
@@ -37,7 +60,20 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Let browser devtools show the Server-Timing breakdown cross-origin.
+    expose_headers=["Server-Timing", "X-Profile-Id"],
 )
+# Outermost, so its total covers CORS handling as well.
+app.add_middleware(TimingMiddleware)
+
+
+def _columnar_store():
+    """The in-memory copy of cone_data, or None; app.columnar is only imported when enabled."""
+    if not settings.columnar_engine:
+        return None
+    from app import columnar
+
+    return columnar.get_store()
 
 
 # Pydantic response model for /plot-data
@@ -49,9 +85,14 @@ class PlotData(BaseModel):
 
 # 1) List patients
 @app.get("/patients")
-async def get_patients():
-    pool = get_pool()
-    async with pool.acquire() as conn:
+async def get_patients(request: Request):
+    store = _columnar_store()
+    if store is not None:
+        with stage("columnar"):
+            patients = store.patients()
+        return json_response(patients, request)
+
+    async with admission.interactive.admit(), acquire() as conn:
         rows = await conn.fetch(
             "SELECT DISTINCT subject_id, age, eye, "
             "CASE WHEN eye = 'OD' THEN 'Right Eye' "
@@ -59,13 +100,15 @@ async def get_patients():
             "FROM cone_data WHERE subject_id IS NOT NULL "
             "ORDER BY subject_id LIMIT 1000"
         )
-    return JSONResponse(content=[dict(row) for row in rows])
+    return json_response(rows, request)
 
 
 # 2) Get cones with flexible filters
 @app.get("/cones")
 async def get_cones(
+    request: Request,
     subject_id: Optional[str] = Query(None),
+    eye: Optional[str] = Query(None),
     meridian: Optional[str] = Query(None),
     cone_type: Optional[str] = Query(None, alias="cone_spectral_type"),
     age_min: Optional[int] = Query(None),
@@ -73,62 +116,35 @@ async def get_cones(
     limit: int = Query(50000, gt=0, le=100000),
     offset: int = Query(0, ge=0),
 ):
-    where_clauses = []
-    params = []
-    param_idx = 1
-
-    if subject_id:
-        where_clauses.append(f"subject_id = ${param_idx}")
-        params.append(subject_id)
-        param_idx += 1
-    if meridian:
-        where_clauses.append(f"LOWER(meridian) = LOWER(${param_idx})")
-        params.append(meridian)
-        param_idx += 1
-    if cone_type:
-        where_clauses.append(f"cone_spectral_type = ${param_idx}")
-        params.append(cone_type)
-        param_idx += 1
-    if age_min is not None:
-        where_clauses.append(f"age >= ${param_idx}")
-        params.append(age_min)
-        param_idx += 1
-    if age_max is not None:
-        where_clauses.append(f"age <= ${param_idx}")
-        params.append(age_max)
-        param_idx += 1
-
-    params.append(limit)
-    params.append(offset)
-
-    where_sql = f"WHERE {' AND '.join(where_clauses)}" if where_clauses else ""
+    spec = FilterSpec.build(subject_id=subject_id, eye=eye, meridian=meridian,
+                            cone_types=[cone_type] if cone_type else None,
+                            age_min=age_min, age_max=age_max)
+    store = _columnar_store()
+    if store is not None:
+        with stage("columnar"):
+            cones = store.cones(store.mask(spec), limit, offset)
+        return json_response(cones, request)
+
+    where_sql, params = spec.compile()
+    params += [limit, offset]
     sql = f"""
         SELECT *
         FROM cone_data
         {where_sql}
         ORDER BY cone_x_microns NULLS LAST
-        LIMIT ${param_idx} OFFSET ${param_idx + 1};
+        LIMIT ${len(params) - 1} OFFSET ${len(params)};
     """
 
-    pool = get_pool()
-    async with pool.acquire() as conn:
+    async with admission.interactive.admit(), acquire() as conn:
         rows = await conn.fetch(sql, *params)
 
-    # Convert any non-serializable objects to strings
-    result = []
-    for r in rows:
-        row_dict = dict(r)
-        for k, v in row_dict.items():
-            if isinstance(v, datetime):
-                row_dict[k] = v.isoformat()
-        result.append(row_dict)
-
-    return JSONResponse(content=result)
+    return json_response(rows, request)
 
 
 # 3) Plot-friendly JSON
 @app.get("/plot-data", response_model=PlotData)
 async def plot_data(
+    request: Request,
     subject_id: Optional[str] = Query(None),
     eye: Optional[str] = Query(None),
     meridian: Optional[str] = Query(None),
@@ -137,39 +153,17 @@ async def plot_data(
     eccentricity_max: Optional[float] = Query(None),
     limit: int = Query(50000, gt=0, le=100000),
 ):
-    where_clauses = []
-    params = []
-    param_idx = 1
-
-    if subject_id:
-        where_clauses.append(f"subject_id = ${param_idx}")
-        params.append(subject_id)
-        param_idx += 1
-    if eye:
-        where_clauses.append(f"UPPER(eye) = UPPER(${param_idx})")
-        params.append(eye)
-        param_idx += 1
-    if meridian:
-        where_clauses.append(f"LOWER(meridian) = LOWER(${param_idx})")
-        params.append(meridian)
-        param_idx += 1
-    if cone_type:
-        placeholders = ", ".join(f"${param_idx + i}" for i in range(len(cone_type)))
-        where_clauses.append(f"cone_spectral_type IN ({placeholders})")
-        params.extend(cone_type)
-        param_idx += len(cone_type)
-    if eccentricity_min is not None:
-        where_clauses.append(f"eccentricity_deg >= ${param_idx}")
-        params.append(eccentricity_min)
-        param_idx += 1
-    if eccentricity_max is not None:
-        where_clauses.append(f"eccentricity_deg <= ${param_idx}")
-        params.append(eccentricity_max)
-        param_idx += 1
-
+    spec = FilterSpec.build(subject_id=subject_id, eye=eye, meridian=meridian,
+                            cone_types=cone_type, eccentricity_min=eccentricity_min,
+                            eccentricity_max=eccentricity_max)
+    store = _columnar_store()
+    if store is not None:
+        with stage("columnar"):
+            data = store.plot_data(store.mask(spec), limit)
+        return json_response(data, request)
+
+    where_sql, params = spec.compile()
     params.append(limit)
-
-    where_sql = f"WHERE {' AND '.join(where_clauses)}" if where_clauses else ""
     # DISTINCT on (x, y, cone_type) defends against accidental duplicate rows
     # from re-uploaded CSVs — physical cones can't share all three values.
     sql = f"""
@@ -177,25 +171,30 @@ async def plot_data(
         FROM cone_data
         {where_sql}
         ORDER BY cone_x_microns NULLS LAST
-        LIMIT ${param_idx};
+        LIMIT ${len(params)};
     """
 
-    pool = get_pool()
-    async with pool.acquire() as conn:
-        rows = await conn.fetch(sql, *params)
+    async def run() -> Payload:
+        async with admission.interactive.admit(), acquire() as conn:
+            rows = await conn.fetch(sql, *params)
 
-    x, y, ctype = [], [], []
-    for r in rows:
-        x.append(r["x"])
-        y.append(r["y"])
-        ctype.append(r["cone_type"])
+        with stage("convert"):
+            x, y, ctype = [], [], []
+            for r in rows:
+                x.append(r["x"])
+                y.append(r["y"])
+                ctype.append(r["cone_type"])
 
-    return {"x": x, "y": y, "cone_type": ctype}
+        return Payload.from_content({"x": x, "y": y, "cone_type": ctype})
+
+    payload = await _read_flight.do(("plot-data", spec, limit), run)
+    return payload.response(request)
 
 
 # 4) Get metadata for legend
 @app.get("/metadata")
 async def get_metadata(
+    request: Request,
     subject_id: Optional[str] = Query(None),
     eye: Optional[str] = Query(None),
     meridian: Optional[str] = Query(None),
@@ -203,37 +202,16 @@ async def get_metadata(
     eccentricity_min: Optional[float] = Query(None),
     eccentricity_max: Optional[float] = Query(None),
 ):
-    where_clauses = []
-    params = []
-    param_idx = 1
-
-    if subject_id:
-        where_clauses.append(f"subject_id = ${param_idx}")
-        params.append(subject_id)
-        param_idx += 1
-    if eye:
-        where_clauses.append(f"UPPER(eye) = UPPER(${param_idx})")
-        params.append(eye)
-        param_idx += 1
-    if meridian:
-        where_clauses.append(f"LOWER(meridian) = LOWER(${param_idx})")
-        params.append(meridian)
-        param_idx += 1
-    if cone_type:
-        placeholders = ", ".join(f"${param_idx + i}" for i in range(len(cone_type)))
-        where_clauses.append(f"cone_spectral_type IN ({placeholders})")
-        params.extend(cone_type)
-        param_idx += len(cone_type)
-    if eccentricity_min is not None:
-        where_clauses.append(f"eccentricity_deg >= ${param_idx}")
-        params.append(eccentricity_min)
-        param_idx += 1
-    if eccentricity_max is not None:
-        where_clauses.append(f"eccentricity_deg <= ${param_idx}")
-        params.append(eccentricity_max)
-        param_idx += 1
-
-    where_sql = f"WHERE {' AND '.join(where_clauses)}" if where_clauses else ""
+    spec = FilterSpec.build(subject_id=subject_id, eye=eye, meridian=meridian,
+                            cone_types=cone_type, eccentricity_min=eccentricity_min,
+                            eccentricity_max=eccentricity_max)
+    store = _columnar_store()
+    if store is not None:
+        with stage("columnar"):
+            metadata = store.metadata(store.mask(spec))
+        return json_response(metadata, request)
+
+    where_sql, params = spec.compile()
 
     # Get metadata from first row (consistent across filtered data)
     metadata_sql = f"""
@@ -263,26 +241,28 @@ async def get_metadata(
         ) sub;
     """
 
-    pool = get_pool()
-    async with pool.acquire() as conn:
-        metadata_row = await conn.fetchrow(metadata_sql, *params)
-        counts_row = await conn.fetchrow(counts_sql, *params)
+    async def run() -> Payload:
+        async with admission.interactive.admit(), acquire() as conn:
+            metadata_row = await conn.fetchrow(metadata_sql, *params)
+            counts_row = await conn.fetchrow(counts_sql, *params)
 
-    if not metadata_row:
-        return JSONResponse(content={})
+        if not metadata_row:
+            return Payload.from_content({})
 
-    metadata = dict(metadata_row)
-    counts = dict(counts_row)
+        metadata = dict(metadata_row)
+        counts = dict(counts_row)
 
-    # Add filtered counts to metadata
-    metadata.update({
-        "filtered_total_cones": counts["total_filtered_cones"],
-        "filtered_l_cones": counts["l_cones_count"],
-        "filtered_m_cones": counts["m_cones_count"],
-        "filtered_s_cones": counts["s_cones_count"]
-    })
+        # Add filtered counts to metadata
+        metadata.update({
+            "filtered_total_cones": counts["total_filtered_cones"],
+            "filtered_l_cones": counts["l_cones_count"],
+            "filtered_m_cones": counts["m_cones_count"],
+            "filtered_s_cones": counts["s_cones_count"]
+        })
+        return Payload.from_content(metadata)
 
-    return JSONResponse(content=metadata)
+    payload = await _read_flight.do(("metadata", spec), run)
+    return payload.response(request)
 
 
 # 5) Get eccentricity ranges for a subject/meridian
@@ -292,28 +272,24 @@ async def get_eccentricity_ranges(
     meridian: str = Query(...),
     eye: Optional[str] = Query(None),
 ):
-    pool = get_pool()
-    async with pool.acquire() as conn:
-        if eye:
-            rows = await conn.fetch(
-                "SELECT DISTINCT eccentricity_deg, COUNT(*) as count "
-                "FROM cone_data "
-                "WHERE subject_id = $1 AND LOWER(meridian) = LOWER($2) "
-                "AND UPPER(eye) = UPPER($3) "
-                "GROUP BY eccentricity_deg ORDER BY eccentricity_deg",
-                subject_id, meridian, eye
-            )
-        else:
-            rows = await conn.fetch(
-                "SELECT DISTINCT eccentricity_deg, COUNT(*) as count "
-                "FROM cone_data "
-                "WHERE subject_id = $1 AND LOWER(meridian) = LOWER($2) "
-                "GROUP BY eccentricity_deg ORDER BY eccentricity_deg",
-                subject_id, meridian
-            )
+    spec = FilterSpec.build(subject_id=subject_id, eye=eye, meridian=meridian)
+    store = _columnar_store()
+    if store is not None:
+        with stage("columnar"):
+            eccentricities = store.eccentricities(store.mask(spec))
+        return FastJSONResponse(content={"ranges": eccentricity_ranges(eccentricities)})
+
+    where_sql, params = spec.compile()
+    async with admission.interactive.admit(), acquire() as conn:
+        rows = await conn.fetch(
+            "SELECT eccentricity_deg, COUNT(*) as count "
+            f"FROM cone_data {where_sql} "
+            "GROUP BY eccentricity_deg ORDER BY eccentricity_deg",
+            *params
+        )
 
     if not rows:
-        return JSONResponse(content={"ranges": []})
+        return FastJSONResponse(content={"ranges": []})
 
     # Group eccentricities into ranges
     eccentricities = []
@@ -326,56 +302,37 @@ async def get_eccentricity_ranges(
                 continue
     eccentricities.sort()
 
-    ranges = []
-    for ecc in eccentricities:
-        # Create a small range around each eccentricity value
-        range_size = 0.1  # 0.1 degree range
-        min_ecc = max(0, ecc - range_size / 2)
-        max_ecc = ecc + range_size / 2
-
-        ranges.append({
-            "min": min_ecc,
-            "max": max_ecc,
-            "label": f"{ecc:.1f}°"
-        })
-
-    return JSONResponse(content={"ranges": ranges})
+    return FastJSONResponse(content={"ranges": eccentricity_ranges(eccentricities)})
 
 
 # 6) Bulk subjects data (eliminates N+1 queries)
 @app.get("/subjects/data")
-async def get_subjects_data():
-    pool = get_pool()
-    async with pool.acquire() as conn:
-        rows = await conn.fetch(
-            """SELECT subject_id, eye, meridian, eccentricity_deg,
-                      cone_spectral_type, cone_x_microns, cone_y_microns,
-                      lm_ratio, scones
-               FROM cone_data
-               ORDER BY subject_id, meridian, eccentricity_deg
-               LIMIT 500000"""
-        )
-    return JSONResponse(content=[dict(r) for r in rows])
+async def get_subjects_data(request: Request):
+    # Held through encoding too: the row list and JSON body are the memory hogs.
+    async with admission.bulk.admit():
+        async with acquire() as conn:
+            rows = await conn.fetch(
+                """SELECT subject_id, eye, meridian, eccentricity_deg,
+                          cone_spectral_type, cone_x_microns, cone_y_microns,
+                          lm_ratio, scones
+                   FROM cone_data
+                   ORDER BY subject_id, meridian, eccentricity_deg
+                   LIMIT 500000"""
+            )
+        return json_response(rows, request)
 
 
 # 7) Upload log
 @app.get("/upload-log")
-async def get_upload_log():
-    pool = get_pool()
-    async with pool.acquire() as conn:
+async def get_upload_log(request: Request):
+    async with acquire() as conn:
         rows = await conn.fetch(
             "SELECT id, uploaded_at, subject_id, eye, event_type, "
-            "commit_message, rows_ingested, uploaded_by "
+            "commit_message, rows_ingested, uploaded_by, "
+            "bytes_ingested, blocks_parsed, parse_ms, convert_ms, delete_ms, insert_ms, rows_per_second, derive_ms "
             "FROM upload_log ORDER BY uploaded_at DESC LIMIT 100"
         )
-    result = []
-    for r in rows:
-        row_dict = dict(r)
-        for k, v in row_dict.items():
-            if isinstance(v, datetime):
-                row_dict[k] = v.isoformat()
-        result.append(row_dict)
-    return JSONResponse(content=result)
+    return json_response(rows, request)
 
 
 # 8) CSV export (streaming)
@@ -383,6 +340,7 @@ async def get_upload_log():
 async def export_cones(
     subject_id: str = Query(...),
     meridian: str = Query(...),
+    eye: Optional[str] = Query(None),
     cone_type: Optional[List[str]] = Query(None, alias="cone_spectral_type"),
     eccentricity_min: Optional[float] = Query(None),
     eccentricity_max: Optional[float] = Query(None),
@@ -391,41 +349,28 @@ async def export_cones(
     if not subject_id or not meridian:
         raise HTTPException(status_code=400, detail="subject_id and meridian are required")
 
-    params = [subject_id, meridian]
-    where_clauses = ["subject_id = $1", "LOWER(meridian) = LOWER($2)"]
-    param_idx = 3
-
-    if cone_type:
-        placeholders = ", ".join(f"${param_idx + i}" for i in range(len(cone_type)))
-        where_clauses.append(f"cone_spectral_type IN ({placeholders})")
-        params.extend(cone_type)
-        param_idx += len(cone_type)
-
-    if eccentricity_min is not None:
-        where_clauses.append(f"eccentricity_deg >= ${param_idx}")
-        params.append(eccentricity_min)
-        param_idx += 1
-
-    if eccentricity_max is not None:
-        where_clauses.append(f"eccentricity_deg <= ${param_idx}")
-        params.append(eccentricity_max)
-        param_idx += 1
-
+    spec = FilterSpec.build(subject_id=subject_id, eye=eye, meridian=meridian,
+                            cone_types=cone_type, eccentricity_min=eccentricity_min,
+                            eccentricity_max=eccentricity_max)
+    where_sql, params = spec.compile()
     params.append(limit)
-
-    where_sql = " AND ".join(where_clauses)
     sql = f"""
         SELECT *
         FROM cone_data
-        WHERE {where_sql}
+        {where_sql}
         ORDER BY cone_x_microns
-        LIMIT ${param_idx};
+        LIMIT ${len(params)};
     """
 
+    # Admit before streaming starts so an overloaded bulk lane can still answer 429.
+    ticket = await admission.bulk.acquire()
+
     async def stream_generator():
-        pool = get_pool()
-        async with pool.acquire() as conn:
-            rows = await conn.fetch(sql, *params)
+        try:
+            # Fetch, then release before the first yield: the client may download slowly, and in
+            # DB_MODE=single the connection would otherwise be held for the whole download.
+            async with acquire() as conn:
+                rows = await conn.fetch(sql, *params)
 
             if not rows:
                 yield b"id,cone_x_microns,cone_y_microns,cone_spectral_type\n"
@@ -436,7 +381,8 @@ async def export_cones(
                            "eccentricity_mm", "ret_mag_factor", "fov", "lm_ratio",
                            "scones", "lcone_density", "mcone_density", "scone_density",
                            "numcones", "nonclass_cones", "cone_origin", "zernike_pupil_diam",
-                           "zernike_measure_wave", "zernike_optim_wave"]
+                           "zernike_measure_wave", "zernike_optim_wave", "eccentricity_x_deg",
+                           "eccentricity_y_deg", "eccentricity_x_mm", "eccentricity_y_mm"]
             cone_fields = [k for k in rows[0].keys() if k not in meta_fields]
 
             header = cone_fields + meta_fields
@@ -463,6 +409,8 @@ async def export_cones(
                 yield buff.getvalue().encode()
                 count += 1
                 await asyncio.sleep(0)
+        finally:
+            ticket.release()
 
     # Create descriptive filename
     cone_types_str = "_".join(cone_type) if cone_type else "all"
@@ -477,9 +425,488 @@ async def export_cones(
         stream_generator(),
         media_type="text/csv",
         headers={"Content-Disposition": f"attachment; filename={filename}"},
+        # Covers the case where the client disconnects before the body starts.
+        background=BackgroundTask(ticket.release),
     )
 
 
+# Wavefront map and RMS from one block's Zernike coefficients
+@app.get("/wavefront")
+async def get_wavefront(
+    request: Request,
+    subject_id: str = Query(...),
+    meridian: str = Query(...),
+    eccentricity_deg: float = Query(...),
+    eye: Optional[str] = Query(None),
+    grid: int = Query(64, ge=8, le=256),
+    pupil_mm: Optional[float] = Query(None, gt=0),
+):
+    # Same +-0.05 deg window as the /eccentricity-ranges labels.
+    spec = FilterSpec.build(subject_id=subject_id, eye=eye, meridian=meridian,
+                            eccentricity_min=eccentricity_deg - 0.05,
+                            eccentricity_max=eccentricity_deg + 0.05)
+    where_sql, params = spec.compile()
+    params.append(eccentricity_deg)
+    async with admission.interactive.admit(), acquire() as conn:
+        row = await conn.fetchrow(
+            f"""SELECT subject_id, eye, meridian, eccentricity_deg, zernike_pupil_diam,
+                       zernike_measure_wave, zernike_optim_wave, zernike_coeffs
+                FROM block_optics
+                {where_sql}
+                ORDER BY abs(eccentricity_deg - ${len(params)}), id DESC
+                LIMIT 1""",
+            *params,
+        )
+    if row is None:
+        raise HTTPException(status_code=404, detail="No Zernike coefficients for this block")
+
+    from app import zernike
+
+    # Evaluate over a smaller centred pupil when asked; never extrapolate past the fitted one.
+    fitted = row["zernike_pupil_diam"]
+    fraction = 1.0
+    if pupil_mm is not None and fitted:
+        if pupil_mm > fitted:
+            raise HTTPException(status_code=400, detail=f"pupil_mm exceeds the fitted pupil ({fitted} mm)")
+        # Rounded up to a twentieth of the fitted pupil, so the basis cache sees few distinct pupils.
+        fraction = zernike.pupil_step(pupil_mm / fitted)
+
+    with stage("zernike"):
+        # A new basis is tenths of a second of NumPy at grid=256; keep it off the event loop.
+        result = await asyncio.to_thread(zernike.wavefront, list(row["zernike_coeffs"]), grid, fraction)
+    return json_response({
+        "subject_id": row["subject_id"],
+        "eye": row["eye"],
+        "meridian": row["meridian"],
+        "eccentricity_deg": row["eccentricity_deg"],
+        "pupil_diameter_mm": fitted,
+        "evaluated_pupil_mm": fitted * fraction if fitted else None,
+        "measured_wavelength_nm": row["zernike_measure_wave"],
+        "optimized_wavelength_nm": row["zernike_optim_wave"],
+        "coefficients": row["zernike_coeffs"],
+        "grid": grid,
+        "rms": result["rms"],
+        "rms_higher_order": result["rms_higher_order"],
+        "peak_to_valley": result["peak_to_valley"],
+        # grid x grid, row 0 at the top of the pupil; null outside it.
+        "wavefront": result["map"],
+    }, request)
+
+
+# Per-block analytics (/spacing, /density) over a cached spatial index
+async def _block_cones(spec: FilterSpec, eccentricity_deg: float):
+    """x, y, type arrays of the block nearest `eccentricity_deg` within the spec's window."""
+    import numpy as np
+
+    store = _columnar_store()
+    if store is not None:
+        with stage("columnar"):
+            x, y, types, ecc = store.positions(store.mask(spec))
+    else:
+        where_sql, params = spec.compile()
+        async with admission.interactive.admit(), acquire() as conn:
+            rows = await conn.fetch(
+                "SELECT cone_x_microns, cone_y_microns, cone_spectral_type, eccentricity_deg "
+                f"FROM cone_data {where_sql}",
+                *params,
+            )
+        x = np.array([r["cone_x_microns"] for r in rows], dtype=float)
+        y = np.array([r["cone_y_microns"] for r in rows], dtype=float)
+        types = np.array([r["cone_spectral_type"] for r in rows], dtype=object)
+        ecc = np.array([r["eccentricity_deg"] for r in rows], dtype=float)
+    if len(ecc) == 0:
+        return None
+    nearest = ecc[np.argmin(np.abs(ecc - eccentricity_deg))]
+    block = ecc == nearest
+    return x[block], y[block], types[block], float(nearest)
+
+
+async def _block_report(request: Request, subject_id: str, eye: str, meridian: str,
+                        eccentricity_deg: float, variant: tuple, build):
+    """Serve `build(index) -> dict` for one block from blocks.cache, computing it at most once."""
+    from app import blocks, columnar
+
+    # Same +-0.05 deg window as the /eccentricity-ranges labels.
+    spec = FilterSpec.build(subject_id=subject_id, eye=eye, meridian=meridian,
+                            eccentricity_min=eccentricity_deg - 0.05,
+                            eccentricity_max=eccentricity_deg + 0.05)
+    key = (spec.subject_id, spec.eye, spec.meridian, round(eccentricity_deg, 2))
+    store = _columnar_store()
+    if store is not None:
+        version = store.version
+    else:
+        async with acquire() as conn:
+            version = await conn.fetchval(columnar.VERSION_SQL)
+
+    payload = blocks.cache.report(version, key, variant)
+    if payload is not None:
+        return payload.response(request)
+
+    async def run() -> Payload:
+        index = blocks.cache.index(version, key)
+        if index is None:
+            block = await _block_cones(spec, eccentricity_deg)
+            if block is None:
+                raise HTTPException(status_code=404, detail="No cones for this block")
+            # KD-trees, Voronoi cells and density grids are NumPy/SciPy work: keep it off the loop.
+            # A BlockIndex is read-only once built, so reports can share it across threads.
+            with stage("index"):
+                index = await asyncio.to_thread(blocks.BlockIndex, *block)
+            blocks.cache.store_index(version, key, index)
+        with stage(variant[0]):
+            report = await asyncio.to_thread(build, index)
+        # The cache key is normalised, so the body echoes the normalised values, not this caller's.
+        payload = Payload.from_content({
+            "subject_id": spec.subject_id,
+            "eye": spec.eye,
+            "meridian": spec.meridian,
+            "eccentricity_deg": index.eccentricity_deg,
+            "version": version,
+            **report,
+        })
+        blocks.cache.store_report(version, key, variant, payload)
+        return payload
+
+    payload = await _read_flight.do((version, key, variant), run)
+    return payload.response(request)
+
+
+# Nearest-neighbour and Voronoi cone spacing for one block
+@app.get("/spacing")
+async def get_spacing(
+    request: Request,
+    subject_id: str = Query(...),
+    eye: str = Query(...),
+    meridian: str = Query(...),
+    eccentricity_deg: float = Query(...),
+    bins: int = Query(40, ge=5, le=200),
+):
+    from app import spacing
+
+    return await _block_report(request, subject_id, eye, meridian, eccentricity_deg,
+                               ("spacing", bins), lambda index: spacing.analyse(index, bins))
+
+
+# Density heatmap grids for one block, per cone type
+@app.get("/density")
+async def get_density(
+    request: Request,
+    subject_id: str = Query(...),
+    eye: str = Query(...),
+    meridian: str = Query(...),
+    eccentricity_deg: float = Query(...),
+    cells: int = Query(32, ge=4, le=256),
+    method: str = Query("hist"),
+    bandwidth: Optional[float] = Query(None, gt=0),
+):
+    from app import density
+
+    if method not in density.METHODS:
+        raise HTTPException(status_code=400, detail=f"method must be one of {', '.join(density.METHODS)}")
+    return await _block_report(request, subject_id, eye, meridian, eccentricity_deg,
+                               ("density", cells, method, bandwidth),
+                               lambda index: density.grid(index, cells, method, bandwidth))
+
+
+# One subject's eye in montage coordinates (mm from the fovea, +x temporal, +y superior; see app/retina.py)
+@app.get("/montage", response_model=PlotData)
+async def get_montage(
+    request: Request,
+    subject_id: str = Query(...),
+    eye: str = Query(...),
+    cone_type: Optional[List[str]] = Query(None, alias="cone_spectral_type"),
+    x_min: Optional[float] = Query(None),
+    x_max: Optional[float] = Query(None),
+    y_min: Optional[float] = Query(None),
+    y_max: Optional[float] = Query(None),
+    dedupe: bool = Query(False),
+    limit: int = Query(100000, gt=0, le=500000),
+):
+    spec = FilterSpec.build(subject_id=subject_id, eye=eye, cone_types=cone_type)
+    box = (x_min, x_max, y_min, y_max)
+    store = _columnar_store()
+    if store is not None:
+        with stage("columnar"):
+            data = store.montage(store.mask(spec), box, limit, dedupe)
+        return json_response(data, request)
+
+    where_sql, params = spec.compile()
+    clauses = ["retinal_x_mm IS NOT NULL", "retinal_y_mm IS NOT NULL"]
+    if dedupe:
+        # Cones also imaged by a neighbouring block appear once (see app/overlap.py).
+        clauses.append("NOT EXISTS (SELECT 1 FROM cone_overlap o WHERE o.cone_id = cone_data.id)")
+    for column, op, value in (("retinal_x_mm", ">=", x_min), ("retinal_x_mm", "<=", x_max),
+                              ("retinal_y_mm", ">=", y_min), ("retinal_y_mm", "<=", y_max)):
+        if value is not None:
+            params.append(value)
+            clauses.append(f"{column} {op} ${len(params)}")
+    params.append(limit)
+    sql = f"""
+        SELECT DISTINCT ON (retinal_x_mm, retinal_y_mm, cone_spectral_type)
+               retinal_x_mm AS x, retinal_y_mm AS y, cone_spectral_type AS cone_type
+        FROM cone_data
+        {where_sql} AND {' AND '.join(clauses)}
+        ORDER BY retinal_x_mm, retinal_y_mm, cone_spectral_type
+        LIMIT ${len(params)};
+    """
+
+    async def run() -> Payload:
+        async with admission.interactive.admit(), acquire() as conn:
+            rows = await conn.fetch(sql, *params)
+
+        with stage("convert"):
+            x, y, ctype = [], [], []
+            for r in rows:
+                x.append(r["x"])
+                y.append(r["y"])
+                ctype.append(r["cone_type"])
+
+        return Payload.from_content({"x": x, "y": y, "cone_type": ctype})
+
+    payload = await _read_flight.do(("montage", spec, box, dedupe, limit), run)
+    return payload.response(request)
+
+
+# Montage map tiles (z/x/y) for one subject's eye, rendered on first request and cached on disk
+@app.get("/tiles/{subject_id}/{eye}/{z}/{x}/{tile}")
+async def get_tile(request: Request, subject_id: str, eye: str, z: int, x: int, tile: str):
+    import numpy as np
+
+    from app import columnar, tiles
+
+    y_text, _, fmt = tile.partition(".")
+    if fmt not in tiles.FORMATS or not y_text.isdigit():
+        raise HTTPException(status_code=404, detail=f"Tile must be <y>.{{{','.join(tiles.FORMATS)}}}")
+    y = int(y_text)
+    if not tiles.valid(z, x, y):
+        raise HTTPException(status_code=404, detail=f"No tile {z}/{x}/{y} (max zoom {tiles.MAX_ZOOM})")
+    eye = eye.upper()
+    spec = FilterSpec.build(subject_id=subject_id, eye=eye)
+    store = _columnar_store()
+    if store is not None:
+        version = store.version
+    else:
+        async with acquire() as conn:
+            version = await conn.fetchval(columnar.VERSION_SQL)
+    path = tiles.cache.path(version, subject_id, eye, z, x, y, fmt)
+
+    async def render() -> bytes:
+        data = tiles.cache.get(path)
+        if data is not None:
+            return data
+        # The cache path comes from the URL: check the eye exists before anything is written under it.
+        box = tiles.bounds(z, x, y)
+        if store is not None:
+            with stage("columnar"):
+                mask = store.mask(spec)
+                if not mask.any():
+                    raise HTTPException(status_code=404, detail=f"No data for {subject_id} {eye}")
+                rx, ry, types = store.retinal_positions(mask, box)
+        else:
+            async with admission.interactive.admit(), acquire() as conn:
+                if not await conn.fetchval(tiles.EXISTS_SQL, subject_id, eye):
+                    raise HTTPException(status_code=404, detail=f"No data for {subject_id} {eye}")
+                rows = await conn.fetch(tiles.TILE_SQL, subject_id, eye, *box)
+            rx = np.array([r["retinal_x_mm"] for r in rows], dtype=float)
+            ry = np.array([r["retinal_y_mm"] for r in rows], dtype=float)
+            types = np.array([r["cone_spectral_type"] for r in rows], dtype=object)
+        with stage("render"):
+            counts = tiles.rasterize(rx, ry, types, z, x, y)
+            if fmt == "png":
+                data = tiles.render_png(counts, z)
+            else:
+                data = dumps(tiles.render_json(counts, z, x, y))
+        # Most of the grid is empty retina; those tiles are cheap to redraw and not worth a file each.
+        if counts[0].any():
+            tiles.cache.put(version, path, data)
+        return data
+
+    data = await _read_flight.do(("tile", path), render)
+    return Payload(data, tiles.MEDIA_TYPES[fmt]).response(request if fmt == "json" else None)
+
+
+# Cross-block overlap for one subject's eye: unique cone count and which blocks share cones
+@app.get("/overlap")
+async def get_overlap(
+    request: Request,
+    subject_id: str = Query(...),
+    eye: str = Query(...),
+):
+    eye = eye.upper()
+    async with admission.interactive.admit(), acquire() as conn:
+        total = await conn.fetchval(
+            "SELECT COUNT(*) FROM cone_data WHERE subject_id = $1 AND UPPER(eye) = $2",
+            subject_id, eye,
+        )
+        if not total:
+            raise HTTPException(status_code=404, detail=f"No data for {subject_id} {eye}")
+        pairs = await conn.fetch(
+            """SELECT d.meridian, d.eccentricity_deg,
+                      c.meridian AS canonical_meridian, c.eccentricity_deg AS canonical_eccentricity_deg,
+                      COUNT(*) AS cones, AVG(o.distance_um) AS mean_distance_um
+               FROM cone_overlap o
+               JOIN cone_data d ON d.id = o.cone_id
+               JOIN cone_data c ON c.id = o.canonical_id
+               WHERE o.subject_id = $1 AND UPPER(o.eye) = $2
+               GROUP BY 1, 2, 3, 4
+               ORDER BY cones DESC""",
+            subject_id, eye,
+        )
+    duplicates = sum(r["cones"] for r in pairs)
+    return json_response({
+        "subject_id": subject_id,
+        "eye": eye,
+        "tolerance_microns": settings.overlap_tolerance_microns,
+        "cones": total,
+        "duplicates": duplicates,
+        "unique_cones": total - duplicates,
+        "block_pairs": pairs,
+    }, request)
+
+
+# Stored S/L/M randomness statistics for one block (computed by app/randomness.py)
+@app.get("/randomness")
+async def get_randomness(
+    request: Request,
+    subject_id: str = Query(...),
+    eye: str = Query(...),
+    meridian: str = Query(...),
+    eccentricity_deg: float = Query(...),
+):
+    async with admission.interactive.admit(), acquire() as conn:
+        rows = await conn.fetch(
+            """SELECT * FROM block_randomness
+               WHERE subject_id = $1 AND UPPER(eye) = $2 AND LOWER(meridian) = $3
+                 AND eccentricity_deg = (
+                     SELECT eccentricity_deg FROM block_randomness
+                     WHERE subject_id = $1 AND UPPER(eye) = $2 AND LOWER(meridian) = $3
+                       AND abs(eccentricity_deg - $4) <= 0.05
+                     ORDER BY abs(eccentricity_deg - $4) LIMIT 1
+                 )
+               ORDER BY cone_type""",
+            subject_id, eye.upper(), meridian.lower(), eccentricity_deg,
+        )
+    if not rows:
+        raise HTTPException(status_code=404, detail="No randomness statistics for this block")
+    return json_response({
+        "subject_id": subject_id,
+        "eye": eye,
+        "meridian": meridian,
+        "eccentricity_deg": rows[0]["eccentricity_deg"],
+        "types": {r["cone_type"]: r for r in rows},
+    }, request)
+
+
+# Cohort normative curves (density, L/M ratio, % S-cones vs eccentricity), optionally with one subject's z-scores
+@app.get("/cohort")
+async def get_cohort(
+    request: Request,
+    meridian: Optional[str] = Query(None),
+    age_min: Optional[float] = Query(None, ge=0),
+    age_max: Optional[float] = Query(None, ge=0),
+    by_age: bool = Query(False),
+    subject_id: Optional[str] = Query(None),
+):
+    if age_min is not None and age_max is not None and age_min > age_max:
+        raise HTTPException(status_code=400, detail="age_min must not exceed age_max")
+    age_lo = cohort.age_bin(age_min) if age_min is not None else None
+    age_hi = cohort.age_bin(age_max) if age_max is not None else None
+    meridian = meridian.lower() if meridian else None
+
+    async with admission.interactive.admit(), acquire() as conn:
+        rows = await conn.fetch(cohort.curves_sql(by_age), meridian, age_lo, age_hi)
+        if subject_id is not None:
+            # z-scores are always against the pooled (not per-age) bins.
+            pooled = rows if not by_age else await conn.fetch(cohort.curves_sql(False), meridian, age_lo, age_hi)
+            subject_blocks = await conn.fetch(cohort.SUBJECT_BLOCKS_SQL, subject_id)
+    content = {
+        "meridian": meridian,
+        "age_bins": [age_lo, age_hi],
+        "age_bin_years": cohort.AGE_BIN_YEARS,
+        "curves": cohort.curves(rows),
+    }
+    if subject_id is not None:
+        if not subject_blocks:
+            raise HTTPException(status_code=404, detail=f"No data for subject {subject_id}")
+        if meridian:
+            subject_blocks = [b for b in subject_blocks if b["meridian"].lower() == meridian]
+        content["subject"] = {
+            "subject_id": subject_id,
+            "blocks": cohort.compare(subject_blocks, cohort.curves(pooled)),
+        }
+    return json_response(content, request)
+
+
+# Coalescing counters and admission lane queue depth / wait times
+@app.get("/stats")
+async def get_stats():
+    from app import artifacts, blocks, tiles
+
+    return {
+        "database": database.stats(),
+        "coalescing": _read_flight.stats(),
+        "block_cache": blocks.cache.stats(),
+        "tile_cache": tiles.cache.stats(),
+        "static_export": artifacts.last_run,
+        "lanes": {
+            "interactive": admission.interactive.stats(),
+            "bulk": admission.bulk.stats(),
+        },
+    }
+
+
+# Prometheus scrape endpoint
+def _pool_sizes() -> dict:
+    pool = database.pool
+    if pool is None:
+        return {}
+    size, idle = pool.get_size(), pool.get_idle_size()
+    return {("in_use",): size - idle, ("idle",): idle, ("max",): pool.get_max_size()}
+
+
+def _lane_samples(field: str) -> dict:
+    return {(lane.name,): getattr(lane, field) for lane in (admission.interactive, admission.bulk)}
+
+
+metrics.registry.register(metrics.Collected(
+    "db_pool_connections", "asyncpg pool connections by state.", _pool_sizes, ("state",),
+))
+metrics.registry.register(metrics.Collected(
+    "admission_active", "Requests running in each admission lane.",
+    lambda: _lane_samples("active"), ("lane",),
+))
+metrics.registry.register(metrics.Collected(
+    "admission_queued", "Requests waiting for each admission lane.",
+    lambda: _lane_samples("waiting"), ("lane",),
+))
+metrics.registry.register(metrics.Collected(
+    "admission_admitted_total", "Requests admitted per lane.",
+    lambda: _lane_samples("admitted"), ("lane",), kind="counter",
+))
+metrics.registry.register(metrics.Collected(
+    "admission_rejected_total", "Requests refused with 429 per lane.",
+    lambda: _lane_samples("rejected"), ("lane",), kind="counter",
+))
+metrics.registry.register(metrics.Collected(
+    "admission_wait_seconds_total", "Total time spent queued per lane.",
+    lambda: _lane_samples("wait_seconds_total"), ("lane",), kind="counter",
+))
+metrics.registry.register(metrics.Collected(
+    "coalesce_requests_total", "Coalesced read requests: executed ran a query, deduplicated shared one.",
+    lambda: {("executed",): _read_flight.executed, ("deduplicated",): _read_flight.deduplicated},
+    ("result",), kind="counter",
+))
+metrics.registry.register(metrics.Collected(
+    "columnar_rows", "Rows held by the in-memory columnar engine (absent when disabled).",
+    lambda: {(): store.size} if (store := _columnar_store()) is not None else {},
+))
+
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+
 # 7) Admin login
 class LoginRequest(BaseModel):
     password: str
@@ -489,24 +916,44 @@ class LoginRequest(BaseModel):
 async def admin_login(body: LoginRequest):
     if body.password != settings.admin_password:
         raise HTTPException(status_code=401, detail="Invalid password")
-    token = secrets.token_hex(32)
-    _admin_sessions.add(token)
-    return {"token": token}
+    return {"token": issue_token()}
 
 
 def _require_admin(authorization: Optional[str]):
     if not authorization or not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Unauthorized")
     token = authorization[7:]
-    if token not in _admin_sessions:
+    if not verify_token(token):
         raise HTTPException(status_code=401, detail="Unauthorized")
 
 
+# Profiles captured with the X-Profile header
+@app.get("/admin/profiles")
+async def admin_profiles(authorization: Optional[str] = Header(None)):
+    _require_admin(authorization)
+    return profiling.list_profiles()
+
+
+@app.get("/admin/profiles/{profile_id}/{kind}")
+async def admin_profile_file(
+    profile_id: str,
+    kind: str,
+    authorization: Optional[str] = Header(None),
+):
+    _require_admin(authorization)
+    path, media_type = profiling.profile_file(profile_id, kind)
+    filename = f"profile-{profile_id}.{'pstats' if kind == 'pstats' else kind + '.txt'}"
+    return FileResponse(path, media_type=media_type, filename=filename)
+
+
 def _parse_upload(content: bytes, filename: str):
     if not (filename or "").lower().endswith(".csv"):
         raise HTTPException(status_code=400, detail="Only CSV files are supported")
+    from app.csv_parser import parse_csv_bytes
+
     try:
-        df = parse_csv_bytes(content)
+        with stage("parse"):
+            df = parse_csv_bytes(content)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Failed to parse CSV: {e}")
     if df.empty:
@@ -514,6 +961,38 @@ def _parse_upload(content: bytes, filename: str):
     return df
 
 
+# Randomness job: queue one (all blocks, or one subject's) and poll its progress
+@app.post("/admin/randomness")
+async def admin_randomness(
+    background_tasks: BackgroundTasks,
+    subject_id: Optional[str] = Query(None),
+    permutations: int = Query(999, ge=99, le=9999),
+    force: bool = Query(False),
+    authorization: Optional[str] = Header(None),
+):
+    _require_admin(authorization)
+    from app import randomness
+
+    # Claimed in the database, so a POST to any worker (or a CLI run) is refused while one runs.
+    async with acquire() as conn:
+        if not await randomness.claim(conn, subject_id, permutations):
+            raise HTTPException(status_code=409, detail="A randomness job is already running")
+    background_tasks.add_task(
+        randomness.run_job, acquire, subject_id, permutations,
+        workers=settings.analysis_workers, force=force, log=lambda line: None,
+    )
+    return {"queued": True, "subject_id": subject_id, "permutations": permutations}
+
+
+@app.get("/admin/randomness")
+async def admin_randomness_status(authorization: Optional[str] = Header(None)):
+    _require_admin(authorization)
+    from app import randomness
+
+    async with acquire() as conn:
+        return await randomness.job_status(conn)
+
+
 # 8) Admin CSV validate (dry-run — no DB writes)
 @app.post("/admin/validate")
 async def admin_validate(
@@ -528,6 +1007,11 @@ async def admin_validate(
     meridians = sorted(df["meridian"].dropna().unique().tolist()) if "meridian" in df.columns else []
     cone_types = sorted(df["cone_spectral_type"].dropna().unique().tolist()) if "cone_spectral_type" in df.columns else []
 
+    from app.validation import check_blocks
+
+    with stage("quality"):
+        quality = check_blocks(df)
+
     return {
         "valid": True,
         "row_count": len(df),
@@ -535,6 +1019,8 @@ async def admin_validate(
         "meridians": meridians,
         "cone_types": cone_types,
         "filename": file.filename,
+        # Per-block data-quality report; "valid" only means the file parsed.
+        "quality": quality,
     }
 
 
@@ -544,9 +1030,63 @@ async def _ingest_and_log(
     subject_ids: list[str],
     eye_vals: list[str],
     commit_message: Optional[str],
+    stage_seconds: dict[str, float],
+    bytes_ingested: int,
+    blocks_parsed: int,
+    block_optics: list[tuple],
+):
+    try:
+        await _ingest(rows, subject_ids, eye_vals, commit_message, stage_seconds,
+                      bytes_ingested, blocks_parsed, block_optics)
+    except Exception:
+        metrics.ingest_runs.inc("failure")
+        raise
+    metrics.observe_ingest(stage_seconds, len(rows))
+
+    # Postgres is the source of truth; rebuild the read copy only after commit.
+    if settings.columnar_engine:
+        from app import columnar
+
+        await columnar.refresh(get_pool())
+
+    if settings.static_export_dir:
+        await _export_static(subject_ids)
+
+
+async def _export_static(subject_ids: list[str]):
+    """Re-export the uploaded subjects' static files (app/artifacts.py)."""
+    from app import artifacts, columnar
+
+    store = _columnar_store() if settings.columnar_engine else None
+    if store is None:
+        # No admission lane: a full one answers 429, and there is no client here to retry, so
+        # the export would just be skipped. One load per upload is bounded by the uploads.
+        # load_store builds the arrays in a worker thread.
+        async with acquire() as conn:
+            store = await columnar.load_store(conn)
+    await asyncio.to_thread(artifacts.build, store, settings.static_export_dir, subject_ids)
+
+
+async def _ingest(
+    rows: list[tuple],
+    subject_ids: list[str],
+    eye_vals: list[str],
+    commit_message: Optional[str],
+    stage_seconds: dict[str, float],
+    bytes_ingested: int,
+    blocks_parsed: int,
+    block_optics: list[tuple],
 ):
-    pool = get_pool()
-    async with pool.acquire() as conn:
+    from app import overlap
+
+    # Overlap matching needs only the parsed rows, so it runs in a thread before a
+    # connection is taken; the transaction below just writes its result.
+    started = time.perf_counter()
+    pending, overlap_rows = await asyncio.to_thread(
+        overlap.detect_pending, rows, settings.overlap_tolerance_microns)
+    match_seconds = time.perf_counter() - started
+
+    async with acquire() as conn:
         # Detection: check if any (subject_id, eye) pair already exists
         existing = await conn.fetch(
             "SELECT 1 FROM cone_data WHERE subject_id = ANY($1::text[]) AND eye = ANY($2::text[]) LIMIT 1",
@@ -564,6 +1104,9 @@ async def _ingest_and_log(
         async with conn.transaction():
             # Replace semantics: uploading AO001/OS again wipes the old AO001/OS rows
             # before inserting the fresh set, so repeat uploads don't stack duplicates.
+            started = time.perf_counter()
+            # The replaced blocks' share of the cohort aggregates, read before the delete.
+            replaced = await conn.fetch(cohort.BLOCKS_SQL, pair_subjects, pair_eyes) if upload_pairs else []
             if upload_pairs:
                 await conn.execute(
                     """DELETE FROM cone_data
@@ -572,27 +1115,73 @@ async def _ingest_and_log(
                        )""",
                     pair_subjects, pair_eyes,
                 )
+                await conn.execute(
+                    """DELETE FROM block_optics
+                       WHERE (subject_id, eye) IN (
+                           SELECT s, e FROM unnest($1::text[], $2::text[]) AS t(s, e)
+                       )""",
+                    pair_subjects, pair_eyes,
+                )
+                await conn.execute(overlap.DELETE_SQL, pair_subjects, pair_eyes)
+            stage_seconds["delete"] = time.perf_counter() - started
+
+            started = time.perf_counter()
             await conn.executemany(
                 """INSERT INTO cone_data (
                     cone_x_microns, cone_y_microns, cone_spectral_type,
                     subject_id, eye, meridian, eccentricity_deg, eccentricity_mm,
                     lm_ratio, scones, lcone_density, mcone_density, scone_density,
                     numcones, nonclass_cones, age, fov, ret_mag_factor,
-                    cone_origin, zernike_pupil_diam, zernike_measure_wave, zernike_optim_wave
-                ) VALUES ($1,$2,$3,$4,$5,$6,$7,$8,$9,$10,$11,$12,$13,$14,$15,$16,$17,$18,$19,$20,$21,$22)""",
+                    cone_origin, zernike_pupil_diam, zernike_measure_wave, zernike_optim_wave,
+                    eccentricity_x_deg, eccentricity_y_deg, eccentricity_x_mm, eccentricity_y_mm,
+                    retinal_x_mm, retinal_y_mm
+                ) VALUES ($1,$2,$3,$4,$5,$6,$7,$8,$9,$10,$11,$12,$13,$14,$15,$16,$17,$18,$19,$20,$21,$22,
+                          $23,$24,$25,$26,$27,$28)""",
                 rows,
             )
+            if block_optics:
+                await conn.executemany(
+                    """INSERT INTO block_optics (
+                        subject_id, eye, meridian, eccentricity_deg,
+                        zernike_pupil_diam, zernike_measure_wave, zernike_optim_wave, zernike_coeffs
+                    ) VALUES ($1,$2,$3,$4,$5,$6,$7,$8)""",
+                    block_optics,
+                )
+            stage_seconds["insert"] = time.perf_counter() - started
+            # rows_per_second covers parse through insert, as it always has; derive is reported on its own.
+            total_seconds = sum(stage_seconds.values())
+
+            # Per-subject upkeep (cohort sums, overlap re-match), timed apart so it can't skew insert_ms.
+            started = time.perf_counter()
+            await cohort.apply(conn, cohort.deltas(replaced, -1), cohort.deltas(cohort.blocks_from_rows(rows)))
+            if upload_pairs:
+                # Needs the new rows' ids, so it runs after the insert in the same transaction.
+                written = await overlap.insert_pending(conn, pair_subjects, pair_eyes, overlap_rows, pending)
+                if written is None:
+                    # The ids didn't line up with the upload (another writer on these pairs): match what's stored.
+                    await overlap.refresh(conn, pair_subjects, pair_eyes, settings.overlap_tolerance_microns)
+            stage_seconds["derive"] = match_seconds + time.perf_counter() - started
             # Log in same transaction — no ghost entries if cone_data INSERT fails
             await conn.execute(
                 """INSERT INTO upload_log
-                   (subject_id, eye, event_type, commit_message, rows_ingested, uploaded_by)
-                   VALUES ($1, $2, $3, $4, $5, $6)""",
+                   (subject_id, eye, event_type, commit_message, rows_ingested, uploaded_by,
+                    bytes_ingested, blocks_parsed, parse_ms, convert_ms, delete_ms, insert_ms,
+                    rows_per_second, derive_ms)
+                   VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14)""",
                 subject_ids[0] if subject_ids else None,
                 eye_vals[0] if eye_vals else None,
                 event_type,
                 commit_message[:500] if commit_message else None,
                 len(rows),
                 "admin",
+                bytes_ingested,
+                blocks_parsed,
+                stage_seconds["parse"] * 1000,
+                stage_seconds["convert"] * 1000,
+                stage_seconds["delete"] * 1000,
+                stage_seconds["insert"] * 1000,
+                len(rows) / total_seconds if total_seconds > 0 else None,
+                stage_seconds["derive"] * 1000,
             )
 
 
@@ -606,14 +1195,24 @@ async def admin_upload(
     _require_admin(authorization)
     content = await file.read()  # bytes read BEFORE task queued
     filename = file.filename or ""
+    started = time.perf_counter()
+    from app.csv_parser import to_row
+
     df = _parse_upload(content, filename)  # validate synchronously
-    rows = [to_row(r) for _, r in df.iterrows()]
+    parse_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    with stage("convert"):
+        rows = [to_row(r) for _, r in df.iterrows()]
+    convert_seconds = time.perf_counter() - started
 
     subjects = sorted(df["subject_id"].dropna().unique().tolist()) if "subject_id" in df.columns else []
     eyes = sorted(df["eye"].dropna().unique().tolist()) if "eye" in df.columns else []
 
     background_tasks.add_task(
-        _ingest_and_log, rows, subjects, eyes, commit_message
+        _ingest_and_log, rows, subjects, eyes, commit_message,
+        {"parse": parse_seconds, "convert": convert_seconds},
+        len(content), df.attrs.get("blocks_parsed", 0), df.attrs.get("block_optics", []),
     )
     return {"queued": True, "row_count": len(rows), "subjects": subjects}
 
@@ -0,0 +1,160 @@
+"""Prometheus text-format metrics for /metrics.
+
+Everything runs on the event loop thread, so counters and histograms are
+plain attribute updates with no locks. An observation is one bisect and two
+increments; label tuples index pre-created series, so the hot path
+allocates nothing beyond the first request on a new route. Gauges that
+already live elsewhere (pool size, lane queues, coalescing counters) are
+read at scrape time instead of being mirrored here.
+
+Each uvicorn worker keeps its own numbers; aggregate across workers in
+Prometheus with sum().
+"""
+from bisect import bisect_left
+from typing import Callable
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+INGEST_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _labels(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+    inner = ",".join(f'{n}="{str(v)}"' for n, v in zip(names, values))
+    return "{" + inner + "}"
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1.0):
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in self.values.items():
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class _Series:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, n: int):
+        self.counts = [0] * (n + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, buckets: tuple, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.labelnames = labelnames
+        self.series: dict[tuple, _Series] = {}
+
+    def observe(self, value: float, *labels):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = _Series(len(self.buckets))
+        series.counts[bisect_left(self.buckets, value)] += 1
+        series.sum += value
+        series.count += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        names = self.labelnames + ("le",)
+        for labels, series in self.series.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets, series.counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_labels(names, labels + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(names, labels + ('+Inf',))} {series.count}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {series.sum}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {series.count}")
+        return lines
+
+
+class Collected:
+    """Samples produced at scrape time by `collect()`, for values kept elsewhere.
+
+    `kind` is the Prometheus type to declare: "gauge", or "counter" when the
+    source is a monotonically increasing total.
+    """
+
+    def __init__(self, name: str, documentation: str, collect: Callable[[], dict],
+                 labelnames: tuple[str, ...] = (), kind: str = "gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.collect = collect
+        self.labelnames = labelnames
+        self.kind = kind
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in self.collect().items():
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+request_seconds = registry.register(Histogram(
+    "http_request_duration_seconds", "Request latency by route.",
+    LATENCY_BUCKETS, ("method", "route", "status"),
+))
+response_bytes = registry.register(Histogram(
+    "http_response_size_bytes", "Response body size by route (after compression).",
+    SIZE_BUCKETS, ("method", "route"),
+))
+ingest_stage_seconds = registry.register(Histogram(
+    "ingest_stage_duration_seconds", "Time spent in each ingestion stage.",
+    INGEST_BUCKETS, ("stage",),
+))
+ingest_rows = registry.register(Counter(
+    "ingest_rows_total", "Rows written to cone_data by ingestion.",
+))
+ingest_runs = registry.register(Counter(
+    "ingest_runs_total", "Completed ingestions by outcome.", ("outcome",),
+))
+_last_ingest = {"rows_per_second": 0.0}
+registry.register(Collected(
+    "ingest_last_rows_per_second", "Insert throughput of the most recent ingestion.",
+    lambda: {(): _last_ingest["rows_per_second"]},
+))
+
+
+def observe_request(method: str, route: str, status: int, seconds: float, size: int):
+    request_seconds.observe(seconds, method, route, status)
+    response_bytes.observe(size, method, route)
+
+
+def observe_ingest(stages: dict[str, float], rows: int):
+    for stage, seconds in stages.items():
+        ingest_stage_seconds.observe(seconds, stage)
+    ingest_rows.inc(amount=rows)
+    ingest_runs.inc("success")
+    insert_seconds = stages.get("insert", 0.0)
+    if insert_seconds > 0:
+        _last_ingest["rows_per_second"] = rows / insert_seconds
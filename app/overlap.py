@@ -0,0 +1,353 @@
+"""Cross-block overlap detection: one canonical row per physical cone.
+
+Neighbouring blocks of an eye can image the same patch of retina, so a
+whole-retina count or montage would see those cones twice. app/dedupe_cones
+only catches exact repeats within a block; this module matches cones
+across blocks in montage coordinates (retinal_x_mm / retinal_y_mm, see
+app/retina.py).
+
+Per (subject, eye), vectorized within each pair of neighbouring blocks:
+
+1. Registration: the stated eccentricities place a block only to within
+   tens of microns, far more than the spacing of cones, so every cone
+   within SEARCH_RADIUS of a cone of the other block is a candidate (spatial
+   hash of cell side SEARCH_RADIUS, sorted keys, searchsorted) and their
+   displacements vote for the offset between the two blocks. Cones the
+   blocks really share all agree on one offset; chance neighbours spread
+   out. A block pair whose best offset doesn't stand clearly above chance
+   (registration_offset) is treated as not overlapping.
+2. Only pairs within `tolerance` of that offset are kept, and of those
+   only mutual nearest neighbours, so in a dense mosaic a cone can't be
+   matched to several neighbours of its twin.
+3. Connected components of the matches are one physical cone each; the
+   lowest id is canonical, as in app/dedupe_cones.
+
+cone_overlap holds one row per non-canonical cone: (cone_id, canonical_id).
+A cone without a row is canonical. Aggregates drop the duplicates with
+`NOT EXISTS (SELECT 1 FROM cone_overlap o WHERE o.cone_id = cone_data.id)`.
+Uploads refresh the mapping of the (subject, eye) pairs they replace. A
+full rebuild, e.g. with a different tolerance, is
+
+    DATABASE_URL=... python -m app.overlap [--tolerance MICRONS] [--apply]
+
+Consumers keep duplicates by default (/montage?dedupe=true drops them)
+until the matcher has been checked against blocks known to overlap.
+"""
+import argparse
+import asyncio
+import os
+from typing import Optional
+
+import asyncpg
+import numpy as np
+from scipy.ndimage import uniform_filter
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+DEFAULT_TOLERANCE = 1.0  # microns
+# Largest registration error (microns) between two blocks that matching allows for.
+SEARCH_RADIUS = 60.0
+# A block pair's offset needs at least this many cone pairs agreeing on it...
+MIN_SUPPORT = 10
+# ...standing this many standard deviations above the pairs that agree by chance,
+MIN_SIGNIFICANCE = 8.0
+# judged from the displacements within this many microns of it.
+BACKGROUND_MICRONS = 5.0
+# Own cell plus half of the 8 neighbours: each unordered cell pair is visited once.
+FORWARD_CELLS = ((0, 0), (1, -1), (1, 0), (1, 1), (0, 1))
+
+CONES_SQL = """
+    SELECT id, subject_id, eye, meridian, eccentricity_deg, retinal_x_mm, retinal_y_mm
+    FROM cone_data
+    WHERE (subject_id, eye) IN (SELECT s, e FROM unnest($1::text[], $2::text[]) AS t(s, e))
+      AND retinal_x_mm IS NOT NULL AND retinal_y_mm IS NOT NULL
+    ORDER BY subject_id, eye, id
+"""
+DELETE_SQL = """
+    DELETE FROM cone_overlap
+    WHERE (subject_id, eye) IN (SELECT s, e FROM unnest($1::text[], $2::text[]) AS t(s, e))
+"""
+# The upload's rows in insertion order: serial ids ascend as executemany inserts.
+IDS_SQL = """
+    SELECT id FROM cone_data
+    WHERE (subject_id, eye) IN (SELECT s, e FROM unnest($1::text[], $2::text[]) AS t(s, e))
+    ORDER BY id
+"""
+INSERT_SQL = """
+    INSERT INTO cone_overlap (cone_id, canonical_id, subject_id, eye, distance_um)
+    VALUES ($1, $2, $3, $4, $5)
+"""
+
+
+def candidate_pairs(x: np.ndarray, y: np.ndarray, cell: float) -> tuple[np.ndarray, np.ndarray]:
+    """Index pairs (i, j), i != j, whose hash cells touch; every pair appears once."""
+    n = len(x)
+    if n < 2:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    cx = np.floor(x / cell).astype(np.int64)
+    cy = np.floor(y / cell).astype(np.int64)
+    # Shift so neighbour keys stay non-negative and never wrap into another column.
+    cx -= cx.min()
+    cy -= cy.min() - 1
+    height = int(cy.max()) + 2
+    key = cx * height + cy
+    order = np.argsort(key, kind="stable")
+    sorted_key = key[order]
+
+    firsts, seconds = [], []
+    for dx, dy in FORWARD_CELLS:
+        target = (cx + dx) * height + (cy + dy)
+        lo = np.searchsorted(sorted_key, target, side="left")
+        hi = np.searchsorted(sorted_key, target, side="right")
+        counts = hi - lo
+        total = int(counts.sum())
+        if total == 0:
+            continue
+        i = np.repeat(np.arange(n), counts)
+        # Position k of each run: lo[i] + (0 .. counts[i]-1).
+        offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        j = order[np.repeat(lo, counts) + offsets]
+        if (dx, dy) == (0, 0):
+            keep = i < j
+            i, j = i[keep], j[keep]
+        firsts.append(i)
+        seconds.append(j)
+    if not firsts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(firsts), np.concatenate(seconds)
+
+
+def _mutual_nearest(i: np.ndarray, j: np.ndarray, d: np.ndarray, n: int) -> np.ndarray:
+    """Mask of pairs where each side is the other's closest candidate."""
+    both_a = np.concatenate([i, j])
+    both_b = np.concatenate([j, i])
+    both_d = np.concatenate([d, d])
+    order = np.lexsort((both_b, both_d, both_a))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = both_a[order][1:] != both_a[order][:-1]
+    best = np.full(n, -1, dtype=np.int64)
+    best[both_a[order][first]] = both_b[order][first]
+    return (best[i] == j) & (best[j] == i)
+
+
+def _block_pairs(x: np.ndarray, y: np.ndarray, block: np.ndarray, k: int, radius: float) -> np.ndarray:
+    """(a, b) block pairs, a < b, whose bounding boxes come within `radius` of each other."""
+    lo_x, lo_y = np.full(k, np.inf), np.full(k, np.inf)
+    hi_x, hi_y = np.full(k, -np.inf), np.full(k, -np.inf)
+    np.minimum.at(lo_x, block, x)
+    np.minimum.at(lo_y, block, y)
+    np.maximum.at(hi_x, block, x)
+    np.maximum.at(hi_y, block, y)
+    near = ((lo_x[:, None] - radius <= hi_x[None, :]) & (lo_x[None, :] - radius <= hi_x[:, None])
+            & (lo_y[:, None] - radius <= hi_y[None, :]) & (lo_y[None, :] - radius <= hi_y[:, None]))
+    return np.argwhere(np.triu(near, k=1))
+
+
+def registration_offset(dx: np.ndarray, dy: np.ndarray, tolerance: float,
+                        radius: float) -> Optional[tuple[float, float]]:
+    """Offset (microns) most cone pairs of two blocks agree on, or None if none stands out.
+
+    Displacements vote into bins of half the tolerance. Each 2 x 2 window is
+    scored against the chance level around it (the mean of the surrounding
+    BACKGROUND_MICRONS square), so the peak of a dense mosaic isn't simply
+    where the most pairs happen to fall. The best window is refined to the
+    median displacement near it, and kept only if at least MIN_SUPPORT pairs
+    agree with it within `tolerance`, MIN_SIGNIFICANCE standard deviations
+    above chance.
+    """
+    if len(dx) < MIN_SUPPORT:
+        return None
+    step = tolerance / 2
+    bins = int(np.ceil(radius / step))
+    width = 2 * bins
+    ix = np.clip(np.floor(dx / step).astype(np.int64) + bins, 0, width - 1)
+    iy = np.clip(np.floor(dy / step).astype(np.int64) + bins, 0, width - 1)
+    votes = np.bincount(ix * width + iy, minlength=width * width).reshape(width, width).astype(float)
+    # Mean over the bins of the search disc only, or its rim would look like a peak.
+    centres = (np.arange(width) - bins + 0.5) * step
+    disc = (np.hypot(centres[:, None], centres[None, :]) <= radius).astype(float)
+    size = 2 * int(BACKGROUND_MICRONS / step) + 1
+    background = (uniform_filter(votes, size=size, mode="constant")
+                  / np.maximum(uniform_filter(disc, size=size, mode="constant"), 1e-9))
+    window = votes[:-1, :-1] + votes[1:, :-1] + votes[:-1, 1:] + votes[1:, 1:]
+    chance = 4 * background[:-1, :-1]
+    px, py = np.unravel_index(int(((window - chance) / np.sqrt(chance + 1)).argmax()), window.shape)
+    cx, cy = (px + 1 - bins) * step, (py + 1 - bins) * step
+    near = np.hypot(dx - cx, dy - cy) <= tolerance
+    ox, oy = float(np.median(dx[near])), float(np.median(dy[near]))
+
+    support = int((np.hypot(dx - ox, dy - oy) <= tolerance).sum())
+    expected = background[px, py] / step ** 2 * np.pi * tolerance ** 2
+    if support < MIN_SUPPORT or (support - expected) / np.sqrt(expected + 1) < MIN_SIGNIFICANCE:
+        return None
+    return ox, oy
+
+
+def match(ids: np.ndarray, x_um: np.ndarray, y_um: np.ndarray, block: np.ndarray,
+          tolerance: float, radius: float = SEARCH_RADIUS) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(cone_id, canonical_id, distance_um) for every non-canonical cone of one eye.
+
+    distance_um is the distance left after the block pair's registration offset.
+    """
+    n = len(ids)
+    _, block = np.unique(block, return_inverse=True)
+    firsts, seconds, residuals = [], [], []
+    for a, b in _block_pairs(x_um, y_um, block, int(block.max()) + 1 if n else 0, radius):
+        # Only cones within `radius` of the other block's box can pair up.
+        sel = []
+        for own, other in ((a, b), (b, a)):
+            other_x, other_y = x_um[block == other], y_um[block == other]
+            sel.append(np.flatnonzero(
+                (block == own)
+                & (x_um >= other_x.min() - radius) & (x_um <= other_x.max() + radius)
+                & (y_um >= other_y.min() - radius) & (y_um <= other_y.max() + radius)))
+        idx = np.concatenate(sel)
+        ci, cj = candidate_pairs(x_um[idx], y_um[idx], radius)
+        i, j = idx[ci], idx[cj]
+        keep = block[i] != block[j]
+        i, j = i[keep], j[keep]
+        # Orient every pair from block a to block b, so displacements share a sign.
+        flip = block[i] == b
+        i, j = np.where(flip, j, i), np.where(flip, i, j)
+        dx, dy = x_um[j] - x_um[i], y_um[j] - y_um[i]
+        keep = np.hypot(dx, dy) <= radius
+        i, j, dx, dy = i[keep], j[keep], dx[keep], dy[keep]
+
+        offset = registration_offset(dx, dy, tolerance, radius)
+        if offset is None:
+            continue
+        residual = np.hypot(dx - offset[0], dy - offset[1])
+        keep = residual <= tolerance
+        firsts.append(i[keep])
+        seconds.append(j[keep])
+        residuals.append(residual[keep])
+
+    if not firsts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+    i, j, d = np.concatenate(firsts), np.concatenate(seconds), np.concatenate(residuals)
+    keep = _mutual_nearest(i, j, d, n)
+    i, j, d = i[keep], j[keep], d[keep]
+
+    graph = coo_matrix((np.ones(len(i)), (i, j)), shape=(n, n))
+    _, labels = connected_components(graph, directed=False)
+    canonical = np.full(labels.max() + 1, np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(canonical, labels, ids)
+    canonical_id = canonical[labels]
+    # Distance to the partner the cone was matched with (components are mostly pairs).
+    distance = np.full(n, np.nan)
+    distance[i] = d
+    distance[j] = d
+    dup = np.flatnonzero(canonical_id != ids)
+    return ids[dup], canonical_id[dup], distance[dup]
+
+
+def detect(records, tolerance: float = DEFAULT_TOLERANCE) -> list[tuple]:
+    """cone_overlap rows for CONES_SQL records, grouped per (subject, eye)."""
+    if not records:
+        return []
+    subject = np.array([r["subject_id"] for r in records], dtype=object)
+    eye = np.array([r["eye"] for r in records], dtype=object)
+    ids = np.fromiter((r["id"] for r in records), dtype=np.int64, count=len(records))
+    x = np.fromiter((r["retinal_x_mm"] for r in records), dtype=float, count=len(records)) * 1000.0
+    y = np.fromiter((r["retinal_y_mm"] for r in records), dtype=float, count=len(records)) * 1000.0
+    _, block = np.unique(np.array([f"{r['meridian']}|{r['eccentricity_deg']}" for r in records]),
+                         return_inverse=True)
+
+    rows = []
+    # Records arrive sorted by (subject_id, eye), so each eye is one contiguous run.
+    pair = np.array([f"{s}|{e}" for s, e in zip(subject, eye)])
+    starts = np.flatnonzero(np.r_[True, pair[1:] != pair[:-1]])
+    for start, stop in zip(starts, np.r_[starts[1:], len(pair)]):
+        cone, canonical, distance = match(ids[start:stop], x[start:stop], y[start:stop],
+                                          block[start:stop], tolerance)
+        s, e = subject[start], eye[start]
+        rows.extend(zip(cone.tolist(), canonical.tolist(), [s] * len(cone), [e] * len(cone),
+                        distance.tolist()))
+    return rows
+
+
+def detect_pending(rows: list[tuple], tolerance: float = DEFAULT_TOLERANCE) -> tuple[int, list[tuple]]:
+    """detect() for cone_data tuples (app/csv_parser.to_row order) that aren't inserted yet.
+
+    Lets an upload match in a worker thread before it opens its transaction.
+    A cone's id is its position among the rows with a subject and an eye,
+    which sorts like the ids executemany will give them; insert_pending()
+    swaps in the real ones. Returns (number of such rows, cone_overlap rows).
+    """
+    pending = [r for r in rows if r[3] and r[4]]
+    records = [{"id": i, "subject_id": r[3], "eye": r[4], "meridian": r[5], "eccentricity_deg": r[6],
+                "retinal_x_mm": r[26], "retinal_y_mm": r[27]}
+               for i, r in enumerate(pending) if r[26] is not None and r[27] is not None]
+    # Stable, so ids stay ascending within each eye as CONES_SQL orders them.
+    records.sort(key=lambda r: (r["subject_id"], r["eye"]))
+    return len(pending), detect(records, tolerance)
+
+
+async def insert_pending(conn, subjects: list[str], eyes: list[str], rows: list[tuple],
+                         expected: int) -> Optional[int]:
+    """Write detect_pending() rows under the inserted ids; call in the upload's transaction.
+
+    Returns None, writing nothing, if the pairs don't hold exactly the
+    `expected` rows, since positions then can't be mapped to ids.
+    """
+    ids = [r["id"] for r in await conn.fetch(IDS_SQL, subjects, eyes)]
+    if len(ids) != expected:
+        return None
+    if rows:
+        await conn.executemany(INSERT_SQL, [(ids[cone], ids[canonical], s, e, d)
+                                            for cone, canonical, s, e, d in rows])
+    return len(rows)
+
+
+async def refresh(conn, subjects: list[str], eyes: list[str],
+                  tolerance: float = DEFAULT_TOLERANCE) -> int:
+    """Recompute the mapping of the given (subject, eye) pairs; matching runs in a worker thread."""
+    cones = await conn.fetch(CONES_SQL, subjects, eyes)
+    rows = await asyncio.to_thread(detect, cones, tolerance)
+    await conn.execute(DELETE_SQL, subjects, eyes)
+    if rows:
+        await conn.executemany(INSERT_SQL, rows)
+    return len(rows)
+
+
+async def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Rebuild the cross-block cone overlap mapping.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help=f"Match distance in microns (default {DEFAULT_TOLERANCE}).")
+    parser.add_argument("--apply", action="store_true",
+                        help="Write cone_overlap (default: dry-run, counts only).")
+    args = parser.parse_args(argv)
+
+    database_url = os.environ.get("DATABASE_URL")
+    if not database_url:
+        raise SystemExit("DATABASE_URL is required")
+
+    conn = await asyncpg.connect(database_url, statement_cache_size=0)
+    try:
+        pairs = await conn.fetch(
+            "SELECT DISTINCT subject_id, eye FROM cone_data WHERE eye IS NOT NULL ORDER BY 1, 2")
+        total = 0
+        for subject_id, eye in pairs:
+            if args.apply:
+                async with conn.transaction():
+                    found = await refresh(conn, [subject_id], [eye], args.tolerance)
+            else:
+                found = len(detect(await conn.fetch(CONES_SQL, [subject_id], [eye]), args.tolerance))
+            total += found
+            print(f"  {subject_id!s:10} {eye!s:4}  {found} overlapping cones")
+        if args.apply:
+            # Bump the dataset version so caches and the columnar copy reload.
+            await conn.execute(
+                """INSERT INTO upload_log (event_type, commit_message, rows_ingested, uploaded_by)
+                   VALUES ('backfill', $1, 0, 'app.overlap')""",
+                f"cone overlap at {args.tolerance} µm",
+            )
+        print(f"\n{total} non-canonical cones at {args.tolerance} µm"
+              + ("" if args.apply else " (dry-run; re-run with --apply to write cone_overlap)"))
+        return 0
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(main()))
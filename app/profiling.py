@@ -0,0 +1,231 @@
+"""Admin-only, on-demand profiling of a single live request.
+
+Send any request with `X-Profile: cprofile` (deterministic, pstats output)
+or `X-Profile: sample` (1 ms stack sampling, collapsed-stack output for
+flamegraph.pl / speedscope) together with the admin `Authorization`
+header. The response carries `X-Profile-Id`; the files are then listed at
+`/admin/profiles` and downloaded from `/admin/profiles/{id}/{kind}`. Every
+profile also records the top tracemalloc allocation sites for the request.
+
+The window covers the whole ASGI call, including background tasks such as
+the ingestion that `/admin/upload` schedules. Both profilers watch the
+event loop thread, so other requests served concurrently by the same
+worker show up too; profile on a quiet worker where that matters. Only one
+request per worker is profiled at a time.
+
+Files go to PROFILE_DIR (default: a `retinal-profiles` directory in the
+system temp dir) so any worker on the machine can serve the download. The
+newest KEEP_PROFILES are kept.
+"""
+import cProfile
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from typing import Callable, Optional
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers
+
+from app.config import settings
+
+MODES = ("cprofile", "sample")
+KINDS = {
+    "pstats": "application/octet-stream",
+    "collapsed": "text/plain; charset=utf-8",
+    "allocations": "text/plain; charset=utf-8",
+}
+KEEP_PROFILES = 20
+SAMPLE_INTERVAL_SECONDS = 0.001
+TOP_ALLOCATIONS = 30
+_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+_busy = threading.Lock()
+
+
+def profile_dir() -> str:
+    path = settings.profile_dir or os.path.join(tempfile.gettempdir(), "retinal-profiles")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _path(profile_id: str, kind: str) -> str:
+    return os.path.join(profile_dir(), f"{profile_id}.{kind}")
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler(threading.Thread):
+    """Samples one thread's Python stack every SAMPLE_INTERVAL_SECONDS."""
+
+    def __init__(self, thread_id: int):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.stacks: Counter = Counter()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(SAMPLE_INTERVAL_SECONDS):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            # An idle loop sits in the selector; skip those samples.
+            if stack and not stack[0].startswith("select "):
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def _allocations(before: tracemalloc.Snapshot, after: tracemalloc.Snapshot) -> str:
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    diff = after.filter_traces(filters).compare_to(before.filter_traces(filters), "lineno")
+    lines = [str(stat) for stat in diff[:TOP_ALLOCATIONS]]
+    current, peak = tracemalloc.get_traced_memory()
+    lines.append(f"traced now={current} B peak={peak} B")
+    return "\n".join(lines) + "\n"
+
+
+def _prune():
+    root = profile_dir()
+    metas = sorted(
+        (f for f in os.listdir(root) if f.endswith(".json")),
+        key=lambda f: os.path.getmtime(os.path.join(root, f)),
+    )
+    for meta in metas[:-KEEP_PROFILES]:
+        profile_id = meta[:-len(".json")]
+        for kind in (*KINDS, "json"):
+            try:
+                os.remove(_path(profile_id, kind))
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles() -> list[dict]:
+    root = profile_dir()
+    out = []
+    for name in os.listdir(root):
+        if name.endswith(".json"):
+            with open(os.path.join(root, name)) as f:
+                out.append(json.load(f))
+    return sorted(out, key=lambda p: p["started_at"], reverse=True)
+
+
+def profile_file(profile_id: str, kind: str) -> tuple[str, str]:
+    """Return (path, media_type) of a stored profile file, or raise 404."""
+    if not _ID_RE.match(profile_id) or kind not in KINDS:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    path = _path(profile_id, kind)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return path, KINDS[kind]
+
+
+class ProfilingMiddleware:
+    """Pure ASGI middleware; `authorize(authorization_header)` raises HTTPException to refuse."""
+
+    def __init__(self, app, authorize: Callable[[Optional[str]], None]):
+        self.app = app
+        self.authorize = authorize
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        mode = headers.get("x-profile", "").strip().lower()
+        if not mode:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            self.authorize(headers.get("authorization"))
+            if mode not in MODES:
+                raise HTTPException(status_code=400, detail=f"X-Profile must be one of {', '.join(MODES)}")
+        except HTTPException as e:
+            await JSONResponse({"detail": e.detail}, status_code=e.status_code)(scope, receive, send)
+            return
+        if not _busy.acquire(blocking=False):
+            response = JSONResponse({"detail": "Another request is being profiled"}, status_code=409)
+            await response(scope, receive, send)
+            return
+        try:
+            await self._profile(mode, scope, receive, send)
+        finally:
+            _busy.release()
+
+    async def _profile(self, mode: str, scope, receive, send):
+        profile_id = uuid.uuid4().hex
+        started_at = time.time()
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"x-profile-id", profile_id.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        owns_tracemalloc = not tracemalloc.is_tracing()
+        if owns_tracemalloc:
+            tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+
+        profiler = sampler = None
+        if mode == "cprofile":
+            profiler = cProfile.Profile()
+            profiler.enable()
+        else:
+            sampler = StackSampler(threading.get_ident())
+            sampler.start()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            elapsed = time.perf_counter() - started
+            if profiler is not None:
+                profiler.disable()
+            if sampler is not None:
+                sampler.stop()
+            allocations = _allocations(before, tracemalloc.take_snapshot())
+            if owns_tracemalloc:
+                tracemalloc.stop()
+
+            files = ["allocations"]
+            with open(_path(profile_id, "allocations"), "w") as f:
+                f.write(allocations)
+            if profiler is not None:
+                profiler.dump_stats(_path(profile_id, "pstats"))
+                files.append("pstats")
+            if sampler is not None:
+                with open(_path(profile_id, "collapsed"), "w") as f:
+                    f.write(sampler.collapsed())
+                files.append("collapsed")
+            meta = {
+                "id": profile_id,
+                "mode": mode,
+                "method": scope["method"],
+                "path": scope["path"],
+                "query_string": scope.get("query_string", b"").decode("latin-1"),
+                "started_at": started_at,
+                "elapsed_ms": round(elapsed * 1000, 2),
+                "files": files,
+            }
+            with open(_path(profile_id, "json"), "w") as f:
+                json.dump(meta, f)
+            _prune()
+
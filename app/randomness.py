@@ -0,0 +1,382 @@
+"""Spatial randomness of the S, L and M submosaics against a label-permutation null.
+
+For each block and cone type T the observed mosaic is compared with
+`permutations` random relabellings that keep every cone position and the
+number of T cones fixed, so edge effects and the packing of the mosaic
+itself cancel out; only the arrangement of the labels is tested.
+
+    nn        mean distance from each T cone to its nearest other T cone.
+              nn_ratio = observed / null mean: < 1 clustered, > 1 more regular
+              than random. nn_p_clustered / nn_p_regular are the one-sided
+              permutation p-values, (1 + #null at least as extreme) / (1 + n).
+    pcf       T-T pair counts in distance bins up to `max_spacings` mean
+              cone spacings, as a ratio to the null mean, with the 2.5-97.5 %
+              null envelope: the label pair correlation (mark connection)
+              function of T.
+
+Both statistics run on precomputed geometry, so a batch of permutations is
+a handful of array operations: every cone's k nearest neighbours (k chosen
+so a T cone is almost surely among them) and every pair within range,
+sorted by distance bin. Permutations are split into fixed chunks with
+their own seeds and spread over a process pool; the result for a given
+--seed does not depend on the number of workers.
+
+Results replace the block's rows in block_randomness, one row per type,
+together with a digest of the block's cones. A rerun skips blocks whose
+digest and parameters are unchanged, so the nightly job only redoes what
+an upload touched.
+
+Only one job runs at a time across every worker and the CLI: a job first
+claims the single row of randomness_job, and its progress and heartbeat
+are written there for GET /admin/randomness. A claim whose heartbeat is
+older than STALE_SECONDS is taken over, so a worker that died mid-job
+doesn't block the next one forever. The job's NumPy/SciPy work runs in
+threads and the process pool, never on the event loop.
+
+Usage:
+    DATABASE_URL=... python -m app.randomness [--subject AO001] [--permutations 999]
+        [--bins 20] [--max-spacings 5] [--workers 4] [--seed 0] [--force]
+"""
+import argparse
+import asyncio
+import hashlib
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Callable, Optional
+
+import asyncpg
+import numpy as np
+from scipy.spatial import cKDTree
+
+CONE_TYPES = ("S", "L", "M")
+MIN_TYPE_CONES = 5
+# Permutations per task sent to the pool, and per vectorized batch inside a task.
+CHUNK = 100
+BATCH = 25
+# Chance that a T cone's nearest T neighbour lies beyond the k precomputed neighbours.
+MISS_PROBABILITY = 1e-3
+# A running job that hasn't reported progress for this long is presumed dead.
+STALE_SECONDS = 15 * 60
+
+BLOCKS_SQL = """
+    SELECT DISTINCT subject_id, eye, meridian, eccentricity_deg
+    FROM cone_data
+    WHERE eye IS NOT NULL AND meridian IS NOT NULL AND eccentricity_deg IS NOT NULL
+      AND ($1::text IS NULL OR subject_id = $1)
+    ORDER BY subject_id, eye, meridian, eccentricity_deg
+"""
+CONES_SQL = """
+    SELECT cone_x_microns, cone_y_microns, cone_spectral_type
+    FROM cone_data
+    WHERE subject_id = $1 AND eye = $2 AND meridian = $3 AND eccentricity_deg = $4
+"""
+UPSERT_SQL = """
+    INSERT INTO block_randomness (
+        subject_id, eye, meridian, eccentricity_deg, cone_type, digest,
+        permutations, bins, max_spacings, seed, n_cones, n_type,
+        nn_observed, nn_null_mean, nn_null_sd, nn_ratio, nn_p_clustered, nn_p_regular,
+        pcf_r, pcf_ratio, pcf_lo, pcf_hi, elapsed_ms, computed_at
+    ) VALUES ($1,$2,$3,$4,$5,$6,$7,$8,$9,$10,$11,$12,$13,$14,$15,$16,$17,$18,$19,$20,$21,$22,$23, now())
+    ON CONFLICT (subject_id, eye, meridian, eccentricity_deg, cone_type) DO UPDATE SET
+        digest = EXCLUDED.digest, permutations = EXCLUDED.permutations, bins = EXCLUDED.bins,
+        max_spacings = EXCLUDED.max_spacings, seed = EXCLUDED.seed, n_cones = EXCLUDED.n_cones,
+        n_type = EXCLUDED.n_type, nn_observed = EXCLUDED.nn_observed,
+        nn_null_mean = EXCLUDED.nn_null_mean, nn_null_sd = EXCLUDED.nn_null_sd,
+        nn_ratio = EXCLUDED.nn_ratio, nn_p_clustered = EXCLUDED.nn_p_clustered,
+        nn_p_regular = EXCLUDED.nn_p_regular, pcf_r = EXCLUDED.pcf_r,
+        pcf_ratio = EXCLUDED.pcf_ratio, pcf_lo = EXCLUDED.pcf_lo, pcf_hi = EXCLUDED.pcf_hi,
+        elapsed_ms = EXCLUDED.elapsed_ms, computed_at = EXCLUDED.computed_at
+"""
+# A type that drops below MIN_TYPE_CONES gets no new row, so a block's old rows go first.
+DELETE_BLOCK_SQL = """
+    DELETE FROM block_randomness
+    WHERE subject_id = $1 AND eye = $2 AND meridian = $3 AND eccentricity_deg = $4
+"""
+
+CLAIM_SQL = """
+    INSERT INTO randomness_job AS j (id, running, subject_id, permutations, blocks_total,
+                                     blocks_done, blocks_skipped, started_at, heartbeat_at,
+                                     elapsed_seconds, error)
+    VALUES (1, true, $1, $2, NULL, 0, 0, now(), now(), NULL, NULL)
+    ON CONFLICT (id) DO UPDATE SET
+        running = true, subject_id = EXCLUDED.subject_id, permutations = EXCLUDED.permutations,
+        blocks_total = NULL, blocks_done = 0, blocks_skipped = 0, started_at = now(),
+        heartbeat_at = now(), elapsed_seconds = NULL, error = NULL
+    WHERE NOT j.running OR j.heartbeat_at < now() - make_interval(secs => $3)
+    RETURNING id
+"""
+PROGRESS_SQL = """
+    UPDATE randomness_job
+    SET blocks_total = $1, blocks_done = $2, blocks_skipped = $3, heartbeat_at = now()
+    WHERE id = 1
+"""
+FINISH_SQL = """
+    UPDATE randomness_job
+    SET running = false, heartbeat_at = now(), elapsed_seconds = $1, error = $2
+    WHERE id = 1
+"""
+STATUS_SQL = """
+    SELECT running, subject_id, permutations, blocks_total, blocks_done, blocks_skipped,
+           started_at, heartbeat_at, elapsed_seconds, error
+    FROM randomness_job WHERE id = 1
+"""
+
+
+class Geometry:
+    """Label-independent neighbour lists and binned pairs of one block."""
+
+    def __init__(self, points: np.ndarray, bins: int, max_spacings: float):
+        tree = cKDTree(points)
+        self.n = len(points)
+        spacing = float(np.mean(tree.query(points, k=2)[0][:, 1]))
+        self.r_edges = np.linspace(0.0, max_spacings * spacing, bins + 1)
+
+        pairs = tree.query_pairs(self.r_edges[-1], output_type="ndarray")
+        d = np.hypot(*(points[pairs[:, 0]] - points[pairs[:, 1]]).T)
+        b = np.minimum(np.searchsorted(self.r_edges, d, side="right") - 1, bins - 1)
+        order = np.argsort(b, kind="stable")
+        self.pair_i, self.pair_j = pairs[order, 0], pairs[order, 1]
+        # Pairs of bin k are pair_i[bounds[k]:bounds[k + 1]].
+        self.bounds = np.searchsorted(b[order], np.arange(bins + 1))
+        self._tree = tree
+        self._points = points
+
+    def neighbours(self, n_type: int) -> tuple[np.ndarray, np.ndarray]:
+        """(index, distance) of each cone's k nearest others, k sized for `n_type` T cones."""
+        p = n_type / self.n
+        k = self.n - 1 if p >= 1 else math.ceil(math.log(MISS_PROBABILITY) / math.log1p(-p))
+        k = max(1, min(k, self.n - 1))
+        dist, idx = self._tree.query(self._points, k=k + 1)
+        return idx[:, 1:], dist[:, 1:]
+
+
+def _nn_same(labels: np.ndarray, nbr_idx: np.ndarray, nbr_dist: np.ndarray) -> np.ndarray:
+    """Mean nearest same-label distance for each row of `labels` (batch, n)."""
+    same = labels[:, nbr_idx]                      # (batch, n, k)
+    first = same.argmax(axis=2)
+    rows = np.arange(nbr_idx.shape[0])[None, :]
+    d = nbr_dist[rows, first]
+    # Not found within k: censor at the k-th neighbour distance (probability MISS_PROBABILITY).
+    d = np.where(same[np.arange(len(labels))[:, None], rows, first], d, nbr_dist[:, -1][None, :])
+    return (d * labels).sum(axis=1) / labels.sum(axis=1)
+
+
+def _pair_counts(labels: np.ndarray, pair_i: np.ndarray, pair_j: np.ndarray, bounds: np.ndarray) -> np.ndarray:
+    """Same-label pair counts per distance bin for each row of `labels`."""
+    both = labels[:, pair_i] & labels[:, pair_j]
+    c = np.zeros((len(labels), both.shape[1] + 1), dtype=np.int64)
+    np.cumsum(both, axis=1, out=c[:, 1:])
+    return c[:, bounds[1:]] - c[:, bounds[:-1]]
+
+
+def simulate(nbr_idx, nbr_dist, pair_i, pair_j, bounds, n_type: int, seed, n_perm: int):
+    """One pool task: `n_perm` random relabellings -> (nn means, pair counts)."""
+    rng = np.random.default_rng(seed)
+    n = nbr_idx.shape[0]
+    nn = np.empty(n_perm)
+    pcf = np.empty((n_perm, len(bounds) - 1), dtype=np.int64)
+    for start in range(0, n_perm, BATCH):
+        b = min(BATCH, n_perm - start)
+        labels = np.zeros((b, n), dtype=bool)
+        chosen = rng.random((b, n)).argpartition(n_type - 1, axis=1)[:, :n_type]
+        np.put_along_axis(labels, chosen, True, axis=1)
+        nn[start:start + b] = _nn_same(labels, nbr_idx, nbr_dist)
+        pcf[start:start + b] = _pair_counts(labels, pair_i, pair_j, bounds)
+    return nn, pcf
+
+
+def _observed(geometry: Geometry, observed: np.ndarray, n_type: int):
+    """Neighbour lists for `n_type` T cones and the observed nn mean and pair counts."""
+    nbr_idx, nbr_dist = geometry.neighbours(n_type)
+    obs_nn = float(_nn_same(observed[None, :], nbr_idx, nbr_dist)[0])
+    obs_pcf = _pair_counts(observed[None, :], geometry.pair_i, geometry.pair_j, geometry.bounds)[0]
+    return nbr_idx, nbr_dist, obs_nn, obs_pcf
+
+
+async def analyse_type(executor, geometry: Geometry, observed: np.ndarray, permutations: int,
+                       seed: int) -> dict:
+    n_type = int(observed.sum())
+    nbr_idx, nbr_dist, obs_nn, obs_pcf = await asyncio.to_thread(_observed, geometry, observed, n_type)
+
+    loop = asyncio.get_running_loop()
+    sizes = [min(CHUNK, permutations - s) for s in range(0, permutations, CHUNK)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    results = await asyncio.gather(*(
+        loop.run_in_executor(executor, simulate, nbr_idx, nbr_dist, geometry.pair_i,
+                             geometry.pair_j, geometry.bounds, n_type, s, size)
+        for s, size in zip(seeds, sizes)
+    ))
+    null_nn = np.concatenate([r[0] for r in results])
+    null_pcf = np.concatenate([r[1] for r in results])
+
+    null_mean = null_pcf.mean(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.where(null_mean > 0, obs_pcf / null_mean, np.nan)
+        lo, hi = np.percentile(null_pcf, [2.5, 97.5], axis=0) / np.where(null_mean > 0, null_mean, np.nan)
+    mean = float(null_nn.mean())
+    return {
+        "n_type": n_type,
+        "nn_observed": obs_nn,
+        "nn_null_mean": mean,
+        "nn_null_sd": float(null_nn.std(ddof=1)),
+        "nn_ratio": obs_nn / mean if mean > 0 else None,
+        "nn_p_clustered": float((1 + (null_nn <= obs_nn).sum()) / (1 + permutations)),
+        "nn_p_regular": float((1 + (null_nn >= obs_nn).sum()) / (1 + permutations)),
+        "pcf_r": ((geometry.r_edges[:-1] + geometry.r_edges[1:]) / 2).tolist(),
+        "pcf_ratio": [None if v != v else v for v in ratio.tolist()],
+        "pcf_lo": [None if v != v else v for v in lo.tolist()],
+        "pcf_hi": [None if v != v else v for v in hi.tolist()],
+    }
+
+
+def _digest(points: np.ndarray, types: np.ndarray) -> str:
+    h = hashlib.sha1(np.ascontiguousarray(points).tobytes())
+    h.update("".join(t or "-" for t in types.tolist()).encode())
+    return h.hexdigest()
+
+
+def _cones(records) -> tuple[np.ndarray, np.ndarray]:
+    points = np.array([(r["cone_x_microns"], r["cone_y_microns"]) for r in records], dtype=float).reshape(-1, 2)
+    types = np.array([r["cone_spectral_type"] for r in records], dtype=object)
+    keep = ~np.isnan(points).any(axis=1)
+    points, types = points[keep], types[keep]
+    # Same de-duplication as app/blocks.py: repeated coordinates would be zero-distance pairs.
+    _, first = np.unique(points, axis=0, return_index=True)
+    first.sort()
+    return points[first], types[first]
+
+
+async def claim(conn, subject_id: Optional[str], permutations: int) -> bool:
+    """Take the job slot; False if another live job holds it."""
+    return await conn.fetchval(CLAIM_SQL, subject_id, permutations, STALE_SECONDS) is not None
+
+
+async def job_status(conn) -> dict:
+    row = await conn.fetchrow(STATUS_SQL)
+    return dict(row) if row else {"running": False}
+
+
+async def run_job(acquire: Callable, subject_id: Optional[str] = None, permutations: int = 999,
+                  bins: int = 20, max_spacings: float = 5.0, workers: Optional[int] = None,
+                  seed: int = 0, force: bool = False, log: Callable[[str], None] = print) -> dict:
+    """Analyse every block (of `subject_id`, if given). `acquire()` yields a connection per step.
+
+    The caller must have won `claim()` first; the claim is released when the job ends.
+    """
+    started = time.perf_counter()
+    status = {"subject_id": subject_id, "blocks_total": None, "blocks_done": 0, "blocks_skipped": 0}
+    params = (permutations, bins, max_spacings, seed)
+
+    async def progress():
+        async with acquire() as conn:
+            await conn.execute(PROGRESS_SQL, status["blocks_total"], status["blocks_done"],
+                               status["blocks_skipped"])
+
+    error = None
+    try:
+        async with acquire() as conn:
+            blocks = await conn.fetch(BLOCKS_SQL, subject_id)
+        status["blocks_total"] = len(blocks)
+        await progress()
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+            for block in blocks:
+                key = (block["subject_id"], block["eye"], block["meridian"], block["eccentricity_deg"])
+                async with acquire() as conn:
+                    records = await conn.fetch(CONES_SQL, *key)
+                    existing = await conn.fetch(
+                        "SELECT digest, permutations, bins, max_spacings, seed FROM block_randomness "
+                        "WHERE subject_id = $1 AND eye = $2 AND meridian = $3 AND eccentricity_deg = $4",
+                        *key,
+                    )
+                points, types = await asyncio.to_thread(_cones, records)
+                digest = _digest(points, types)
+                if not force and existing and all(
+                    (r["digest"], r["permutations"], r["bins"], r["max_spacings"], r["seed"]) == (digest, *params)
+                    for r in existing
+                ):
+                    status["blocks_skipped"] += 1
+                    await progress()
+                    continue
+                if len(points) < 2 * MIN_TYPE_CONES:
+                    if existing:
+                        async with acquire() as conn:
+                            await conn.execute(DELETE_BLOCK_SQL, *key)
+                    status["blocks_skipped"] += 1
+                    await progress()
+                    continue
+
+                block_started = time.perf_counter()
+                geometry = await asyncio.to_thread(Geometry, points, bins, max_spacings)
+                rows = []
+                for t in CONE_TYPES:
+                    observed = types == t
+                    if observed.sum() < MIN_TYPE_CONES or observed.sum() == len(points):
+                        continue
+                    type_started = time.perf_counter()
+                    r = await analyse_type(executor, geometry, observed, permutations, seed)
+                    rows.append((*key, t, digest, *params, len(points), r["n_type"],
+                                 r["nn_observed"], r["nn_null_mean"], r["nn_null_sd"], r["nn_ratio"],
+                                 r["nn_p_clustered"], r["nn_p_regular"], r["pcf_r"], r["pcf_ratio"],
+                                 r["pcf_lo"], r["pcf_hi"], (time.perf_counter() - type_started) * 1000))
+                    await progress()  # heartbeat
+                async with acquire() as conn:
+                    async with conn.transaction():
+                        await conn.execute(DELETE_BLOCK_SQL, *key)
+                        await conn.executemany(UPSERT_SQL, rows)
+                status["blocks_done"] += 1
+                await progress()
+                # r[4] is the cone type and r[15] nn_ratio, in UPSERT_SQL order.
+                ratios = " ".join(f"{r[4]}={r[15]:.3f}" for r in rows if r[15] is not None)
+                log(f"{key[0]} {key[1]} {key[2]} {key[3]:g}°: {len(points)} cones, nn_ratio {ratios} "
+                    f"({time.perf_counter() - block_started:.1f}s)")
+    except Exception as e:
+        error = str(e)
+        raise
+    finally:
+        status["elapsed_seconds"] = time.perf_counter() - started
+        async with acquire() as conn:
+            await conn.execute(FINISH_SQL, status["elapsed_seconds"], error)
+    return status
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--subject", help="Only this subject_id (default: every block)")
+    parser.add_argument("--permutations", type=int, default=999)
+    parser.add_argument("--bins", type=int, default=20, help="Pair correlation distance bins")
+    parser.add_argument("--max-spacings", type=float, default=5.0,
+                        help="Pair correlation range, in mean cone spacings")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--force", action="store_true", help="Recompute blocks that are up to date")
+    args = parser.parse_args()
+
+    database_url = os.environ.get("DATABASE_URL")
+    if not database_url:
+        raise RuntimeError("DATABASE_URL environment variable is not set")
+
+    async def run():
+        conn = await asyncpg.connect(database_url, statement_cache_size=0)
+
+        @asynccontextmanager
+        async def acquire():
+            yield conn
+
+        try:
+            if not await claim(conn, args.subject, args.permutations):
+                raise SystemExit("A randomness job is already running (see GET /admin/randomness)")
+            result = await run_job(acquire, args.subject, args.permutations, args.bins,
+                                   args.max_spacings, args.workers, args.seed, args.force)
+        finally:
+            await conn.close()
+        print(f"Done: {result['blocks_done']} blocks analysed, {result['blocks_skipped']} skipped "
+              f"in {result['elapsed_seconds']:.1f}s")
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
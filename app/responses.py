@@ -0,0 +1,106 @@
+"""Shared JSON encoding and compression for API responses.
+
+`dumps` encodes with orjson, which handles datetimes and NumPy arrays
+natively, so handlers can hand over `conn.fetch()` results without their own
+conversion loops. orjson can't walk an asyncpg Record, so `default` still
+copies each one into a dict; that copy is most of what a row-list response
+costs to encode. Endpoints that can answer in columns (/plot-data, /montage)
+build lists instead and skip it.
+
+`Payload` keeps an encoded body together with its gzip/brotli variants.
+Variants are compressed on first use and then reused by every response
+built from the same Payload, e.g. all waiters on a coalesced query.
+"""
+import gzip
+import sys
+from typing import Any, Optional
+
+import asyncpg
+import brotli
+import orjson
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+
+from app.instrumentation import stage
+
+# Bodies smaller than this aren't worth the compression CPU.
+MIN_COMPRESS_BYTES = 1024
+# Favour speed: these levels get most of the ratio at a fraction of the max-level cost.
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+
+_OPTIONS = orjson.OPT_NON_STR_KEYS
+_NUMPY_OPTIONS = _OPTIONS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def _default(obj):
+    if isinstance(obj, asyncpg.Record):
+        return dict(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    with stage("encode"):
+        # OPT_SERIALIZE_NUMPY makes orjson import NumPy; until something has, there are no arrays.
+        options = _NUMPY_OPTIONS if "numpy" in sys.modules else _OPTIONS
+        return orjson.dumps(content, default=_default, option=options)
+
+
+class FastJSONResponse(JSONResponse):
+    """Drop-in JSONResponse that renders with `dumps`."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def _accepted(accept_encoding: str) -> set[str]:
+    accepted = set()
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+class Payload:
+    def __init__(self, body: bytes, media_type: str = "application/json"):
+        self.body = body
+        self.media_type = media_type
+        self._encoded: dict[str, bytes] = {}
+
+    @classmethod
+    def from_content(cls, content: Any) -> "Payload":
+        return cls(dumps(content))
+
+    def encoded(self, coding: str) -> bytes:
+        data = self._encoded.get(coding)
+        if data is None:
+            with stage("compress"):
+                if coding == "br":
+                    data = brotli.compress(self.body, quality=BROTLI_QUALITY)
+                else:
+                    data = gzip.compress(self.body, compresslevel=GZIP_LEVEL, mtime=0)
+            self._encoded[coding] = data
+        return data
+
+    def negotiate(self, accept_encoding: Optional[str]) -> Optional[str]:
+        if len(self.body) < MIN_COMPRESS_BYTES or not accept_encoding:
+            return None
+        accepted = _accepted(accept_encoding)
+        for coding in ("br", "gzip"):
+            if coding in accepted:
+                return coding
+        return None
+
+    def response(self, request: Optional[Request] = None, headers: Optional[dict] = None) -> Response:
+        out = {"Vary": "Accept-Encoding", **(headers or {})}
+        coding = self.negotiate(request.headers.get("accept-encoding") if request else None)
+        if coding is None:
+            return Response(content=self.body, media_type=self.media_type, headers=out)
+        out["Content-Encoding"] = coding
+        return Response(content=self.encoded(coding), media_type=self.media_type, headers=out)
+
+
+def json_response(content: Any, request: Optional[Request] = None) -> Response:
+    return Payload.from_content(content).response(request)
@@ -0,0 +1,172 @@
+"""Signed block eccentricity and montage-wide retinal coordinates per cone.
+
+One frame for every subject and both eyes: millimetres on the retina from
+the fovea, +x temporal and +y superior. Right eyes (OD) are therefore
+mirrored relative to a fundus image, where their temporal side is on the
+left; left eyes keep the fundus orientation. OD and OS montages overlay.
+
+Eccentricity. The AO files give "Eccentricity (x,y)" as unsigned
+components (sometimes a bare number), with the direction carried by the
+meridian. For a cardinal meridian the component along its axis gets the
+meridian's sign (temporal/superior +, nasal/inferior −); a value that
+puts the magnitude on the wrong axis, or a bare number, is moved onto
+the meridian axis. Other meridians keep the components as written.
+Missing mm components come from deg × ret_mag_factor.
+
+Cones. Cone x/y are microns in the image, from `cone_origin` (the
+top-left corner of the FOV, y pointing down) unless the origin says
+centre. Images are assumed to be in fundus view (superior up, nasal to
+the right for OD) and centred on the block eccentricity. The image
+centre is half the "FOV (mm)" size, or the middle of the block's cones
+when FOV is missing. Then
+
+    retinal_x_mm = eccentricity_x_mm ∓ (x - centre_x) / 1000   (− for OD, + for OS)
+    retinal_y_mm = eccentricity_y_mm − (y - centre_y) / 1000
+
+Rows loaded before these columns existed are filled in with
+
+    DATABASE_URL=... python -m app.retina
+"""
+import asyncio
+import os
+
+import asyncpg
+import numpy as np
+import pandas as pd
+
+COLUMNS = ("eccentricity_x_deg", "eccentricity_y_deg", "eccentricity_x_mm", "eccentricity_y_mm",
+           "retinal_x_mm", "retinal_y_mm")
+BLOCK_COLS = ["subject_id", "eye", "meridian", "eccentricity_deg"]
+
+# Meridian -> (axis, sign): axis 0 is x (temporal +), 1 is y (superior +).
+MERIDIANS = {"temporal": (0, 1.0), "nasal": (0, -1.0), "superior": (1, 1.0), "inferior": (1, -1.0)}
+# Image x points temporally in a left-eye fundus view, nasally in a right eye.
+IMAGE_X_SIGN = {"OS": 1.0, "OD": -1.0}
+FOV_RE = r"([0-9]*\.?[0-9]+)\s*[xX×]\s*([0-9]*\.?[0-9]+)"
+
+BACKFILL_SELECT = """
+    SELECT id, cone_x_microns, cone_y_microns, subject_id, eye, meridian,
+           eccentricity_deg, eccentricity_mm, ret_mag_factor, fov, cone_origin
+    FROM cone_data
+    WHERE subject_id = $1 AND eccentricity_x_deg IS NULL
+"""
+BACKFILL_UPDATE = """
+    UPDATE cone_data SET
+        eccentricity_x_deg = u.ex_deg, eccentricity_y_deg = u.ey_deg,
+        eccentricity_x_mm = u.ex_mm, eccentricity_y_mm = u.ey_mm,
+        retinal_x_mm = u.rx, retinal_y_mm = u.ry
+    FROM unnest($1::bigint[], $2::float8[], $3::float8[], $4::float8[],
+                $5::float8[], $6::float8[], $7::float8[]) AS u(id, ex_deg, ey_deg, ex_mm, ey_mm, rx, ry)
+    WHERE cone_data.id = u.id
+"""
+
+
+def _col(df: pd.DataFrame, name: str) -> np.ndarray:
+    if name not in df.columns:
+        return np.full(len(df), np.nan)
+    return pd.to_numeric(df[name], errors="coerce").to_numpy(dtype=float)
+
+
+def _text(df: pd.DataFrame, name: str) -> pd.Series:
+    if name not in df.columns:
+        return pd.Series([""] * len(df), index=df.index)
+    return df[name].fillna("").astype(str).str.strip()
+
+
+def _signed(x: np.ndarray, y: np.ndarray, meridian: pd.Series) -> tuple[np.ndarray, np.ndarray]:
+    x, y = x.copy(), y.copy()
+    magnitude = np.hypot(x, y)
+    key = meridian.str.lower()
+    for name, (axis, sign) in MERIDIANS.items():
+        rows = (key == name).to_numpy()
+        on, off = (x, y) if axis == 0 else (y, x)
+        swapped = rows & (np.abs(on) == 0) & (magnitude > 0)
+        off[swapped] = 0.0
+        on[rows] = np.where(swapped[rows], magnitude[rows], np.abs(on[rows])) * sign
+    return x, y
+
+
+def add_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Fill the COLUMNS of a parsed upload in place (vectorized over all cones)."""
+    if df.empty:
+        for c in COLUMNS:
+            df[c] = pd.Series(dtype=float)
+        return df
+    meridian = _text(df, "meridian")
+    ex_deg, ey_deg = _signed(_col(df, "eccentricity_x_deg"), _col(df, "eccentricity_y_deg"), meridian)
+    ex_mm, ey_mm = _signed(_col(df, "eccentricity_x_mm"), _col(df, "eccentricity_y_mm"), meridian)
+    mm_per_deg = _col(df, "ret_mag_factor") / 1000.0
+    ex_mm = np.where(np.isnan(ex_mm), ex_deg * mm_per_deg, ex_mm)
+    ey_mm = np.where(np.isnan(ey_mm), ey_deg * mm_per_deg, ey_mm)
+
+    x, y = _col(df, "cone_x_microns"), _col(df, "cone_y_microns")
+    fov = _text(df, "fov").str.extract(FOV_RE).astype(float).to_numpy() * 1000.0
+    cx, cy = fov[:, 0] / 2, fov[:, 1] / 2
+    if np.isnan(cx).any() or np.isnan(cy).any():
+        keys = [_text(df, c) for c in BLOCK_COLS]
+        grouped = pd.DataFrame({"x": x, "y": y}, index=df.index).groupby(keys)
+        mid = (grouped.transform("min") + grouped.transform("max")) / 2
+        cx = np.where(np.isnan(cx), mid["x"].to_numpy(), cx)
+        cy = np.where(np.isnan(cy), mid["y"].to_numpy(), cy)
+    centred = _text(df, "cone_origin").str.lower().str.contains("cent").to_numpy()
+    cx, cy = np.where(centred, 0.0, cx), np.where(centred, 0.0, cy)
+
+    x_sign = _text(df, "eye").str.upper().map(IMAGE_X_SIGN).to_numpy(dtype=float)
+    df["eccentricity_x_deg"], df["eccentricity_y_deg"] = ex_deg, ey_deg
+    df["eccentricity_x_mm"], df["eccentricity_y_mm"] = ex_mm, ey_mm
+    df["retinal_x_mm"] = ex_mm + x_sign * (x - cx) / 1000.0
+    df["retinal_y_mm"] = ey_mm - (y - cy) / 1000.0
+    return df
+
+
+def from_stored(rows) -> pd.DataFrame:
+    """Rows stored before the signed columns existed: only the magnitude survives,
+    so the components are recoverable for cardinal meridians only."""
+    df = pd.DataFrame([dict(r) for r in rows])
+    cardinal = _text(df, "meridian").str.lower().isin(MERIDIANS).to_numpy()
+    df["eccentricity_x_deg"] = np.where(cardinal, _col(df, "eccentricity_deg"), np.nan)
+    df["eccentricity_y_deg"] = np.where(cardinal, 0.0, np.nan)
+    df["eccentricity_x_mm"] = np.where(cardinal, _col(df, "eccentricity_mm"), np.nan)
+    df["eccentricity_y_mm"] = np.where(cardinal, 0.0, np.nan)
+    return add_columns(df)
+
+
+async def backfill(conn, log=print) -> int:
+    subjects = await conn.fetch(
+        "SELECT DISTINCT subject_id FROM cone_data WHERE eccentricity_x_deg IS NULL ORDER BY 1")
+    total = 0
+    for (subject_id,) in subjects:
+        rows = await conn.fetch(BACKFILL_SELECT, subject_id)
+        df = from_stored(rows)
+        # NULL, not NaN, where a coordinate can't be derived.
+        arrays = [df["id"].astype("int64").tolist()] + [
+            [None if v != v else v for v in df[c].tolist()] for c in COLUMNS
+        ]
+        async with conn.transaction():
+            await conn.execute(BACKFILL_UPDATE, *arrays)
+        total += len(df)
+        log(f"  {subject_id}: {len(df)} rows")
+    if total:
+        # Bump the dataset version so caches and the columnar copy reload.
+        await conn.execute(
+            """INSERT INTO upload_log (event_type, commit_message, rows_ingested, uploaded_by)
+               VALUES ('backfill', 'retinal coordinates', $1, 'app.retina')""",
+            total,
+        )
+    return total
+
+
+async def main():
+    database_url = os.environ.get("DATABASE_URL")
+    if not database_url:
+        raise RuntimeError("DATABASE_URL environment variable is not set")
+    conn = await asyncpg.connect(database_url, statement_cache_size=0)
+    try:
+        total = await backfill(conn)
+        print(f"Filled retinal coordinates for {total} rows")
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,46 @@
+"""Stateless admin session tokens.
+
+A token is `<expires_at>.<nonce>.<signature>`, where the signature is an
+HMAC-SHA256 over the first two parts. Any worker or instance that shares
+the secret can verify it without a lookup, so admin login keeps working
+under `uvicorn --workers N` or behind a load balancer.
+
+The secret defaults to a hash of ADMIN_PASSWORD, which means rotating the
+password also revokes every outstanding session.
+"""
+import hashlib
+import hmac
+import secrets
+import time
+from typing import Optional
+
+from app.config import settings
+
+
+def _secret() -> bytes:
+    if settings.session_secret:
+        return settings.session_secret.encode()
+    return hashlib.sha256(b"retinal-admin-session:" + settings.admin_password.encode()).digest()
+
+
+def _sign(payload: str) -> str:
+    return hmac.new(_secret(), payload.encode("utf-8", "surrogatepass"), hashlib.sha256).hexdigest()
+
+
+def issue_token(now: Optional[float] = None) -> str:
+    expires_at = int((now or time.time()) + settings.session_ttl_seconds)
+    payload = f"{expires_at}.{secrets.token_hex(16)}"
+    return f"{payload}.{_sign(payload)}"
+
+
+def verify_token(token: str, now: Optional[float] = None) -> bool:
+    try:
+        expires_at, nonce, signature = token.split(".")
+        expiry = int(expires_at)
+    except ValueError:
+        return False
+    # compare_digest only takes ASCII str, and the header is client-controlled: compare bytes.
+    expected = _sign(f"{expires_at}.{nonce}").encode()
+    if not hmac.compare_digest(signature.encode("utf-8", "surrogatepass"), expected):
+        return False
+    return (now or time.time()) < expiry
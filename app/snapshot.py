@@ -0,0 +1,140 @@
+"""On-disk, memory-mappable snapshot of the columnar cone_data copy.
+
+Layout under SNAPSHOT_DIR:
+
+    CURRENT            -> name of the live version directory, e.g. "v42"
+    v42/manifest.json  -> version, row count, column list
+    v42/<column>.npy   -> one plain .npy array per column
+    v42/<column>.dict.json -> dictionary for each text column
+
+Versions are named after the latest upload_log id, so every ingest produces
+a new directory. Workers open the arrays with `mmap_mode="r"`: the OS shares
+the pages between processes, so adding uvicorn workers doesn't multiply
+memory and startup is just a few `open` calls.
+
+CURRENT only moves forward. It is rewritten under an flock on `.lock`, and
+only when the new version is greater than the one it names, so a slow
+writer of an older version can't roll the workers back.
+
+Usage (rebuild from Postgres on demand):
+    DATABASE_URL=... SNAPSHOT_DIR=... python -m app.snapshot
+"""
+import asyncio
+import fcntl
+import json
+import os
+import shutil
+from typing import Optional
+
+import asyncpg
+import numpy as np
+
+from app.columnar import ColumnStore, TEXT_COLS, load_store
+
+KEEP_VERSIONS = 2
+
+
+def _current_path(root: str) -> str:
+    return os.path.join(root, "CURRENT")
+
+
+def current_version_dir(root: str) -> Optional[str]:
+    try:
+        with open(_current_path(root)) as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return os.path.join(root, name) if name else None
+
+
+def current_version(root: str) -> Optional[int]:
+    """The version CURRENT points at, or None if there is no snapshot yet."""
+    path = current_version_dir(root)
+    name = os.path.basename(path) if path else ""
+    return int(name[1:]) if name.startswith("v") and name[1:].isdigit() else None
+
+
+def write_snapshot(store: ColumnStore, root: str) -> str:
+    """Write `store` as a new version directory and point CURRENT at it if it is newer."""
+    name = f"v{store.version}"
+    final = os.path.join(root, name)
+    tmp = os.path.join(root, f".{name}.{os.getpid()}.tmp")
+    os.makedirs(root, exist_ok=True)
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    for col, arr in store.columns.items():
+        np.save(os.path.join(tmp, f"{col}.npy"), np.ascontiguousarray(arr))
+    for col in TEXT_COLS:
+        with open(os.path.join(tmp, f"{col}.dict.json"), "w") as f:
+            json.dump(store.dictionaries[col].tolist(), f)
+    with open(os.path.join(tmp, "manifest.json"), "w") as f:
+        json.dump({"version": store.version, "rows": store.size,
+                   "columns": sorted(store.columns)}, f)
+
+    # Another worker may have published the same version first; theirs wins.
+    if os.path.isdir(final):
+        shutil.rmtree(tmp, ignore_errors=True)
+    else:
+        os.replace(tmp, final)
+
+    with open(os.path.join(root, ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        current = current_version(root)
+        if current is None or store.version > current:
+            pointer_tmp = _current_path(root) + f".{os.getpid()}.tmp"
+            with open(pointer_tmp, "w") as f:
+                f.write(name)
+            os.replace(pointer_tmp, _current_path(root))
+        _prune(root, keep=os.path.basename(current_version_dir(root)))
+    return final
+
+
+def _prune(root: str, keep: str):
+    versions = sorted(
+        (d for d in os.listdir(root) if d.startswith("v") and d[1:].isdigit()),
+        key=lambda d: int(d[1:]),
+    )
+    # Older mappings stay valid after unlink, so pruning never breaks a live worker.
+    for d in versions[:-KEEP_VERSIONS]:
+        if d != keep:
+            shutil.rmtree(os.path.join(root, d), ignore_errors=True)
+
+
+def load_snapshot(root: str) -> Optional[ColumnStore]:
+    """Memory-map the CURRENT snapshot read-only, or None if there isn't one."""
+    path = current_version_dir(root)
+    if path is None or not os.path.isdir(path):
+        return None
+    with open(os.path.join(path, "manifest.json")) as f:
+        manifest = json.load(f)
+
+    columns = {
+        col: np.load(os.path.join(path, f"{col}.npy"), mmap_mode="r")
+        for col in manifest["columns"]
+    }
+    dictionaries = {}
+    for col in TEXT_COLS:
+        with open(os.path.join(path, f"{col}.dict.json")) as f:
+            dictionaries[col] = np.array(json.load(f), dtype=object)
+    return ColumnStore(columns, dictionaries, manifest["version"])
+
+
+async def main():
+    database_url = os.environ.get("DATABASE_URL")
+    root = os.environ.get("SNAPSHOT_DIR")
+    if not database_url or not root:
+        raise RuntimeError("DATABASE_URL and SNAPSHOT_DIR environment variables are required")
+
+    conn = await asyncpg.connect(database_url, statement_cache_size=0)
+    try:
+        store = await load_store(conn)
+    finally:
+        await conn.close()
+
+    path = write_snapshot(store, root)
+    print(f"Snapshot v{store.version}: {store.size} rows written to {path}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
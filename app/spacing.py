@@ -0,0 +1,108 @@
+"""Cone spacing analytics for one block: nearest-neighbour distances and Voronoi areas.
+
+Works on an app.blocks.BlockIndex, whose per-mosaic KD-trees are built
+once per block and dataset version. For the mosaic ("all") and each of the L, M and S submosaics the report has:
+
+    nn        nearest-neighbour distance (microns): summary, histogram and the
+              regularity index mean / sd (NNRI)
+    voronoi   cell areas (µm²) of that mosaic's own tessellation: summary,
+              histogram, regularity index (VDRI) and the share of 6-sided cells
+
+Edge cones are left out rather than corrected for: a cone counts towards
+`nn` only if it is at least its NN distance away from the block's bounding
+box (otherwise its true neighbour may lie outside the imaged patch), and a
+Voronoi cell counts only if it is closed and lies inside the bounding box.
+"""
+from itertools import chain
+from typing import Optional
+
+import numpy as np
+from scipy.spatial import Voronoi
+
+from app.blocks import MIN_CONES, BlockIndex
+
+
+def _summary(values: np.ndarray, bins: int) -> dict:
+    mean, sd = float(values.mean()), float(values.std(ddof=1))
+    counts, edges = np.histogram(values, bins=bins)
+    p5, median, p95 = np.percentile(values, [5, 50, 95]).tolist()
+    return {
+        "n": int(len(values)),
+        "mean": mean,
+        "sd": sd,
+        "median": median,
+        "p5": p5,
+        "p95": p95,
+        "regularity_index": mean / sd if sd > 0 else None,
+        "histogram": {"edges": edges, "counts": counts},
+    }
+
+
+def _nn(index: BlockIndex, name: str, bins: int) -> Optional[dict]:
+    tree = index.trees.get(name)
+    if tree is None:
+        return None
+    points = tree.data
+    distances, _ = tree.query(points, k=2)
+    nn = distances[:, 1]
+    to_edge = np.minimum(points - index.lo, index.hi - points).min(axis=1)
+    inner = nn <= to_edge
+    if inner.sum() < MIN_CONES:
+        return None
+    return _summary(nn[inner], bins)
+
+
+def _cell_areas(vor: Voronoi, lo: np.ndarray, hi: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(area, sides, usable) per input point, shoelace over all cells at once."""
+    n = len(vor.points)
+    regions = [vor.regions[r] for r in vor.point_region]
+    sides = np.fromiter(map(len, regions), dtype=np.int64, count=n)
+    flat = np.fromiter(chain.from_iterable(regions), dtype=np.int64, count=int(sides.sum()))
+    owner = np.repeat(np.arange(n), sides)
+
+    # Index of the next vertex around each cell, wrapping the last back to the first.
+    starts = np.cumsum(sides) - sides
+    nxt = np.arange(len(flat)) + 1
+    closing = (starts + sides - 1)[sides > 0]
+    nxt[closing] = starts[sides > 0]
+
+    open_vertex = flat < 0  # -1 marks a vertex at infinity
+    v = vor.vertices[np.where(open_vertex, 0, flat)]
+    outside = open_vertex | (v < lo).any(axis=1) | (v > hi).any(axis=1)
+    w = v[nxt]
+    cross = v[:, 0] * w[:, 1] - w[:, 0] * v[:, 1]
+    area = 0.5 * np.abs(np.bincount(owner, weights=cross, minlength=n))
+    usable = (np.bincount(owner, weights=outside, minlength=n) == 0) & (sides >= 3)
+    return area, sides, usable
+
+
+def _voronoi(index: BlockIndex, name: str, bins: int) -> Optional[dict]:
+    tree = index.trees.get(name)
+    if tree is None:
+        return None
+    try:
+        vor = Voronoi(tree.data)
+    except Exception:  # Qhull refuses degenerate (e.g. collinear) inputs
+        return None
+    area, sides, usable = _cell_areas(vor, index.lo, index.hi)
+    if usable.sum() < MIN_CONES:
+        return None
+    report = _summary(area[usable], bins)
+    report["hexagonal_fraction"] = float((sides[usable] == 6).mean())
+    return report
+
+
+def analyse(index: BlockIndex, bins: int) -> dict:
+    mosaics = {}
+    for name, idx in index.subsets.items():
+        mosaics[name] = {
+            "count": int(len(idx)),
+            "nn": _nn(index, name, bins),
+            "voronoi": _voronoi(index, name, bins),
+        }
+    return {
+        "cones": int(len(index.points)),
+        "duplicates_dropped": index.duplicates,
+        "bounds": index.bounds(),
+        "mosaics": mosaics,
+    }
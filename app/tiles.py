@@ -0,0 +1,191 @@
+"""z/x/y raster tile pyramid of one eye's cone montage.
+
+Tiles are cut from a fixed square of retina, ±EXTENT_MM around the fovea
+in montage coordinates (see app/retina.py), so every subject shares one
+grid. z=0 is a single TILE_SIZE px tile; each zoom level halves the pixel
+size. x grows temporally and y grows inferiorly, as in web map tiles. At
+MAX_ZOOM a pixel is about 0.5 µm, finer than cone spacing; beyond that,
+/plot-data and /montage give exact positions.
+
+A tile is rasterized in one pass: a single bincount over (type, row,
+column) gives the per-pixel counts of all cones and of L, M and S.
+Every block's cones are drawn, including those a neighbouring block
+imaged too (see app/overlap.py).
+There are two formats:
+
+    png   RGBA; each pixel is the L/M/S colours mixed by count. Opacity
+          rises with count, saturating at SATURATION_DENSITY cones/mm², so
+          all tiles of a zoom level share one scale.
+    json  sparse counts: flat pixel indices (row * TILE_SIZE + col) of the
+          non-empty pixels and, for each of all/L/M/S, the count there.
+
+Tiles are rendered on first request and written to disk under
+<root>/v<version>/<subject>/<eye>/<z>/<x>/<y>.<format>. A new dataset
+version starts a new directory, and older versions are pruned.
+"""
+import hashlib
+import os
+import re
+import shutil
+import struct
+import tempfile
+import zlib
+from typing import Optional
+
+import numpy as np
+
+from app.blocks import CONE_TYPES
+from app.config import settings
+
+TILE_SIZE = 256
+EXTENT_MM = 4.0
+MAX_ZOOM = 6
+FORMATS = ("png", "json")
+MEDIA_TYPES = {"png": "image/png", "json": "application/json"}
+MOSAICS = ("all", *CONE_TYPES)
+# Versions kept on disk; the previous one still serves requests in flight.
+KEEP_VERSIONS = 2
+
+SATURATION_DENSITY = 60000.0  # cones/mm²
+COLORS = np.array([
+    (150, 150, 150),  # unclassified
+    (220, 50, 47),    # L
+    (40, 160, 60),    # M
+    (38, 110, 220),   # S
+], dtype=float)
+
+# Cones of one eye inside a tile; $3..$6 are the tile bounds in mm.
+TILE_SQL = """
+    SELECT retinal_x_mm, retinal_y_mm, cone_spectral_type
+    FROM cone_data
+    WHERE subject_id = $1 AND UPPER(eye) = $2
+      AND retinal_x_mm >= $3 AND retinal_x_mm < $4
+      AND retinal_y_mm > $5 AND retinal_y_mm <= $6
+"""
+# Uses idx_cone_data_retina, like TILE_SQL.
+EXISTS_SQL = "SELECT EXISTS (SELECT 1 FROM cone_data WHERE subject_id = $1 AND UPPER(eye) = $2)"
+
+
+def valid(z: int, x: int, y: int) -> bool:
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def bounds(z: int, x: int, y: int) -> tuple[float, float, float, float]:
+    """(x_min, x_max, y_min, y_max) in mm; the tile's top edge is y_max."""
+    size = 2 * EXTENT_MM / 2 ** z
+    x_min = -EXTENT_MM + x * size
+    y_max = EXTENT_MM - y * size
+    return x_min, x_min + size, y_max - size, y_max
+
+
+def rasterize(rx: np.ndarray, ry: np.ndarray, types: np.ndarray, z: int, x: int, y: int) -> np.ndarray:
+    """(len(MOSAICS), TILE_SIZE, TILE_SIZE) counts; `types` is an object array of labels."""
+    x_min, x_max, _, y_max = bounds(z, x, y)
+    pixel = (x_max - x_min) / TILE_SIZE
+    col = np.floor((rx - x_min) / pixel).astype(np.int64)
+    row = np.floor((y_max - ry) / pixel).astype(np.int64)
+    inside = (col >= 0) & (col < TILE_SIZE) & (row >= 0) & (row < TILE_SIZE)
+    code = np.zeros(len(rx), dtype=np.int64)
+    for i, t in enumerate(CONE_TYPES, start=1):
+        code[types == t] = i
+    cells = TILE_SIZE * TILE_SIZE
+    flat = (code * TILE_SIZE + row) * TILE_SIZE + col
+    counts = np.bincount(flat[inside], minlength=(len(CONE_TYPES) + 1) * cells)
+    counts = counts.reshape(len(CONE_TYPES) + 1, TILE_SIZE, TILE_SIZE)
+    # Row 0 of the result is "all": the sum over unclassified + L + M + S.
+    return np.concatenate([counts.sum(axis=0, keepdims=True), counts[1:]]).astype(np.int64)
+
+
+def _png(rgba: np.ndarray) -> bytes:
+    """Minimal RGBA8 PNG encoder (filter 0 on every row)."""
+    height, width, _ = rgba.shape
+    raw = np.concatenate([np.zeros((height, 1), dtype=np.uint8), rgba.reshape(height, -1)], axis=1)
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+            + chunk(b"IDAT", zlib.compress(raw.tobytes(), 6)) + chunk(b"IEND", b""))
+
+
+def render_png(counts: np.ndarray, z: int) -> bytes:
+    total = counts[0]
+    unclassified = total - counts[1:].sum(axis=0)
+    by_type = np.concatenate([unclassified[None], counts[1:]]).astype(float)
+    weight = np.maximum(total, 1)[..., None]
+    rgb = np.tensordot(np.moveaxis(by_type, 0, -1), COLORS, axes=1) / weight
+    pixel_mm = 2 * EXTENT_MM / 2 ** z / TILE_SIZE
+    full = max(SATURATION_DENSITY * pixel_mm ** 2, 1.0)
+    alpha = np.clip(total / full, 0, 1) * 255
+    alpha[total > 0] = np.maximum(alpha[total > 0], 64)
+    rgba = np.dstack([rgb, alpha]).round().astype(np.uint8)
+    return _png(rgba)
+
+
+def render_json(counts: np.ndarray, z: int, x: int, y: int) -> dict:
+    flat = counts.reshape(len(MOSAICS), -1)
+    pixels = np.flatnonzero(flat[0])
+    return {
+        "z": z, "x": x, "y": y,
+        "size": TILE_SIZE,
+        "bounds_mm": list(bounds(z, x, y)),
+        "pixels": pixels,
+        "counts": {name: flat[i, pixels] for i, name in enumerate(MOSAICS)},
+    }
+
+
+def _safe(part: str) -> str:
+    """Path component for a user-supplied value; never '.', '..' or a separator."""
+    clean = re.sub(r"[^A-Za-z0-9_-]", "_", part)
+    if clean != part or not clean:
+        clean = f"{clean}-{hashlib.sha1(part.encode()).hexdigest()[:8]}"
+    return clean
+
+
+class TileCache:
+    """On-disk tiles of the current dataset version."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.version: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, version: int, subject_id: str, eye: str, z: int, x: int, y: int, fmt: str) -> str:
+        return os.path.join(self.root, f"v{version}", _safe(subject_id), _safe(eye),
+                            str(z), str(x), f"{y}.{fmt}")
+
+    def get(self, path: str) -> Optional[bytes]:
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, version: int, path: str, data: bytes):
+        self.misses += 1
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        if version != self.version:
+            self.version = version
+            self._prune(version)
+
+    def _prune(self, current: int):
+        versions = sorted(
+            (int(d[1:]) for d in os.listdir(self.root) if d.startswith("v") and d[1:].isdigit()),
+        )
+        for v in versions:
+            if v != current and v not in versions[-KEEP_VERSIONS:]:
+                shutil.rmtree(os.path.join(self.root, f"v{v}"), ignore_errors=True)
+
+    def stats(self) -> dict:
+        return {"root": self.root, "version": self.version, "hits": self.hits, "misses": self.misses}
+
+
+cache = TileCache(settings.tile_dir or os.path.join(tempfile.gettempdir(), "retinal-tiles"))
@@ -0,0 +1,125 @@
+"""Data-quality checks for a parsed upload, reported per block.
+
+Runs on the DataFrame from `parse_csv_bytes` before anything is written,
+so /admin/validate can flag bad blocks ahead of a full ingest. Every check
+is a pandas/NumPy operation over the whole frame, binned by the parser's
+`block` column; only the final report is assembled per block.
+
+Checks:
+    duplicate_coordinates  the same (x, y) more than once in a block
+    numcones               rows in the block != "Number of selected cones"
+    nonclass_cones         NC rows != "Number of Not classified cones"
+    lm_ratio               L/M recomputed from the cone types != stated
+    scones                 100 * S / classified cones != stated "% S-cones"
+    outside_fov            coordinates outside the stated FOV (mm) for the
+                           block's origin ("Top-left corner of FOV" or centre)
+    missing_metadata       required parameters with no value
+
+Stated values are rounded in the export (ratios to 0.1, FOV to 0.01 mm),
+so comparisons allow half a unit in the last place.
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+CONE_TYPES = ["L", "M", "S", "NC"]
+REQUIRED_METADATA = [
+    "subject_id", "eye", "meridian", "eccentricity_deg", "fov", "cone_origin",
+    "numcones", "nonclass_cones", "lm_ratio", "scones",
+]
+RATIO_TOLERANCE = 0.05 + 1e-9
+FOV_TOLERANCE_MICRONS = 5.0
+_FOV_RE = r"([0-9]*\.?[0-9]+)\s*[xX×]\s*([0-9]*\.?[0-9]+)"
+
+
+def _value(v):
+    if v is None or (isinstance(v, float) and np.isnan(v)):
+        return None
+    return v.item() if isinstance(v, np.generic) else v
+
+
+def check_blocks(df: pd.DataFrame) -> dict:
+    started = time.perf_counter()
+    df = df.reindex(columns=list(dict.fromkeys([*df.columns, *REQUIRED_METADATA])))
+    # The parser stamps each block's metadata on every row, so the first row is enough.
+    meta = df.loc[~df["block"].duplicated(), ["block", *REQUIRED_METADATA]].set_index("block").sort_index()
+    block_ids = meta.index.to_numpy()
+    inv = np.searchsorted(block_ids, df["block"].to_numpy())
+    n_blocks = len(block_ids)
+
+    cones = np.bincount(inv, minlength=n_blocks)
+    type_codes = pd.Categorical(df["cone_spectral_type"], categories=CONE_TYPES).codes + 1
+    counts = np.bincount(inv * 5 + type_codes, minlength=n_blocks * 5).reshape(n_blocks, 5)[:, 1:]
+    n_l, n_m, n_s, n_nc = counts.T
+
+    x = df["cone_x_microns"].to_numpy(dtype=float)
+    y = df["cone_y_microns"].to_numpy(dtype=float)
+    has_xy = ~(np.isnan(x) | np.isnan(y))
+    dup = df.duplicated(["block", "cone_x_microns", "cone_y_microns"]).to_numpy() & has_xy
+    duplicates = np.bincount(inv, weights=dup, minlength=n_blocks).astype(int)
+
+    # FOV "w x h" in mm -> microns; origin decides whether (0, 0) is a corner or the centre.
+    fov = meta["fov"].astype("string").str.extract(_FOV_RE).astype(float).to_numpy() * 1000.0
+    width, height = fov[:, 0], fov[:, 1]
+    origin = meta["cone_origin"].astype("string").str.lower()
+    centred = origin.str.contains("cent", na=False).to_numpy()
+    fov_checked = (~np.isnan(width) & ~np.isnan(height)
+                   & (centred | origin.str.contains("top-left", na=False).to_numpy()))
+    x0 = np.where(centred, -width / 2, 0.0)
+    y0 = np.where(centred, -height / 2, 0.0)
+    tol = FOV_TOLERANCE_MICRONS
+    with np.errstate(invalid="ignore"):
+        outside = has_xy & (
+            (x < x0[inv] - tol) | (x > (x0 + width)[inv] + tol)
+            | (y < y0[inv] - tol) | (y > (y0 + height)[inv] + tol)
+        )
+    out_of_fov = np.bincount(inv, weights=outside, minlength=n_blocks).astype(int)
+
+    classified = cones - n_nc
+    with np.errstate(divide="ignore", invalid="ignore"):
+        lm = np.round(np.where(n_m > 0, n_l / n_m, np.nan), 3)
+        s_pct = np.round(np.where(classified > 0, 100.0 * n_s / classified, np.nan), 3)
+
+    missing = meta.isna().to_numpy()
+    stated = {c: meta[c].to_numpy(dtype=float) for c in ("numcones", "nonclass_cones", "lm_ratio", "scones")}
+    with np.errstate(invalid="ignore"):
+        flags = {
+            "duplicate_coordinates": duplicates > 0,
+            "numcones": ~np.isnan(stated["numcones"]) & (stated["numcones"] != cones),
+            "nonclass_cones": ~np.isnan(stated["nonclass_cones"]) & (stated["nonclass_cones"] != n_nc),
+            "lm_ratio": np.abs(lm - stated["lm_ratio"]) > RATIO_TOLERANCE,
+            "scones": np.abs(s_pct - stated["scones"]) > RATIO_TOLERANCE,
+            "outside_fov": fov_checked & (out_of_fov > 0),
+            "missing_metadata": missing.any(axis=1),
+        }
+    flagged = np.column_stack(list(flags.values()))
+
+    blocks = []
+    for i, (b, m) in enumerate(zip(block_ids, meta.to_dict("records"))):
+        blocks.append({
+            "block": int(b),
+            "subject_id": _value(m["subject_id"]),
+            "eye": _value(m["eye"]),
+            "meridian": _value(m["meridian"]),
+            "eccentricity_deg": _value(m["eccentricity_deg"]),
+            "cones": int(cones[i]),
+            "counts": dict(zip(CONE_TYPES, counts[i].tolist())),
+            "numcones": _value(m["numcones"]),
+            "nonclass_cones": _value(m["nonclass_cones"]),
+            "lm_ratio": {"stated": _value(m["lm_ratio"]), "computed": _value(lm[i])},
+            "scones": {"stated": _value(m["scones"]), "computed": _value(s_pct[i])},
+            "duplicate_coordinates": int(duplicates[i]),
+            "outside_fov": int(out_of_fov[i]) if fov_checked[i] else None,
+            "missing_metadata": [c for c, gone in zip(REQUIRED_METADATA, missing[i]) if gone],
+            "issues": [name for name, f in zip(flags, flagged[i]) if f],
+        })
+
+    return {
+        "ok": not flagged.any(),
+        "blocks_checked": n_blocks,
+        "blocks_with_issues": int(flagged.any(axis=1).sum()),
+        "issue_counts": {name: int(f.sum()) for name, f in flags.items()},
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+        "blocks": blocks,
+    }
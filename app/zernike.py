@@ -0,0 +1,171 @@
+"""Zernike wavefront evaluation for the per-block coefficients in block_optics.
+
+Coefficients are stored in OSA/ANSI single-index order (j = 0 piston,
+1-2 tilt, 3-5 defocus/astigmatism, ...) with the orthonormal OSA
+normalisation, so over the full pupil the RMS wavefront error is simply the
+root-sum-square of every coefficient after piston. Values keep the units of
+the instrument export (microns).
+
+A basis is the matrix of every polynomial sampled at the pixels inside the
+pupil of a square grid. It depends only on (terms, grid size, pupil
+fraction), never on the coefficients, so it is built once with NumPy and
+kept in an LRU cache; evaluating a block is then a single mat-vec. The
+fraction is rounded up to one of PUPIL_STEPS values and the cache is capped
+at BASIS_CACHE_BYTES, since a 66-term 256 x 256 basis alone is ~27 MB and
+both inputs come from the query string.
+"""
+import math
+import re
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+# Radial orders up to 10 (66 terms) cover any aberrometer export.
+MAX_TERMS = 66
+# Terms below j = 6 are piston, tilt, defocus and astigmatism (orders 0-2).
+FIRST_HIGHER_ORDER = 6
+# Evaluated pupils are whole twentieths of the fitted one.
+PUPIL_STEPS = 20
+# About four of the largest bases (66 terms, grid 256); smaller ones fit by the dozen.
+BASIS_CACHE_BYTES = 128 * 1024 * 1024
+
+_NM_RE = re.compile(r"\(?\s*(\d+)\s*,\s*([-+]?\d+)\s*\)?")
+_J_RE = re.compile(r"(\d+)")
+
+
+def osa_index(n: int, m: int) -> Optional[int]:
+    if n < 0 or abs(m) > n or (n - m) % 2:
+        return None
+    return (n * (n + 2) + m) // 2
+
+
+def osa_nm(j: int) -> tuple[int, int]:
+    n = math.ceil((-3 + math.sqrt(9 + 8 * j)) / 2)
+    return n, 2 * j - n * (n + 2)
+
+
+def parse_coefficients(labels, values) -> Optional[list[float]]:
+    """Coefficient list in OSA order from a block's `Zernike Coeffs`/`Values` pair.
+
+    A label like "Z(4,0)" or "(4, 0)" is read as (n, m); a bare number as the
+    OSA index j. Rows with an unreadable label are taken in order from j = 0.
+    Returns None when the block has no numeric coefficients.
+    """
+    coeffs: dict[int, float] = {}
+    position = 0
+    for label, value in zip(labels, values):
+        try:
+            c = float(value)
+        except (TypeError, ValueError):
+            continue
+        if math.isnan(c):
+            continue
+        text = "" if label is None or label != label else str(label)
+        j = None
+        m = _NM_RE.search(text)
+        if m:
+            j = osa_index(int(m.group(1)), int(m.group(2)))
+        else:
+            m = _J_RE.search(text)
+            if m:
+                j = int(m.group(1))
+        if j is None:
+            j = position
+        if j < MAX_TERMS:
+            coeffs[j] = c
+        position += 1
+    if not coeffs:
+        return None
+    out = [0.0] * (max(coeffs) + 1)
+    for j, c in coeffs.items():
+        out[j] = c
+    return out
+
+
+def _radial(n: int, m: int, rho: np.ndarray) -> np.ndarray:
+    m = abs(m)
+    out = np.zeros_like(rho)
+    for k in range((n - m) // 2 + 1):
+        c = ((-1) ** k * math.factorial(n - k)
+             / (math.factorial(k) * math.factorial((n + m) // 2 - k) * math.factorial((n - m) // 2 - k)))
+        out += c * rho ** (n - 2 * k)
+    return out
+
+
+def pupil_step(fraction: float) -> float:
+    """`fraction` rounded up to a whole PUPIL_STEPS step, never past the fitted pupil."""
+    return min(1.0, math.ceil(fraction * PUPIL_STEPS - 1e-9) / PUPIL_STEPS)
+
+
+_bases: OrderedDict[tuple, tuple[np.ndarray, np.ndarray]] = OrderedDict()
+_bases_bytes = 0
+# Requests evaluate in worker threads (asyncio.to_thread).
+_bases_lock = threading.Lock()
+
+
+def basis(n_terms: int, grid: int, pupil_fraction: float = 1.0) -> tuple[np.ndarray, np.ndarray]:
+    """(inside, Z): boolean grid x grid pupil mask and the (n_terms, inside.sum()) basis.
+
+    The grid spans the evaluated pupil; `pupil_fraction` (<= 1) is its
+    diameter as a fraction of the pupil the coefficients were fitted over.
+    Both arrays are read-only because they are shared between requests.
+    """
+    global _bases_bytes
+    key = (n_terms, grid, pupil_fraction)
+    with _bases_lock:
+        cached = _bases.get(key)
+        if cached is not None:
+            _bases.move_to_end(key)
+            return cached
+    inside, z = _build_basis(n_terms, grid, pupil_fraction)
+    with _bases_lock:
+        if key not in _bases:
+            _bases[key] = (inside, z)
+            _bases_bytes += inside.nbytes + z.nbytes
+            while _bases_bytes > BASIS_CACHE_BYTES:
+                old_inside, old_z = _bases.popitem(last=False)[1]
+                _bases_bytes -= old_inside.nbytes + old_z.nbytes
+    return inside, z
+
+
+def _build_basis(n_terms: int, grid: int, pupil_fraction: float) -> tuple[np.ndarray, np.ndarray]:
+    axis = (np.arange(grid) + 0.5) / grid * 2.0 - 1.0
+    x, y = np.meshgrid(axis, -axis)
+    r = np.hypot(x, y)
+    inside = r <= 1.0
+    rho = r[inside] * pupil_fraction
+    theta = np.arctan2(y[inside], x[inside])
+
+    z = np.empty((n_terms, rho.size))
+    for j in range(n_terms):
+        n, m = osa_nm(j)
+        norm = math.sqrt(2 * (n + 1)) if m else math.sqrt(n + 1)
+        angular = np.cos(m * theta) if m >= 0 else np.sin(-m * theta)
+        z[j] = norm * _radial(n, m, rho) * angular
+    inside.setflags(write=False)
+    z.setflags(write=False)
+    return inside, z
+
+
+def wavefront(coeffs: list[float], grid: int, pupil_fraction: float = 1.0) -> dict:
+    """Wavefront map (NaN outside the pupil) and its RMS / peak-to-valley.
+
+    `pupil_fraction` should already be a `pupil_step()`; other values are
+    rounded up to one.
+    """
+    c = np.asarray(coeffs[:MAX_TERMS], dtype=np.float64)
+    inside, z = basis(len(c), grid, pupil_step(pupil_fraction))
+    w = c @ z
+    hoa = c[FIRST_HIGHER_ORDER:] @ z[FIRST_HIGHER_ORDER:] if len(c) > FIRST_HIGHER_ORDER else np.zeros_like(w)
+
+    surface = np.full(inside.shape, np.nan)
+    surface[inside] = w
+    return {
+        "map": surface,
+        # Piston-removed RMS over the sampled pupil.
+        "rms": float(w.std()),
+        "rms_higher_order": float(hoa.std()),
+        "peak_to_valley": float(w.max() - w.min()),
+    }
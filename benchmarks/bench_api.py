@@ -0,0 +1,443 @@
+"""End-to-end API benchmark against a throwaway local PostgreSQL.
+
+Steps:
+    1. initdb + pg_ctl a scratch cluster in a temp dir (or use --database-url)
+    2. create the schema with app.create_schema
+    3. start uvicorn on app.main:app as a subprocess
+    4. POST every CSV in --data-dir to /admin/upload (the real ingestion path)
+       and wait for upload_log to show them all
+    5. drive each route with a realistic query mix at fixed concurrency
+    6. write throughput, p50/p95/p99 latency, status counts and the server's
+       peak RSS to --json
+
+PostgreSQL binaries are taken from --pg-bin, $PG_BIN or PATH. initdb
+refuses to run as root; run as an ordinary user or point --database-url at
+an empty database you don't mind filling. Needs httpx on top of
+requirements.txt.
+
+Usage:
+    python -m benchmarks.bench_api [--concurrency 8] [--requests 200]
+        [--data-dir Cone_classification_data] [--env COLUMNAR_ENGINE=true]
+        [--json bench.json]
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+import asyncpg
+import httpx
+import numpy as np
+
+ADMIN_PASSWORD = "bench-admin-password"
+# Bulk routes move megabytes per call; a smaller count keeps a run under a few minutes.
+BULK_ROUTES = {"/subjects/data", "/cones/export", "/admin/validate"}
+CONE_TYPES = ("L", "M", "S")
+# Longest wait for the uploads' background ingests to appear in upload_log.
+INGEST_TIMEOUT_SECONDS = 600
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _pg_tool(pg_bin: Optional[str], name: str) -> str:
+    path = os.path.join(pg_bin, name) if pg_bin else shutil.which(name)
+    if not path or not os.path.exists(path):
+        sys.exit(f"{name} not found; pass --pg-bin, set PG_BIN, or use --database-url")
+    return path
+
+
+@contextmanager
+def throwaway_postgres(pg_bin: Optional[str]):
+    if hasattr(os, "geteuid") and os.geteuid() == 0:
+        sys.exit("initdb cannot run as root; run as another user or pass --database-url")
+    root = tempfile.mkdtemp(prefix="bench-pg-")
+    data = os.path.join(root, "data")
+    port = _free_port()
+    subprocess.run([_pg_tool(pg_bin, "initdb"), "-D", data, "-U", "postgres", "-A", "trust"],
+                   check=True, stdout=subprocess.DEVNULL)
+    pg_ctl = _pg_tool(pg_bin, "pg_ctl")
+    subprocess.run(
+        [pg_ctl, "-D", data, "-l", os.path.join(root, "postgres.log"), "-w", "start",
+         "-o", f"-p {port} -k {root} -c listen_addresses=127.0.0.1 -c fsync=off"],
+        check=True, stdout=subprocess.DEVNULL,
+    )
+    try:
+        yield f"postgresql://postgres@127.0.0.1:{port}/postgres"
+    finally:
+        subprocess.run([pg_ctl, "-D", data, "-m", "fast", "-w", "stop"], stdout=subprocess.DEVNULL)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def _peak_rss_bytes(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+@contextmanager
+def api_server(env: dict):
+    port = _free_port()
+    # The per-request log goes to stderr; a file keeps a full pipe from stalling the server.
+    log = tempfile.TemporaryFile()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=log,
+    )
+    proc.log = log
+    try:
+        yield proc, f"http://127.0.0.1:{port}"
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+        log.close()
+
+
+async def wait_until_up(client: httpx.AsyncClient, proc: subprocess.Popen):
+    for _ in range(300):
+        if proc.poll() is not None:
+            proc.log.seek(0)
+            sys.exit(f"server exited:\n{proc.log.read().decode(errors='replace')[-4000:]}")
+        try:
+            if (await client.get("/stats")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.1)
+    sys.exit("server did not start within 30 s")
+
+
+async def ingest(client: httpx.AsyncClient, database_url: str, paths: list[str], token: str) -> dict:
+    headers = {"Authorization": f"Bearer {token}"}
+    conn = await asyncpg.connect(database_url)
+    try:
+        # --database-url may point at a database that already has uploads; count only ours.
+        baseline = await conn.fetchval("SELECT COALESCE(MAX(id), 0) FROM upload_log")
+    finally:
+        await conn.close()
+
+    started = time.perf_counter()
+    for path in paths:
+        with open(path, "rb") as f:
+            r = await client.post("/admin/upload", headers=headers,
+                                  files={"file": (os.path.basename(path), f.read())},
+                                  data={"commit_message": "benchmark load"})
+        r.raise_for_status()
+
+    conn = await asyncpg.connect(database_url)
+    try:
+        # A failed background ingest never logs a row, so wait with a deadline.
+        deadline = started + INGEST_TIMEOUT_SECONDS
+        while (done := await conn.fetchval("SELECT COUNT(*) FROM upload_log WHERE id > $1", baseline)) < len(paths):
+            if time.perf_counter() > deadline:
+                sys.exit(f"only {done} of {len(paths)} uploads were ingested within "
+                         f"{INGEST_TIMEOUT_SECONDS} s; check the server log for a failed ingest")
+            await asyncio.sleep(0.1)
+        wall = time.perf_counter() - started
+        totals = await conn.fetchrow(
+            """SELECT SUM(rows_ingested)::bigint AS rows, SUM(bytes_ingested)::bigint AS bytes,
+                      SUM(parse_ms) AS parse_ms, SUM(convert_ms) AS convert_ms,
+                      SUM(delete_ms) AS delete_ms, SUM(insert_ms) AS insert_ms,
+                      SUM(derive_ms) AS derive_ms
+               FROM upload_log WHERE id > $1""",
+            baseline,
+        )
+    finally:
+        await conn.close()
+    return {"files": len(paths), "wall_seconds": wall,
+            "rows_per_second": (totals["rows"] or 0) / wall, **dict(totals)}
+
+
+def build_scenarios(blocks: dict, csv_bodies: list[bytes]) -> dict:
+    """route -> zero-arg callable returning (method, url, request kwargs)."""
+    subjects = sorted(k for k in blocks if isinstance(k, str))
+
+    def block():
+        subject = random.choice(subjects)
+        meridian, eye = random.choice(blocks[subject])
+        return subject, meridian, eye
+
+    def ecc_window(subject, meridian, eye):
+        ranges = blocks[(subject, meridian, eye)]
+        if not ranges:
+            return {}
+        r = random.choice(ranges)
+        return {"eccentricity_min": r["min"], "eccentricity_max": r["max"]}
+
+    def types():
+        return random.sample(CONE_TYPES, random.randint(1, 3))
+
+    def plot_data():
+        s, m, e = block()
+        return "GET", "/plot-data", {"params": {"subject_id": s, "meridian": m, "eye": e,
+                                                "cone_spectral_type": types(), **ecc_window(s, m, e)}}
+
+    def metadata():
+        s, m, e = block()
+        return "GET", "/metadata", {"params": {"subject_id": s, "meridian": m, "eye": e,
+                                               **ecc_window(s, m, e)}}
+
+    def cones():
+        s, _, e = block()
+        return "GET", "/cones", {"params": {"subject_id": s, "eye": e, "limit": 1000,
+                                            "offset": random.choice((0, 1000, 5000))}}
+
+    def ecc_ranges():
+        s, m, e = block()
+        return "GET", "/eccentricity-ranges", {"params": {"subject_id": s, "meridian": m, "eye": e}}
+
+    def export():
+        s, m, e = block()
+        return "GET", "/cones/export", {"params": {"subject_id": s, "meridian": m, "eye": e}}
+
+    def block_ecc():
+        s, m, e = block()
+        ranges = blocks[(s, m, e)]
+        # Each range is the block's eccentricity + 0.05 deg (see /eccentricity-ranges).
+        ecc = random.choice(ranges)["max"] - 0.05 if ranges else 0.0
+        return {"subject_id": s, "meridian": m, "eye": e, "eccentricity_deg": ecc}
+
+    def wavefront():
+        return "GET", "/wavefront", {"params": block_ecc()}
+
+    def spacing():
+        return "GET", "/spacing", {"params": block_ecc()}
+
+    def randomness():
+        return "GET", "/randomness", {"params": block_ecc()}
+
+    def density():
+        return "GET", "/density", {"params": {**block_ecc(), "method": random.choice(("hist", "kde"))}}
+
+    def montage():
+        s, _, e = block()
+        return "GET", "/montage", {"params": {"subject_id": s, "eye": e, "cone_spectral_type": types()}}
+
+    def overlap():
+        s, _, e = block()
+        return "GET", "/overlap", {"params": {"subject_id": s, "eye": e}}
+
+    def tile():
+        s, _, e = block()
+        z = random.randint(0, 4)
+        # Tiles near the centre of the grid, where the montage is.
+        x, y = (random.randint(max(2 ** (z - 1) - 1, 0), 2 ** (z - 1) if z else 0) for _ in range(2))
+        return "GET", f"/tiles/{s}/{e}/{z}/{x}/{y}.{random.choice(('png', 'json'))}", {}
+
+    def cohort():
+        s, m, _ = block()
+        return "GET", "/cohort", {"params": {"meridian": m, "subject_id": s}}
+
+    def validate():
+        return "POST", "/admin/validate", {"files": {"file": ("bench.csv", random.choice(csv_bodies))},
+                                           "auth": True}
+
+    return {
+        "/patients": lambda: ("GET", "/patients", {}),
+        "/cones": cones,
+        "/plot-data": plot_data,
+        "/metadata": metadata,
+        "/eccentricity-ranges": ecc_ranges,
+        "/subjects/data": lambda: ("GET", "/subjects/data", {}),
+        "/upload-log": lambda: ("GET", "/upload-log", {}),
+        "/cones/export": export,
+        "/wavefront": wavefront,
+        "/spacing": spacing,
+        "/density": density,
+        "/randomness": randomness,
+        "/cohort": cohort,
+        "/montage": montage,
+        "/overlap": overlap,
+        "/tiles": tile,
+        "/stats": lambda: ("GET", "/stats", {}),
+        "/metrics": lambda: ("GET", "/metrics", {}),
+        "/admin/login": lambda: ("POST", "/admin/login", {"json": {"password": ADMIN_PASSWORD}}),
+        "/admin/profiles": lambda: ("GET", "/admin/profiles", {"auth": True}),
+        "/admin/validate": validate,
+    }
+
+
+async def discover_blocks(client: httpx.AsyncClient, database_url: str) -> dict:
+    """subject -> [(meridian, eye)], and (subject, meridian, eye) -> eccentricity ranges."""
+    conn = await asyncpg.connect(database_url)
+    try:
+        rows = await conn.fetch(
+            "SELECT DISTINCT subject_id, meridian, eye FROM cone_data "
+            "WHERE meridian IS NOT NULL AND eye IS NOT NULL"
+        )
+    finally:
+        await conn.close()
+    blocks: dict = {}
+    for r in rows:
+        blocks.setdefault(r["subject_id"], []).append((r["meridian"], r["eye"]))
+        resp = await client.get("/eccentricity-ranges", params=dict(r))
+        blocks[(r["subject_id"], r["meridian"], r["eye"])] = resp.json().get("ranges", [])
+    return blocks
+
+
+async def drive(client: httpx.AsyncClient, scenario, requests: int, concurrency: int, token: str) -> dict:
+    latencies: list[float] = []
+    statuses: dict[int, int] = {}
+    errors = 0
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            method, url, kwargs = scenario()
+            kwargs = dict(kwargs)
+            if kwargs.pop("auth", False):
+                kwargs["headers"] = {"Authorization": f"Bearer {token}"}
+            started = time.perf_counter()
+            try:
+                r = await client.request(method, url, **kwargs)
+                await r.aread()
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+            statuses[r.status_code] = statuses.get(r.status_code, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+    ms = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "wall_seconds": wall,
+        "throughput_rps": len(latencies) / wall if wall else 0.0,
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+        "status_counts": {str(k): v for k, v in sorted(statuses.items())},
+        "transport_errors": errors,
+    }
+
+
+def _uncovered_routes(scenarios: dict) -> list[str]:
+    from app.main import app
+
+    paths = {r.path for r in app.routes if getattr(r, "include_in_schema", False) or r.path == "/metrics"}
+    # Upload is exercised by the ingest phase; profile downloads need a profile id.
+    skip = {"/admin/upload", "/admin/profiles/{profile_id}/{kind}"}
+    return sorted(p for p in paths - skip - set(scenarios) if not p.startswith(("/docs", "/openapi", "/redoc")))
+
+
+async def run(args, database_url: str) -> dict:
+    env = {**os.environ, "DATABASE_URL": database_url, "ADMIN_PASSWORD": ADMIN_PASSWORD,
+           "ALLOWED_ORIGINS": "http://localhost"}
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    os.environ.update(env)
+
+    subprocess.run([sys.executable, "-m", "app.create_schema"], env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+    paths = sorted(glob.glob(os.path.join(args.data_dir, "*.csv")))
+    if not paths:
+        sys.exit(f"no CSVs in {args.data_dir}")
+
+    with api_server(env) as (proc, base_url):
+        limits = httpx.Limits(max_connections=args.concurrency * 2)
+        async with httpx.AsyncClient(base_url=base_url, timeout=300, limits=limits) as client:
+            await wait_until_up(client, proc)
+            token = (await client.post("/admin/login", json={"password": ADMIN_PASSWORD})).json()["token"]
+            ingest_result = await ingest(client, database_url, paths, token)
+
+            blocks = await discover_blocks(client, database_url)
+            csv_bodies = [open(p, "rb").read() for p in paths[:3]]
+            scenarios = build_scenarios(blocks, csv_bodies)
+            missing = _uncovered_routes(scenarios)
+            if missing:
+                print(f"warning: no benchmark scenario for {', '.join(missing)}", file=sys.stderr)
+
+            routes = {}
+            for route, scenario in scenarios.items():
+                if args.only and route not in args.only:
+                    continue
+                n = max(args.requests // 10, args.concurrency) if route in BULK_ROUTES else args.requests
+                routes[route] = await drive(client, scenario, n, args.concurrency, token)
+                print(f"{route:22} {routes[route]['throughput_rps']:8.1f} req/s  "
+                      f"p50 {routes[route]['p50_ms']:8.1f}  p95 {routes[route]['p95_ms']:8.1f}  "
+                      f"p99 {routes[route]['p99_ms']:8.1f} ms  {routes[route]['status_counts']}")
+        peak_rss = _peak_rss_bytes(proc.pid)
+
+    if peak_rss is None:
+        # Not Linux: the server has been reaped by now, so its peak shows up here.
+        peak_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        peak_rss *= 1 if sys.platform == "darwin" else 1024
+    return {"ingest": ingest_result, "routes": routes, "server_peak_rss_bytes": peak_rss}
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200, help="Requests per route (bulk routes use a tenth)")
+    parser.add_argument("--data-dir", default="Cone_classification_data")
+    parser.add_argument("--database-url", help="Use this empty database instead of a throwaway cluster")
+    parser.add_argument("--pg-bin", default=os.environ.get("PG_BIN"), help="Directory with initdb and pg_ctl")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="Extra server environment, e.g. COLUMNAR_ENGINE=true")
+    parser.add_argument("--only", action="append", metavar="ROUTE", help="Benchmark only these routes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write results to this file as JSON")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    if args.database_url:
+        result = asyncio.run(run(args, args.database_url))
+    else:
+        with throwaway_postgres(args.pg_bin) as database_url:
+            result = asyncio.run(run(args, database_url))
+
+    result = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "concurrency": args.concurrency,
+        "seed": args.seed,
+        "server_env": args.env,
+        **result,
+    }
+    print(f"ingest: {result['ingest']['rows']} rows in {result['ingest']['wall_seconds']:.1f} s; "
+          f"server peak RSS {result['server_peak_rss_bytes'] / 2**20:.0f} MiB")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""CPU benchmark: stdlib JSONResponse path vs app.responses, per endpoint shape.
+
+Builds each endpoint's result from the real CSVs in Cone_classification_data/
+(no database needed) and times, in process CPU seconds:
+
+    before  dict(row) + isinstance(datetime) loop + JSONResponse(...).body
+    after   app.responses.Payload (orjson), plus gzip/brotli of the same body
+
+Row-shaped results are asyncpg Records, as `conn.fetch()` returns them, so
+both sides pay for turning each Record into a mapping.
+
+Usage:
+    python -m benchmarks.bench_serialization [--repeat 5] [--json out.json]
+"""
+import argparse
+import glob
+import json
+import time
+from datetime import datetime, timedelta, timezone
+
+from asyncpg.protocol.protocol import _create_record
+from fastapi.responses import JSONResponse
+
+from app.csv_parser import parse_csv_bytes, to_row
+from app.responses import Payload
+
+DATA_DIR = "Cone_classification_data"
+CONE_COLUMNS = (
+    "cone_x_microns", "cone_y_microns", "cone_spectral_type",
+    "subject_id", "eye", "meridian", "eccentricity_deg", "eccentricity_mm",
+    "lm_ratio", "scones", "lcone_density", "mcone_density", "scone_density",
+    "numcones", "nonclass_cones", "age", "fov", "ret_mag_factor",
+    "cone_origin", "zernike_pupil_diam", "zernike_measure_wave", "zernike_optim_wave",
+)
+SUBJECTS_DATA_COLUMNS = (
+    "subject_id", "eye", "meridian", "eccentricity_deg", "cone_spectral_type",
+    "cone_x_microns", "cone_y_microns", "lm_ratio", "scones",
+)
+
+
+def load_rows() -> list[dict]:
+    rows = []
+    for path in sorted(glob.glob(f"{DATA_DIR}/*.csv")):
+        with open(path, "rb") as f:
+            df = parse_csv_bytes(f.read())
+        for r in df.to_dict("records"):
+            rows.append({"id": len(rows) + 1, **dict(zip(CONE_COLUMNS, to_row(r)))})
+    return rows
+
+
+def records(rows: list[dict]) -> list:
+    """The rows as asyncpg Records, via the constructor asyncpg's own tests use."""
+    mapping = {k: i for i, k in enumerate(rows[0])}
+    return [_create_record(mapping, tuple(r.values())) for r in rows]
+
+
+def build_cases(rows: list[dict]) -> dict:
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    upload_log = [
+        {"id": i, "uploaded_at": start + timedelta(hours=i), "subject_id": "AO001",
+         "eye": "OS", "event_type": "update", "commit_message": "re-upload",
+         "rows_ingested": 12000, "uploaded_by": "admin"}
+        for i in range(100)
+    ]
+    plot = rows[:50000]
+    return {
+        "/cones": ("rows", records(rows[:50000])),
+        "/plot-data": ("object", {
+            "x": [r["cone_x_microns"] for r in plot],
+            "y": [r["cone_y_microns"] for r in plot],
+            "cone_type": [r["cone_spectral_type"] for r in plot],
+        }),
+        "/subjects/data": ("rows", records([{k: r[k] for k in SUBJECTS_DATA_COLUMNS} for r in rows])),
+        "/upload-log": ("rows", records(upload_log)),
+    }
+
+
+def before(kind: str, content) -> bytes:
+    if kind == "object":
+        return JSONResponse(content=content).body
+    result = []
+    for r in content:
+        row_dict = dict(r)
+        for k, v in row_dict.items():
+            if isinstance(v, datetime):
+                row_dict[k] = v.isoformat()
+        result.append(row_dict)
+    return JSONResponse(content=result).body
+
+
+def cpu(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.process_time()
+        fn()
+        best = min(best, time.process_time() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", help="Write results to this file as JSON")
+    args = parser.parse_args()
+
+    rows = load_rows()
+    results = []
+    for route, (kind, content) in build_cases(rows).items():
+        payload = Payload.from_content(content)
+        result = {
+            "route": route,
+            "before_ms": cpu(lambda: before(kind, content), args.repeat) * 1000,
+            "after_ms": cpu(lambda: Payload.from_content(content), args.repeat) * 1000,
+            "gzip_ms": cpu(lambda: Payload(payload.body).encoded("gzip"), args.repeat) * 1000,
+            "br_ms": cpu(lambda: Payload(payload.body).encoded("br"), args.repeat) * 1000,
+            "bytes": len(payload.body),
+            "gzip_bytes": len(payload.encoded("gzip")),
+            "br_bytes": len(payload.encoded("br")),
+        }
+        results.append(result)
+
+    print(f"{'route':16} {'before ms':>10} {'after ms':>9} {'speedup':>8} "
+          f"{'gzip ms':>8} {'br ms':>7} {'bytes':>10} {'gzip':>9} {'br':>9}")
+    for r in results:
+        print(f"{r['route']:16} {r['before_ms']:10.1f} {r['after_ms']:9.1f} "
+              f"{r['before_ms'] / max(r['after_ms'], 1e-6):7.1f}x "
+              f"{r['gzip_ms']:8.1f} {r['br_ms']:7.1f} "
+              f"{r['bytes']:10d} {r['gzip_bytes']:9d} {r['br_bytes']:9d}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Cold-start benchmark for the serverless entry point (api/index.py).
+
+Each run is a fresh interpreter, as on a cold serverless instance:
+
+    import     seconds to `from api.index import app`
+    first      seconds for the first request, including opening the
+               database pool (the ASGI lifespan is not run, as on Vercel)
+    connect    the part of `first` spent connecting (its Server-Timing
+               "connect" stage); compare DB_MODE settings with --env
+    second     seconds for the same request again, for comparison
+    total      wall seconds from spawning the process to its exit
+
+It also records whether NumPy, pandas or SciPy were loaded by the time
+the first request was answered; /patients should need none of them.
+
+The database only needs the schema, so an empty throwaway cluster works
+(see benchmarks/bench_api.py for the PostgreSQL requirements). Needs httpx.
+
+Usage:
+    python -m benchmarks.bench_startup [--runs 10] [--route /patients]
+        [--database-url URL] [--env DB_MODE=single] [--json startup.json]
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.bench_api import ADMIN_PASSWORD, _git_commit, throwaway_postgres
+
+HEAVY_MODULES = ("numpy", "pandas", "scipy")
+
+# Runs in the fresh interpreter; prints one JSON line.
+CHILD = """
+import json, re, sys, time
+started = time.perf_counter()
+from api.index import app
+imported = time.perf_counter()
+
+import asyncio
+import httpx
+
+async def main():
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        t = time.perf_counter()
+        first = await client.get(sys.argv[1])
+        first_seconds = time.perf_counter() - t
+        loaded = [m for m in {heavy!r} if m in sys.modules]
+        stages = dict(re.findall(r"([\\w-]+);dur=([0-9.]+)", first.headers.get("server-timing", "")))
+        t = time.perf_counter()
+        await client.get(sys.argv[1])
+        second_seconds = time.perf_counter() - t
+    print(json.dumps({{
+        "import": imported - started, "first": first_seconds, "second": second_seconds,
+        "connect": float(stages.get("connect", 0)) / 1000,
+        "status": first.status_code, "heavy_modules": loaded,
+    }}))
+
+asyncio.run(main())
+""".format(heavy=HEAVY_MODULES)
+
+
+def cold_start(env: dict, route: str) -> dict:
+    started = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-c", CHILD, route], env=env, capture_output=True, text=True)
+    total = time.perf_counter() - started
+    if proc.returncode != 0:
+        sys.exit(f"cold start failed:\n{proc.stderr[-4000:]}")
+    # The app logs each request to stderr; the result is the last stdout line.
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["total"] = total
+    return result
+
+
+def summarize(runs: list[dict]) -> dict:
+    out = {}
+    for field in ("import", "first", "connect", "second", "total"):
+        values = sorted(r[field] for r in runs)
+        out[f"{field}_p50_ms"] = statistics.median(values) * 1000
+        out[f"{field}_max_ms"] = values[-1] * 1000
+    out["status_counts"] = {str(s): sum(r["status"] == s for r in runs) for s in {r["status"] for r in runs}}
+    out["heavy_modules"] = sorted({m for r in runs for m in r["heavy_modules"]})
+    return out
+
+
+def run(args, database_url: str) -> dict:
+    env = {**os.environ, "DATABASE_URL": database_url, "ADMIN_PASSWORD": ADMIN_PASSWORD,
+           "ALLOWED_ORIGINS": "http://localhost", "PYTHONPATH": os.getcwd()}
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    subprocess.run([sys.executable, "-m", "app.create_schema"], env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+
+    routes = {}
+    for route in args.route or ["/patients"]:
+        routes[route] = summarize([cold_start(env, route) for _ in range(args.runs)])
+        r = routes[route]
+        print(f"{route:22} import {r['import_p50_ms']:7.1f}  first {r['first_p50_ms']:7.1f}  "
+              f"(connect {r['connect_p50_ms']:6.1f})  "
+              f"second {r['second_p50_ms']:6.1f}  total {r['total_p50_ms']:7.1f} ms (p50)  "
+              f"heavy: {', '.join(r['heavy_modules']) or 'none'}")
+    return {"runs": args.runs, "routes": routes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10, help="Fresh processes per route")
+    parser.add_argument("--route", action="append", metavar="PATH",
+                        help="Route (with query string) to request; default /patients")
+    parser.add_argument("--database-url", help="Use this database instead of a throwaway cluster")
+    parser.add_argument("--pg-bin", default=os.environ.get("PG_BIN"), help="Directory with initdb and pg_ctl")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="Extra app environment, e.g. COLUMNAR_ENGINE=true")
+    parser.add_argument("--json", help="Write results to this file as JSON")
+    args = parser.parse_args()
+
+    if args.database_url:
+        result = run(args, args.database_url)
+    else:
+        with throwaway_postgres(args.pg_bin) as database_url:
+            result = run(args, database_url)
+
+    result = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "app_env": args.env,
+        **result,
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
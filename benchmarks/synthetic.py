@@ -0,0 +1,216 @@
+"""Synthetic cone-mosaic CSVs in the AO instrument's multi-block layout.
+
+Writes one `<subject><R|L>.csv` per subject and eye, laid out exactly like
+the files in Cone_classification_data/: every block is eight columns
+
+    Cone x location (microns), Cone y location (microns), Cone spectral type,
+    Zernike Coeffs, Values, Parameter_Name, Values, <blank>
+
+with the same 24 Parameter_Name rows, so parse_csv_bytes, load_data.py and
+/admin/upload read them unchanged. The numbers follow the real data:
+
+    total density   65,000 cones/mm² at 0.6°, falling as ((e + 0.2) / 0.8)^-0.82
+                    (about 15,000 at 4.5° and 8,000 at 10°)
+    L/M ratio       per-subject log-normal around 2.1, +-0.2 between blocks
+    % S-cones       1 + 7 * (1 - exp(-e / 2.5)), i.e. ~2% near the fovea, ~8% at 10°
+    FOV             narrow strips (0.05-0.08 x 0.17-0.19 mm, turned for the
+                    vertical meridians) inside 1.2°, ~0.27 mm squares beyond
+    mosaic          jittered triangular lattice at the block's density;
+                    origin is the top-left corner of the FOV
+    magnification   ~12.1 microns/deg per mm of axial length
+
+--fov-scale multiplies each FOV's side, so cone counts grow with its square.
+--zernike fills each block's Zernike Coeffs/Values pair with labelled
+"Z(n,m)" coefficients up to 4th order (microns, 6 mm pupil); by default the
+pair is left empty like the bundled files.
+Output is deterministic for a given --seed.
+
+Usage:
+    python -m benchmarks.synthetic --subjects 1000 --out /tmp/synthetic
+        [--blocks 20] [--fov-scale 1.0] [--one-eye] [--zernike] [--seed 0] [--workers 4]
+"""
+import argparse
+import csv
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+MERIDIANS = ("Temporal", "Nasal", "Superior", "Inferior")
+NEAR_ECCENTRICITIES = (0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0, 1.1)
+FAR_ECCENTRICITIES = (1.5, 2.0, 2.5, 3.5, 4.0, 4.5, 5.0, 6.0, 10.0)
+BLOCK_HEADER = [
+    "Cone x location (microns)", "Cone y location (microns)", "Cone spectral type",
+    "Zernike Coeffs", "Values", "Parameter_Name", "Values", "",
+]
+PARAMETER_NAMES = [
+    "subject Id", "Age (years)", "Eye", "Axial length (mm)", "Meridian",
+    "Eccentricity (x,y) (deg)", "Eccentricity (x,y) (mm)",
+    "Retinal maginification factor (microns/deg)", "FOV (mm)", "L/M ratio", "% S-cones",
+    "L-cone density (cones per square mm)", "M-cone density (cones per square mm)",
+    "S-cone density (cones per square mm)", "Number of selected cones",
+    "Number of Not classified cones", "L-", "M-", "S-", "NC-",
+    "Cone location origin (0,0)", "Zernike Coeffs Pupil diameter (mm)",
+    "Zernike Coeffs measured wavelength (nm)", "Zernike Coeffs Optimized wavelength (nm)",
+]
+# (n, m) in OSA order through 4th radial order, and the coefficient spread per order (microns).
+ZERNIKE_TERMS = [(n, m) for n in range(5) for m in range(-n, n + 1, 2)]
+ZERNIKE_SD = {0: 0.0, 1: 0.0, 2: 0.15, 3: 0.06, 4: 0.03}
+
+
+def total_density(ecc_deg: float) -> float:
+    """Cones per mm² at `ecc_deg`, fitted to the bundled dataset."""
+    return 65000.0 * ((ecc_deg + 0.2) / 0.8) ** -0.82
+
+
+def s_cone_percent(ecc_deg: float) -> float:
+    return 1.0 + 7.0 * (1.0 - math.exp(-ecc_deg / 2.5))
+
+
+def _fmt(v: float) -> str:
+    return f"{v:.1f}".rstrip("0").rstrip(".") if v != int(v) else str(int(v))
+
+
+def mosaic(rng: np.random.Generator, density: float, width_mm: float, height_mm: float):
+    """Jittered triangular lattice covering the FOV; returns x, y in microns."""
+    spacing = math.sqrt(2.0 / (math.sqrt(3.0) * density)) * 1000.0
+    w, h = width_mm * 1000.0, height_mm * 1000.0
+    cols = np.arange(0.0, w + spacing, spacing)
+    rows = np.arange(0.0, h + spacing, spacing * math.sqrt(3.0) / 2.0)
+    gx, gy = np.meshgrid(cols, rows)
+    gx = gx + (np.arange(len(rows))[:, None] % 2) * spacing / 2.0
+    x = gx.ravel() + rng.normal(0.0, 0.12 * spacing, gx.size)
+    y = gy.ravel() + rng.normal(0.0, 0.12 * spacing, gx.size)
+    inside = (x > 0) & (x < w) & (y > 0) & (y < h)
+    order = np.lexsort((y[inside], x[inside]))
+    return np.round(x[inside][order], 1), np.round(y[inside][order], 1)
+
+
+def zernike(rng) -> tuple[list, list]:
+    """(labels, values) for one block's Zernike Coeffs/Values columns."""
+    labels = [f"Z({n},{m})" for n, m in ZERNIKE_TERMS]
+    values = [f"{rng.normal(0.0, ZERNIKE_SD[n]):.4f}" for n, _ in ZERNIKE_TERMS]
+    return labels, values
+
+
+def block(rng, subject: dict, eye: str, meridian: str, ecc: float, fov_scale: float) -> tuple[list, list]:
+    """Returns (cone columns x/y/type, parameter values) for one block."""
+    horizontal = meridian in ("Temporal", "Nasal")
+    if ecc < 1.2:
+        short, long_ = rng.uniform(0.05, 0.08), rng.uniform(0.17, 0.19)
+        width, height = (short, long_) if horizontal else (long_, short)
+    else:
+        width, height = rng.uniform(0.25, 0.29, 2)
+    width, height = width * fov_scale, height * fov_scale
+
+    density = total_density(ecc) * rng.normal(1.0, 0.08)
+    x, y = mosaic(rng, density, width, height)
+    n = len(x)
+
+    lm = subject["lm_ratio"] * math.exp(rng.normal(0.0, 0.1))
+    p_s = s_cone_percent(ecc) * rng.normal(1.0, 0.15) / 100.0
+    p_nc = rng.choice((0.0, 0.0, 0.002, 0.01))
+    p_l = (1.0 - p_s - p_nc) * lm / (1.0 + lm)
+    types = rng.choice(np.array(["L", "M", "S", "NC"]), size=n, p=[p_l, 1.0 - p_l - p_s - p_nc, p_s, p_nc])
+
+    counts = {t: int((types == t).sum()) for t in ("L", "M", "S", "NC")}
+    classified = n - counts["NC"]
+    area = width * height
+    ecc_mm = ecc * subject["rmf"] / 1000.0
+    ecc_xy = f"({_fmt(ecc)},0)" if horizontal else f"(0,{_fmt(ecc)})"
+    ecc_mm_xy = f"({ecc_mm:.2f},0)" if horizontal else f"(0,{ecc_mm:.2f})"
+    values = [
+        subject["id"], str(subject["age"]), eye, f"{subject['axial_length']:.1f}", meridian,
+        ecc_xy, ecc_mm_xy, f"{subject['rmf']:.1f}", f"{width:.2f} x {height:.2f}",
+        f"{counts['L'] / max(counts['M'], 1):.1f}",
+        f"{100.0 * counts['S'] / max(classified, 1):.1f}",
+        f"{counts['L'] / area:.1f}", f"{counts['M'] / area:.1f}", f"{counts['S'] / area:.1f}",
+        str(n), str(counts["NC"]),
+        "Long wavelength cones", "Middle wavelength cones", "Short wavelength cones", "Not classified",
+        "Top-left corner of FOV", "6", "900", "550",
+    ]
+    return [[_fmt(v) for v in x], [_fmt(v) for v in y], types.tolist()], values
+
+
+def plan_blocks(rng, n_blocks: int) -> list[tuple[str, float]]:
+    """(meridian, eccentricity) pairs: mostly near-foveal strips, a few far squares."""
+    plan = []
+    for i in range(n_blocks):
+        meridian = MERIDIANS[i % len(MERIDIANS)]
+        pool = NEAR_ECCENTRICITIES if rng.random() < 0.6 else FAR_ECCENTRICITIES
+        plan.append((meridian, float(rng.choice(pool))))
+    return sorted(set(plan), key=lambda b: (MERIDIANS.index(b[0]), b[1]))
+
+
+def write_subject(index: int, out_dir: str, n_blocks: int, fov_scale: float,
+                  both_eyes: bool, seed: int, with_zernike: bool = False) -> list[tuple[str, int]]:
+    rng = np.random.default_rng([seed, index])
+    axial_length = float(np.clip(rng.normal(24.0, 1.0), 21.5, 27.0))
+    subject = {
+        "id": f"SYN{index:05d}",
+        "age": int(rng.integers(18, 75)),
+        "axial_length": axial_length,
+        "rmf": 12.08 * axial_length,
+        "lm_ratio": float(np.exp(rng.normal(math.log(2.1), 0.25))),
+    }
+    written = []
+    for eye, suffix in (("OD", "R"), ("OS", "L"))[: 2 if both_eyes else 1]:
+        blocks = [block(rng, subject, eye, m, e, fov_scale) for m, e in plan_blocks(rng, n_blocks)]
+        n_rows = max(len(PARAMETER_NAMES), *(len(cones[0]) for cones, _ in blocks))
+
+        columns: list[list[str]] = []
+        for cones, values in blocks:
+            for col in cones:
+                columns.append(col + [""] * (n_rows - len(col)))
+            if with_zernike:
+                for col in zernike(rng):
+                    columns.append(col + [""] * (n_rows - len(col)))
+            else:
+                columns.append([""] * n_rows)  # Zernike Coeffs
+                columns.append([""] * n_rows)  # Values
+            columns.append(PARAMETER_NAMES + [""] * (n_rows - len(PARAMETER_NAMES)))
+            columns.append(values + [""] * (n_rows - len(values)))
+            columns.append([""] * n_rows)
+        header = BLOCK_HEADER * len(blocks)
+        # Like the instrument export, the last block has no trailing blank column.
+        header, columns = header[:-1], columns[:-1]
+
+        path = os.path.join(out_dir, f"{subject['id']}{suffix}.csv")
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(zip(*columns))
+        written.append((path, sum(len(cones[0]) for cones, _ in blocks)))
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--subjects", type=int, default=100)
+    parser.add_argument("--blocks", type=int, default=20, help="Blocks per eye (duplicates are dropped)")
+    parser.add_argument("--fov-scale", type=float, default=1.0, help="Multiply each FOV side by this")
+    parser.add_argument("--one-eye", action="store_true", help="Write only OD files")
+    parser.add_argument("--zernike", action="store_true", help="Fill in Zernike coefficient tables")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--out", required=True)
+    args = parser.parse_args()
+    os.makedirs(args.out, exist_ok=True)
+
+    files = cones = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = [
+            pool.submit(write_subject, i + 1, args.out, args.blocks, args.fov_scale,
+                        not args.one_eye, args.seed, args.zernike)
+            for i in range(args.subjects)
+        ]
+        for future in futures:
+            for _, n in future.result():
+                files += 1
+                cones += n
+    print(f"Wrote {files} files, {cones} cones to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 # Save this as reformat_AO.py and run with: python reformat_AO.py
 import pandas as pd, numpy as np, math, re
+from app.zernike import parse_coefficients   # run from the repo root
 
 ao_path = "AO001R_v1.csv"            # <- change to your path if needed
 sample_path = "sampleAO001fix.csv"   # <- path to sample fix for column ordering
@@ -14,16 +15,14 @@ cols = ao.columns.tolist()
 param_cols = [c for c in cols if c.startswith("Parameter_Name")]
 values_cols = [c for c in cols if c.startswith("Values")]
 
-# find Values.* columns that actually contain metadata (non-empty)
-nonempty_values = [v for v in values_cols if ao[v].dropna().shape[0] > 0]
-
-# map each Parameter_Name.* column to the nearest non-empty Values.* column
+# each block is ..., Zernike Coeffs, Values, Parameter_Name, Values:
+# map each label column to the Values.* column right after it
 col_index = {c: i for i, c in enumerate(cols)}
-param_to_values = {}
-for p in param_cols:
-    pidx = col_index[p]
-    best = min(nonempty_values, key=lambda v: abs(col_index[v] - pidx))
-    param_to_values[p] = best
+def values_after(col):
+    j = col_index.get(col, len(cols)) + 1
+    return cols[j] if j < len(cols) and cols[j] in values_cols else None
+
+param_to_values = {p: values_after(p) for p in param_cols}
 
 # helper to parse tuple strings like "(0.4,0)"
 def parse_tuple(s):
@@ -162,6 +161,14 @@ while True:
             else:
                 metadata[pname_str] = val_str
 
+    # Zernike table -> "c0;c1;..." in OSA/ANSI order (see app/zernike.py)
+    zernike_col = f"Zernike Coeffs{suffix}"
+    zernike_values = values_after(zernike_col)
+    if zernike_values is not None:
+        coeffs = parse_coefficients(ao[zernike_col].tolist(), ao[zernike_values].tolist())
+        if coeffs:
+            metadata["zernike_coeffs"] = ";".join(repr(c) for c in coeffs)
+
     for k, v in metadata.items():
         block_cones[k] = v
 
@@ -8,11 +8,15 @@ import math
 import os
 import re
 import glob
+import time
 
 import asyncpg
 import numpy as np
 import pandas as pd
 
+from app import cohort, overlap, retina
+from app.zernike import parse_coefficients
+
 
 DATA_DIR = "Cone_classification_data"
 COLS = [
@@ -23,6 +27,11 @@ COLS = [
     "cone_origin", "zernike_pupil_diam", "zernike_measure_wave", "zernike_optim_wave",
 ]
 
+BLOCK_OPTICS_INSERT = """INSERT INTO block_optics (
+    subject_id, eye, meridian, eccentricity_deg,
+    zernike_pupil_diam, zernike_measure_wave, zernike_optim_wave, zernike_coeffs
+) VALUES ($1,$2,$3,$4,$5,$6,$7,$8)"""
+
 
 def parse_tuple(s):
     if pd.isna(s):
@@ -57,20 +66,14 @@ def parse_csv(path: str) -> pd.DataFrame:
     ao = pd.read_csv(path, encoding="utf-8-sig")
     cols = ao.columns.tolist()
 
-    param_cols = [c for c in cols if c.startswith("Parameter_Name")]
-    values_cols = [c for c in cols if c.startswith("Values")]
-    nonempty_values = [v for v in values_cols if ao[v].dropna().shape[0] > 0]
-    col_index = {c: i for i, c in enumerate(cols)}
-
-    param_to_values = {}
-    for p in param_cols:
-        if not nonempty_values:
-            continue
-        pidx = col_index[p]
-        best = min(nonempty_values, key=lambda v: abs(col_index[v] - pidx))
-        param_to_values[p] = best
+    # Each block is laid out as ..., Zernike Coeffs, Values, Parameter_Name, Values:
+    # every label column is read with the Values column right after it.
+    def values_after(col):
+        j = cols.index(col) + 1 if col in cols else len(cols)
+        return cols[j] if j < len(cols) and cols[j].startswith("Values") else None
 
     all_dfs = []
+    block_optics = []
     i = 0
     while True:
         suffix = "" if i == 0 else f".{i}"
@@ -88,7 +91,7 @@ def parse_csv(path: str) -> pd.DataFrame:
             continue
 
         param_col = "Parameter_Name" if i == 0 else f"Parameter_Name.{i}"
-        values_col = param_to_values.get(param_col)
+        values_col = values_after(param_col)
         metadata = {}
 
         if values_col:
@@ -111,9 +114,11 @@ def parse_csv(path: str) -> pd.DataFrame:
                 elif "eccentricity (x,y) (deg)" in pl:
                     x, y = parse_tuple(v)
                     metadata["eccentricity_deg"] = safe_float(math.hypot(x, y)) if not (math.isnan(x) or math.isnan(y)) else None
+                    metadata["eccentricity_x_deg"], metadata["eccentricity_y_deg"] = safe_float(x), safe_float(y)
                 elif "eccentricity (x,y) (mm)" in pl:
                     x, y = parse_tuple(v)
                     metadata["eccentricity_mm"] = safe_float(math.hypot(x, y)) if not (math.isnan(x) or math.isnan(y)) else None
+                    metadata["eccentricity_x_mm"], metadata["eccentricity_y_mm"] = safe_float(x), safe_float(y)
                 elif "retinal ma" in pl:
                     metadata["ret_mag_factor"] = safe_float(v)
                 elif pl.startswith("fov"):
@@ -141,6 +146,22 @@ def parse_csv(path: str) -> pd.DataFrame:
                 elif "zernike coeffs optimized wavelength" in pl:
                     metadata["zernike_optim_wave"] = safe_float(v)
 
+        zernike_col = f"Zernike Coeffs{suffix}"
+        zernike_values = values_after(zernike_col)
+        if zernike_values:
+            coeffs = parse_coefficients(ao[zernike_col].tolist(), ao[zernike_values].tolist())
+            if coeffs:
+                block_optics.append((
+                    str(metadata.get("subject_id") or "UNKNOWN"),
+                    metadata.get("eye") or None,
+                    metadata.get("meridian") or None,
+                    metadata.get("eccentricity_deg"),
+                    metadata.get("zernike_pupil_diam"),
+                    metadata.get("zernike_measure_wave"),
+                    metadata.get("zernike_optim_wave"),
+                    coeffs,
+                ))
+
         for k, val in metadata.items():
             block[k] = val
 
@@ -151,7 +172,13 @@ def parse_csv(path: str) -> pd.DataFrame:
         print(f"  WARNING: no cone blocks found in {path}")
         return pd.DataFrame()
 
-    return pd.concat(all_dfs, ignore_index=True)
+    df = pd.concat(all_dfs, ignore_index=True)
+    # Signed eccentricity components and montage coordinates (see app/retina.py).
+    retina.add_columns(df)
+    df.attrs["blocks_parsed"] = len(all_dfs)
+    # One row per block with Zernike coefficients, in block_optics column order.
+    df.attrs["block_optics"] = block_optics
+    return df
 
 
 def to_row(r) -> tuple:
@@ -184,6 +211,12 @@ def to_row(r) -> tuple:
         safe_float(f("zernike_pupil_diam")),
         safe_float(f("zernike_measure_wave")),
         safe_float(f("zernike_optim_wave")),
+        safe_float(f("eccentricity_x_deg")),
+        safe_float(f("eccentricity_y_deg")),
+        safe_float(f("eccentricity_x_mm")),
+        safe_float(f("eccentricity_y_mm")),
+        safe_float(f("retinal_x_mm")),
+        safe_float(f("retinal_y_mm")),
     )
 
 
@@ -205,24 +238,71 @@ async def main():
         for path in csv_files:
             name = os.path.basename(path)
             print(f"  Parsing {name}...", end=" ", flush=True)
+            started = time.perf_counter()
             df = parse_csv(path)
+            parse_seconds = time.perf_counter() - started
             if df.empty:
                 print("skipped (empty)")
                 continue
 
+            started = time.perf_counter()
             rows = [to_row(r) for _, r in df.iterrows()]
+            convert_seconds = time.perf_counter() - started
+
+            started = time.perf_counter()
             await conn.executemany(
                 """INSERT INTO cone_data (
                     cone_x_microns, cone_y_microns, cone_spectral_type,
                     subject_id, eye, meridian, eccentricity_deg, eccentricity_mm,
                     lm_ratio, scones, lcone_density, mcone_density, scone_density,
                     numcones, nonclass_cones, age, fov, ret_mag_factor,
-                    cone_origin, zernike_pupil_diam, zernike_measure_wave, zernike_optim_wave
-                ) VALUES ($1,$2,$3,$4,$5,$6,$7,$8,$9,$10,$11,$12,$13,$14,$15,$16,$17,$18,$19,$20,$21,$22)""",
+                    cone_origin, zernike_pupil_diam, zernike_measure_wave, zernike_optim_wave,
+                    eccentricity_x_deg, eccentricity_y_deg, eccentricity_x_mm, eccentricity_y_mm,
+                    retinal_x_mm, retinal_y_mm
+                ) VALUES ($1,$2,$3,$4,$5,$6,$7,$8,$9,$10,$11,$12,$13,$14,$15,$16,$17,$18,$19,$20,$21,$22,
+                          $23,$24,$25,$26,$27,$28)""",
                 rows,
             )
+            if df.attrs.get("block_optics"):
+                await conn.executemany(BLOCK_OPTICS_INSERT, df.attrs["block_optics"])
+            insert_seconds = time.perf_counter() - started
+
+            started = time.perf_counter()
+            # Bulk load appends, so only the new blocks' share is added to the cohort sums.
+            await cohort.apply(conn, cohort.deltas(cohort.blocks_from_rows(rows)))
+            pairs = sorted({(r[3], r[4]) for r in rows if r[3] and r[4]})
+            await overlap.refresh(conn, [p[0] for p in pairs], [p[1] for p in pairs])
+            derive_seconds = time.perf_counter() - started
+
+            # Same per-stage columns as an admin upload; there is no delete step here.
+            total_seconds = parse_seconds + convert_seconds + insert_seconds
+            subjects = sorted(df["subject_id"].dropna().unique().tolist()) if "subject_id" in df.columns else []
+            eyes = sorted(df["eye"].dropna().unique().tolist()) if "eye" in df.columns else []
+            await conn.execute(
+                """INSERT INTO upload_log
+                   (subject_id, eye, event_type, commit_message, rows_ingested, uploaded_by,
+                    bytes_ingested, blocks_parsed, parse_ms, convert_ms, delete_ms, insert_ms,
+                    rows_per_second, derive_ms)
+                   VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14)""",
+                subjects[0] if subjects else None,
+                eyes[0] if eyes else None,
+                "bulk_load",
+                name,
+                len(rows),
+                "load_data.py",
+                os.path.getsize(path),
+                df.attrs.get("blocks_parsed", 0),
+                parse_seconds * 1000,
+                convert_seconds * 1000,
+                None,
+                insert_seconds * 1000,
+                len(rows) / total_seconds if total_seconds > 0 else None,
+                derive_seconds * 1000,
+            )
             total += len(rows)
-            print(f"{len(rows)} rows inserted")
+            print(f"{len(rows)} rows inserted "
+                  f"(parse {parse_seconds:.2f}s, convert {convert_seconds:.2f}s, insert {insert_seconds:.2f}s, "
+                  f"derive {derive_seconds:.2f}s)")
 
         count = await conn.fetchval("SELECT COUNT(*) FROM cone_data")
         print(f"\nDone — {total} rows inserted, {count} total rows in cone_data")
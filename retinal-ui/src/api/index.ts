@@ -3,8 +3,86 @@ import type { PlotData, Patient } from '../types/index';
 
 
 const API_BASE = import.meta.env.VITE_API_URL ?? "http://127.0.0.1:8001";
+// Optional CDN copy of the read-only data (python -m app.artifacts). Anything
+// missing from its manifest, e.g. a subject uploaded since, falls back to the API.
+const STATIC_BASE: string | undefined = import.meta.env.VITE_STATIC_URL;
+
+interface StaticEntry {
+  ranges: string;
+  blocks: Array<{ min: number; max: number; label: string; file: string }>;
+}
+
+interface StaticManifest {
+  version: number;
+  patients: string;
+  // subject -> eye ("*" = any eye) -> meridian
+  subjects: Record<string, Record<string, Record<string, StaticEntry>>>;
+}
+
+interface StaticBlock {
+  plot: PlotData;
+  metadata: Record<string, any>;
+  type_counts: Record<string, number>;
+}
+
+// The manifest changes with every export; re-read it at most this often.
+const MANIFEST_TTL_MS = 60_000;
+
+let manifest: Promise<StaticManifest | null> | undefined;
+let manifestFetchedAt = 0;
+const staticFiles = new Map<string, Promise<any>>();
+
+function getManifest(): Promise<StaticManifest | null> {
+  if (!STATIC_BASE) return Promise.resolve(null);
+  if (!manifest || Date.now() - manifestFetchedAt > MANIFEST_TTL_MS) {
+    manifestFetchedAt = Date.now();
+    manifest = fetch(`${STATIC_BASE}/manifest.json`, { cache: "no-cache" })
+      .then((res) => (res.ok ? res.json() : null))
+      .catch(() => null);
+  }
+  return manifest;
+}
+
+// Hashed files never change, so each is fetched at most once per page load.
+// A failed fetch is forgotten so the next call retries; until then callers use the API.
+function getStaticFile<T>(path: string): Promise<T | null> {
+  let file = staticFiles.get(path);
+  if (!file) {
+    file = fetch(`${STATIC_BASE}/${path}`)
+      .then((res) => {
+        if (!res.ok) throw new Error(`HTTP error! status: ${res.status}`);
+        return res.json();
+      })
+      .catch(() => {
+        staticFiles.delete(path);
+        return null;
+      });
+    staticFiles.set(path, file);
+  }
+  return file;
+}
+
+async function getStaticEntry(subjectId: string, meridian: string, eye?: string): Promise<StaticEntry | undefined> {
+  const m = await getManifest();
+  return m?.subjects[subjectId]?.[eye ? eye.toUpperCase() : "*"]?.[meridian.toLowerCase()];
+}
+
+async function getStaticBlock(
+  subjectId: string,
+  meridian: string,
+  eye?: string,
+  eccentricityMin?: number,
+  eccentricityMax?: number
+): Promise<StaticBlock | null> {
+  const entry = await getStaticEntry(subjectId, meridian, eye);
+  const block = entry?.blocks.find((b) => b.min === eccentricityMin && b.max === eccentricityMax);
+  return block ? getStaticFile<StaticBlock>(block.file) : null;
+}
 
 export async function getPatients(): Promise<Patient[]> {
+  const m = await getManifest();
+  const patients = m && (await getStaticFile<Patient[]>(m.patients));
+  if (patients) return patients;
   try {
     const res = await fetch(`${API_BASE}/patients`);
     if (!res.ok) {
@@ -28,6 +106,22 @@ export async function getMetadata(
   eccentricityMax?: number,
   eye?: string
 ): Promise<Record<string, any>> {
+  const block = await getStaticBlock(subjectId, meridian, eye, eccentricityMin, eccentricityMax);
+  if (block) {
+    // The file counts every type; total the selected ones like the API's type filter.
+    const selected = coneTypes && coneTypes.length > 0 ? coneTypes : Object.keys(block.type_counts);
+    const count = (type: string) => (selected.includes(type) ? block.type_counts[type] ?? 0 : 0);
+    const total = selected.reduce((sum, type) => sum + (block.type_counts[type] ?? 0), 0);
+    if (total === 0) return {};
+    return {
+      ...block.metadata,
+      filtered_total_cones: total,
+      filtered_l_cones: count("L"),
+      filtered_m_cones: count("M"),
+      filtered_s_cones: count("S"),
+    };
+  }
+
   const params = new URLSearchParams();
   params.append("subject_id", subjectId);
   params.append("meridian", meridian);
@@ -54,6 +148,19 @@ export async function getPlotData(filters: {
   eccentricityMax?: number;
   eye?: string;
 }): Promise<PlotData> {
+  const block = await getStaticBlock(
+    filters.subjectId, filters.meridian, filters.eye, filters.eccentricityMin, filters.eccentricityMax
+  );
+  if (block) {
+    // Cones are sorted by x as from the API; filter, then apply the same 50000 limit.
+    const { x, y, cone_type } = block.plot;
+    const keep: number[] = [];
+    for (let i = 0; i < cone_type.length && keep.length < 50000; i++) {
+      if (filters.coneTypes.length === 0 || filters.coneTypes.includes(cone_type[i])) keep.push(i);
+    }
+    return { x: keep.map((i) => x[i]), y: keep.map((i) => y[i]), cone_type: keep.map((i) => cone_type[i]) };
+  }
+
   const params = new URLSearchParams();
   params.append("subject_id", filters.subjectId);
   params.append("meridian", filters.meridian);
@@ -86,6 +193,16 @@ export interface UploadLogEntry {
   commit_message: string | null;
   rows_ingested: number;
   uploaded_by: string | null;
+  // Ingest timings; null for entries logged before they were recorded.
+  bytes_ingested: number | null;
+  blocks_parsed: number | null;
+  parse_ms: number | null;
+  convert_ms: number | null;
+  delete_ms: number | null;
+  insert_ms: number | null;
+  rows_per_second: number | null;
+  // Cohort and overlap upkeep after the insert.
+  derive_ms: number | null;
 }
 
 export async function getUploadLog(): Promise<UploadLogEntry[]> {
@@ -97,6 +214,12 @@ export async function getUploadLog(): Promise<UploadLogEntry[]> {
 }
 
 export async function getEccentricityRanges(subjectId: string, meridian: string, eye?: string): Promise<{ ranges: Array<{ min: number; max: number; label: string }> }> {
+  const entry = await getStaticEntry(subjectId, meridian, eye);
+  const ranges = entry && (await getStaticFile<{ ranges: Array<{ min: number; max: number; label: string }> }>(
+    entry.ranges
+  ));
+  if (ranges) return ranges;
+
   const params = new URLSearchParams();
   params.append("subject_id", subjectId);
   params.append("meridian", meridian);
@@ -122,10 +245,31 @@ export async function adminLogin(password: string): Promise<string> {
   return data.token as string;
 }
 
+export interface QualityBlock {
+  block: number;
+  subject_id: string | null;
+  eye: string | null;
+  meridian: string | null;
+  eccentricity_deg: number | null;
+  cones: number;
+  duplicate_coordinates: number;
+  outside_fov: number | null;
+  missing_metadata: string[];
+  issues: string[];
+}
+
+export interface QualityReport {
+  ok: boolean;
+  blocks_checked: number;
+  blocks_with_issues: number;
+  issue_counts: Record<string, number>;
+  blocks: QualityBlock[];
+}
+
 export async function adminValidateCSV(
   token: string,
   file: File
-): Promise<{ valid: boolean; row_count: number; subjects: string[]; meridians: string[]; cone_types: string[]; filename: string }> {
+): Promise<{ valid: boolean; row_count: number; subjects: string[]; meridians: string[]; cone_types: string[]; filename: string; quality: QualityReport }> {
   const formData = new FormData();
   formData.append("file", file);
 
@@ -163,6 +307,8 @@ export async function adminUploadCSV(
     const err = await res.json().catch(() => ({ detail: "Upload failed" }));
     throw new Error(err.detail || "Upload failed");
   }
+  // The upload re-exports its subjects in the background; don't wait out the TTL for them.
+  manifest = undefined;
   return res.json();
 }
 
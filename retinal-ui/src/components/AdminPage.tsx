@@ -1,5 +1,6 @@
 import React, { useState, useRef, useCallback } from "react";
 import { adminLogin, adminValidateCSV, adminUploadCSV } from "../api";
+import type { QualityReport } from "../api";
 
 type Stage = "login" | "upload" | "preview" | "done";
 
@@ -9,6 +10,7 @@ interface ValidationResult {
   subjects: string[];
   meridians: string[];
   cone_types: string[];
+  quality: QualityReport;
 }
 
 interface UploadResult {
@@ -370,8 +372,33 @@ export const AdminPage: React.FC<Props> = ({ onBack }) => {
               <Row label="Subjects" value={validation.subjects.join(", ") || "—"} />
               <Row label="Meridians" value={validation.meridians.join(", ") || "—"} />
               <Row label="Cone types" value={validation.cone_types.join(", ") || "—"} />
+              <Row
+                label="Data quality"
+                value={validation.quality.ok
+                  ? `No issues in ${validation.quality.blocks_checked} blocks`
+                  : `${validation.quality.blocks_with_issues} of ${validation.quality.blocks_checked} blocks have issues`}
+              />
             </div>
 
+            {!validation.quality.ok && (
+              <div style={{
+                padding: "0.6rem 0.75rem",
+                borderRadius: "var(--radius)",
+                backgroundColor: "#fef3c7",
+                color: "#92400e",
+                fontSize: "0.8rem",
+                display: "flex",
+                flexDirection: "column",
+                gap: "0.25rem",
+              }}>
+                {validation.quality.blocks.filter((b) => b.issues.length > 0).map((b) => (
+                  <div key={b.block}>
+                    Block {b.block + 1} ({b.meridian ?? "?"}, {b.eccentricity_deg ?? "?"}°): {b.issues.join(", ").replace(/_/g, " ")}
+                  </div>
+                ))}
+              </div>
+            )}
+
             {uploadError && (
               <div style={{
                 padding: "0.6rem 0.75rem",